@@ -0,0 +1,389 @@
+"""
+Benchmark / load test for the invoice pipeline.
+
+Generates synthetic invoices (varying line counts, a share that fails matching,
+a share of the failures that go through CLARIFY before being accepted) and measures:
+  - in-process graph throughput and start/resume latency percentiles
+  - per-stage latency (from each thread's audit_log)
+  - checkpoint write cost (timings and bytes per invoice)
+  - MCP tool call latency
+  - end-to-end HTTP latency percentiles under concurrency (uvicorn in-process)
+
+Runs in a scratch directory so the real checkpoints.db is never touched. MCP calls
+go to the in-process mock, or to mcp_server.py over HTTP/stdio (--mcp).
+
+    python benchmark.py --invoices 200 --concurrency 16 --mcp http --latency-ms 5 --output bench.json
+    python benchmark.py --baseline bench.json   # exit code 1 on regression
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+VENDORS = ["Acme Corp", "Globex Inc", "Initech LLC", "Umbrella plc", "Stark Industries"]
+# What the mock normalize_vendor returns for every vendor
+MOCK_TAX_ID = "MOCK-TAX-ID-123"
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": rank(50), "p95": rank(95), "p99": rank(99),
+        "max": round(ordered[-1], 3)
+    }
+
+
+def synthetic_invoices(count: int, prefix: str, args, rng: random.Random) -> List[Dict[str, Any]]:
+    """Invoices plus the PO each should be matched against (`_po`) and the review path (`_plan`)."""
+    invoices = []
+    for i in range(count):
+        lines = []
+        for n in range(rng.randint(1, args.max_lines)):
+            qty, price = rng.randint(1, 20), round(rng.uniform(5, 500), 2)
+            lines.append({"desc": f"Item {n}", "qty": qty, "unit_price": price, "total": round(qty * price, 2)})
+        amount = round(sum(line["total"] for line in lines), 2)
+        invoice_id = f"{prefix}-{i:06d}"
+
+        fails = rng.random() < args.fail_ratio
+        # A failing invoice was billed ~20% above the PO prices
+        po_lines = [{**line, "unit_price": round(line["unit_price"] / 1.2, 2), "total": round(line["total"] / 1.2, 2)} for line in lines] if fails else lines
+        plan = ["ACCEPT"]
+        if fails and rng.random() < args.clarify_ratio:
+            plan = ["CLARIFY"] * rng.randint(1, args.max_clarify_loops) + ["ACCEPT"]
+
+        invoices.append({
+            "invoice_id": invoice_id,
+            "vendor_name": rng.choice(VENDORS),
+            "invoice_date": (datetime.date(2024, 1, 1) + datetime.timedelta(days=rng.randint(0, 364))).isoformat(),
+            "amount": amount,
+            "currency": "USD",
+            "line_items": lines,
+            "_po": {
+                "po_number": f"PO-{invoice_id}", "vendor_tax_id": MOCK_TAX_ID, "status": "OPEN",
+                "amount": round(sum(line["total"] for line in po_lines), 2), "lines": po_lines
+            },
+            "_plan": plan if fails else []
+        })
+    return invoices
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 15.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def start_mcp_server(args) -> Optional[subprocess.Popen]:
+    """Point the MCP clients at a local stand-in server (unless --mcp mock)."""
+    from mcp_client import build_transport, common_client, atlas_client
+
+    server_script = os.path.join(REPO_DIR, "mcp_server.py")
+    process = None
+    if args.mcp == "http":
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, server_script, "--port", str(port), "--latency-ms", str(args.latency_ms)],
+            cwd=os.getcwd()
+        )
+        wait_for_port(port)
+        server_config = {"transport": "http", "url": f"http://127.0.0.1:{port}/mcp", "max_connections": args.concurrency * 4}
+    elif args.mcp == "stdio":
+        server_config = {
+            "transport": "stdio", "pool_size": args.concurrency,
+            "command": [sys.executable, server_script, "--stdio", "--latency-ms", str(args.latency_ms)]
+        }
+    else:
+        return None
+
+    for client in (common_client, atlas_client):
+        client.transport.close()
+        client.transport = build_transport(server_config)
+    return process
+
+
+def seed_purchase_orders(invoices: List[Dict[str, Any]]) -> None:
+    # The ERP side of each synthetic invoice lives in the local PO replica
+    from po_store import po_store
+    po_store.upsert([invoice["_po"] for invoice in invoices], [])
+
+
+def payload_of(invoice: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in invoice.items() if not key.startswith("_")}
+
+
+def run_in_process(invoices: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    import runner
+    from graph import app
+    from review_queue import review_queue
+    from timers import timer_store
+
+    start_ms: List[float] = []
+    resume_ms: List[float] = []
+    outcomes: Dict[str, int] = {}
+    thread_ids: List[str] = []
+    lock = threading.Lock()
+
+    def process(invoice: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        outcome = runner.run_start(runner.new_initial_state(payload_of(invoice)))
+        elapsed = (time.perf_counter() - started) * 1000
+        checkpoint_id = outcome.get("checkpoint_id")
+        plan = invoice["_plan"] if outcome["status"] == "PAUSED" else []
+        local_resume = []
+        for decision in plan:
+            review = review_queue.claim(checkpoint_id, decision, "benchmark")
+            started = time.perf_counter()
+            result = runner.run_resume(review, decision, "benchmark")
+            local_resume.append((time.perf_counter() - started) * 1000)
+            if result["status"] == "WAITING":
+                # The vendor replies at once; the thread is woken inline instead of by the timer scheduler
+                reply = {"message": "benchmark reply"}
+                timer_store.reply(result["correlation_key"], reply)
+                timer_store.claim(outcome["thread_id"], lease_seconds=300)
+                runner.run_wake(outcome["thread_id"], "reply", reply)
+                snapshot = app.get_state({"configurable": {"thread_id": outcome["thread_id"]}})
+                checkpoint_id = snapshot.values["CHECKPOINT_HITL"]["checkpoint_id"]
+        final = "RESUMED" if plan else outcome["status"]
+        with lock:
+            start_ms.append(elapsed)
+            resume_ms.extend(local_resume)
+            outcomes[final] = outcomes.get(final, 0) + 1
+            thread_ids.append(outcome["thread_id"])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(process, invoices))
+    wall = time.perf_counter() - started
+
+    stage_ms: Dict[str, List[float]] = {}
+    for thread_id in thread_ids:
+        values = app.get_state({"configurable": {"thread_id": thread_id}}).values
+        for entry in values.get("audit_log", []):
+            stage_ms.setdefault(entry["stage"], []).append(entry["duration_ms"])
+
+    return {
+        "invoices": len(invoices),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(len(invoices) / wall, 2),
+        "outcomes": outcomes,
+        "start_latency_ms": percentiles(start_ms),
+        "resume_latency_ms": percentiles(resume_ms),
+        "stages_ms": {stage: percentiles(values) for stage, values in stage_ms.items()},
+    }
+
+
+def checkpoint_cost(invoice_count: int) -> Dict[str, Any]:
+    from db import local_db_path
+    from metrics import CHECKPOINT_WRITE
+
+    report = {}
+    for (operation,), (count, total) in CHECKPOINT_WRITE.totals().items():
+        report[operation] = {"count": count, "mean_ms": round(total / count * 1000, 3) if count else None}
+    conn = sqlite3.connect(local_db_path())
+    try:
+        checkpoint_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints").fetchone()[0]
+        write_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+    finally:
+        conn.close()
+    report["bytes_per_invoice"] = round((checkpoint_bytes + write_bytes) / max(invoice_count, 1))
+    return report
+
+
+def tool_latency() -> Dict[str, Any]:
+    from metrics import TOOL_DURATION
+    report = {}
+    for (server, tool, outcome), (count, total) in TOOL_DURATION.totals().items():
+        report[f"{server}.{tool}.{outcome}"] = {"calls": count, "mean_ms": round(total / count * 1000, 3) if count else None}
+    return report
+
+
+def run_http(invoices: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    import httpx
+    import uvicorn
+    import main
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.api, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    wait_for_port(port)
+
+    start_ms: List[float] = []
+    decision_ms: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    base_url = f"http://127.0.0.1:{port}"
+    client = httpx.Client(base_url=base_url, timeout=60.0, limits=httpx.Limits(max_connections=concurrency * 2))
+
+    def process(invoice: Dict[str, Any]) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        response = client.post("/workflow/start", json=payload_of(invoice))
+        elapsed = (time.perf_counter() - started) * 1000
+        local_decisions = []
+        ok = response.status_code == 200
+        if ok and invoice["_plan"] and response.json().get("status") == "PAUSED":
+            thread_id = response.json()["thread_id"]
+            checkpoint_id = response.json().get("checkpoint_id")
+            for decision in invoice["_plan"]:
+                started = time.perf_counter()
+                result = client.post("/human-review/decision", json={
+                    "checkpoint_id": checkpoint_id, "decision": decision, "reviewer_id": "benchmark"
+                })
+                local_decisions.append((time.perf_counter() - started) * 1000)
+                ok = ok and result.status_code == 200
+                if ok and result.json().get("status") == "WAITING":
+                    # The vendor replies at once; the API's timer scheduler wakes the thread for review
+                    client.post("/clarification/reply", json={
+                        "correlation_key": result.json()["correlation_key"], "message": "benchmark reply"
+                    })
+                    status = client.get(f"/workflow/{thread_id}").json()
+                    while status.get("status") != "PAUSED" or "HITL_DECISION" not in status.get("next", []):
+                        time.sleep(0.01)
+                        status = client.get(f"/workflow/{thread_id}").json()
+                    checkpoint_id = status.get("checkpoint_id")
+        with lock:
+            start_ms.append(elapsed)
+            decision_ms.extend(local_decisions)
+            errors += 0 if ok else 1
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(process, invoices))
+        wall = time.perf_counter() - started
+    finally:
+        client.close()
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    return {
+        "invoices": len(invoices),
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(len(invoices) / wall, 2),
+        "errors": errors,
+        "start_latency_ms": percentiles(start_ms),
+        "decision_latency_ms": percentiles(decision_ms),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression_pct: float) -> List[str]:
+    """Regressions beyond the allowed percentage: throughput down or p95 latency up."""
+    regressions = []
+    limit = max_regression_pct / 100
+    for section in ("in_process", "http"):
+        current, previous = results.get(section), baseline.get(section)
+        if not current or not previous:
+            continue
+        if current["throughput_per_second"] < previous["throughput_per_second"] * (1 - limit):
+            regressions.append(f"{section}.throughput_per_second {previous['throughput_per_second']} -> {current['throughput_per_second']}")
+        for metric in ("start_latency_ms",):
+            now, before = current[metric]["p95"], previous[metric]["p95"]
+            if now is not None and before is not None and now > before * (1 + limit):
+                regressions.append(f"{section}.{metric}.p95 {before} -> {now}")
+    return regressions
+
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description="Invoice pipeline benchmark")
+    parser.add_argument("--invoices", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-lines", type=int, default=20)
+    parser.add_argument("--fail-ratio", type=float, default=0.2, help="Share of invoices that fail matching")
+    parser.add_argument("--clarify-ratio", type=float, default=0.5, help="Share of failures that go through CLARIFY")
+    parser.add_argument("--max-clarify-loops", type=int, default=2)
+    parser.add_argument("--mcp", choices=["mock", "http", "stdio"], default="http", help="Where MCP calls go")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated MCP server latency per call")
+    parser.add_argument("--skip-http", action="store_true", help="Only run the in-process phase")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--max-regression-pct", type=float, default=20.0)
+    args = parser.parse_args()
+
+    # Scratch working directory: fresh databases, same config and static files
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+    shutil.copy(os.path.join(REPO_DIR, "workflow.json"), workdir)
+    os.symlink(os.path.join(REPO_DIR, "static"), os.path.join(workdir, "static"))
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    logging.disable(logging.INFO)
+
+    rng = random.Random(args.seed)
+    mcp_process = start_mcp_server(args)
+    try:
+        import main  # noqa: F401  (builds the graph and checkpointer in the scratch dir)
+
+        in_process_invoices = synthetic_invoices(args.invoices, "BENCH", args, rng)
+        http_invoices = [] if args.skip_http else synthetic_invoices(args.invoices, "HTTP", args, rng)
+        seed_purchase_orders(in_process_invoices + http_invoices)
+
+        results: Dict[str, Any] = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        }
+        results["in_process"] = run_in_process(in_process_invoices, args.concurrency)
+        results["checkpoints"] = checkpoint_cost(len(in_process_invoices))
+        if not args.skip_http:
+            results["http"] = run_http(http_invoices, args.concurrency)
+        results["tools"] = tool_latency()
+    finally:
+        if mcp_process:
+            mcp_process.terminate()
+            mcp_process.wait(timeout=10)
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression_pct)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,10 +1,68 @@
 import logging
-from typing import List, Any, Dict
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Any, Dict, Optional
+
+from config import settings
 
 logger = logging.getLogger("BigtoolPicker")
 
+
+class ToolHealth:
+    """Observed performance of one tool: EWMA latency/error rate, cost and circuit state."""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.total_cost = 0.0
+        self.opened_at: Optional[float] = None
+        self.trial_started_at: Optional[float] = None
+        # Smooth weighted round-robin accumulator
+        self.current_weight = 0.0
+
+    def record(self, latency: float, success: bool, cost: float) -> None:
+        self.calls += 1
+        self.total_cost += cost
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+        self.ewma_error_rate = self.alpha * (0.0 if success else 1.0) + (1 - self.alpha) * self.ewma_error_rate
+        if success:
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 3) if self.ewma_latency is not None else None,
+            "ewma_error_rate": round(self.ewma_error_rate, 4),
+            "total_cost": round(self.total_cost, 6),
+            "circuit": "open" if self.opened_at is not None else "closed",
+        }
+
+
 class BigtoolPicker:
-    def __init__(self):
+    """
+    Picks a provider per capability. Candidates come from the stage's `pool_hint`
+    (workflow.json) or the default pools; tools whose circuit is open are skipped,
+    and the remaining ones are ranked by the configured policy:
+      - "first": first healthy tool in the pool (static order)
+      - "ewma_latency": lowest EWMA latency (untried tools are tried first)
+      - "weighted_round_robin": smooth WRR over configured weights
+    Nodes report outcomes through `record`/`track`.
+    """
+
+    def __init__(self, options: Dict[str, Any] = None):
+        options = options or {}
         self.pools = {
             "ocr": ["google_vision", "tesseract", "aws_textract"],
             "enrichment": ["clearbit", "people_data_labs", "vendor_db"],
@@ -13,30 +71,125 @@ class BigtoolPicker:
             "email": ["sendgrid", "smartlead", "ses"],
             "storage": ["s3", "gcs", "local_fs"]
         }
+        self.policy = options.get("policy", "first")
+        self.alpha = options.get("ewma_alpha", 0.3)
+        self.failure_threshold = options.get("failure_threshold", 5)
+        self.error_rate_threshold = options.get("error_rate_threshold", 0.5)
+        self.min_calls = options.get("min_calls", 10)
+        self.cooldown_seconds = options.get("cooldown_seconds", 30)
+        self.weights: Dict[str, float] = options.get("weights", {})
+        self.costs: Dict[str, float] = options.get("costs", {})
+        self._health: Dict[str, ToolHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get_health(self, tool: str) -> ToolHealth:
+        health = self._health.get(tool)
+        if health is None:
+            health = self._health[tool] = ToolHealth(self.alpha)
+        return health
+
+    def _available(self, tool: str, now: float) -> bool:
+        """Circuit breaker check. An open circuit lets one trial call through after the cooldown."""
+        health = self._get_health(tool)
+        if health.opened_at is None:
+            return True
+        if now - health.opened_at < self.cooldown_seconds:
+            return False
+        # A trial that never reported back expires after another cooldown
+        return health.trial_started_at is None or now - health.trial_started_at >= self.cooldown_seconds
 
-    def select(self, capability: str, context: Dict[str, Any] = None, pool_hint: List[str] = None) -> str:
+    def _rank(self, candidates: List[str]) -> str:
+        if self.policy == "ewma_latency":
+            # Untried tools sort first so every provider gets sampled
+            return min(candidates, key=lambda t: (self._get_health(t).ewma_latency or 0.0))
+        if self.policy == "weighted_round_robin":
+            total = 0.0
+            best = None
+            for tool in candidates:
+                health = self._get_health(tool)
+                weight = self.weights.get(tool, 1.0)
+                health.current_weight += weight
+                total += weight
+                if best is None or health.current_weight > self._get_health(best).current_weight:
+                    best = tool
+            self._get_health(best).current_weight -= total
+            return best
+        return candidates[0]
+
+    def select(self, capability: str, context: Dict[str, Any] = None, pool_hint: List[str] = None, stage: str = None) -> str:
         """
         Selects the best tool for the job based on capability and context.
+        With `stage`, the pool_hint declared for this capability in that stage's config is used.
         """
         if context is None:
             context = {}
-            
+        if pool_hint is None and stage:
+            pool_hint = stage_pool_hint(stage, capability)
+
         available_tools = pool_hint if pool_hint else self.pools.get(capability, [])
-        
+
         if not available_tools:
             logger.warning(f"No tools found for capability: {capability}")
             return "unknown_tool"
 
-        
-        selected_tool = available_tools[0]
-        
-        
-        if capability == "ocr" and context.get("language") == "handwritten":
-            if "google_vision" in available_tools:
+        with self._lock:
+            now = time.time()
+            candidates = [tool for tool in available_tools if self._available(tool, now)]
+            if not candidates:
+                # Every circuit is open: fall back to the one that opened first
+                selected_tool = min(available_tools, key=lambda t: self._get_health(t).opened_at)
+            elif capability == "ocr" and context.get("language") == "handwritten" and "google_vision" in candidates:
                 selected_tool = "google_vision"
-        
+            else:
+                selected_tool = self._rank(candidates)
+
+            health = self._get_health(selected_tool)
+            if health.opened_at is not None:
+                health.trial_started_at = now
+
         logger.info(f"[Bigtool] Selected '{selected_tool}' for capability '{capability}'")
         return selected_tool
 
+    def record(self, tool: str, latency: float, success: bool, cost: float = None) -> None:
+        """Report the outcome of a call made with `tool`."""
+        with self._lock:
+            health = self._get_health(tool)
+            health.record(latency, success, self.costs.get(tool, 0.0) if cost is None else cost)
+            if health.opened_at is not None:
+                health.trial_started_at = None
+                # Half-open trial: success closes the circuit, failure restarts the cooldown
+                health.opened_at = None if success else time.time()
+                if success:
+                    logger.info(f"[Bigtool] Circuit closed for '{tool}'")
+            elif not success and (
+                health.consecutive_failures >= self.failure_threshold
+                or (health.calls >= self.min_calls and health.ewma_error_rate >= self.error_rate_threshold)
+            ):
+                health.opened_at = time.time()
+                logger.warning(f"[Bigtool] Circuit opened for '{tool}'")
+
+    @contextmanager
+    def track(self, tool: str):
+        """Time the enclosed call and record its outcome for `tool`."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(tool, time.perf_counter() - started, False)
+            raise
+        self.record(tool, time.perf_counter() - started, True)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {tool: health.to_dict() for tool, health in self._health.items()}
+
+
+def stage_pool_hint(stage_id: str, capability: str) -> Optional[List[str]]:
+    """The pool_hint a stage declares for a BigtoolPicker capability in workflow.json."""
+    for tool in settings.get_stage_config(stage_id).get("tools", []):
+        if tool.get("name") == "BigtoolPicker" and tool.get("capability") == capability:
+            return tool.get("pool_hint")
+    return None
+
 
-bigtool = BigtoolPicker()
+bigtool = BigtoolPicker(settings.bigtool)
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import threading
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Set
+
+from config import settings
+from db import connect_sqlite, local_db_path
+
+BLOB_REF = "$blob"
+
+# Payload fields nodes read on every stage; they stay inline next to the reference
+PAYLOAD_HEADER = ("invoice_id", "vendor_name", "vendor_tax_id", "amount", "currency", "invoice_date", "due_date")
+
+
+class BlobStore:
+    """
+    Content-addressed store for large state values (raw payload, OCR text, ...).
+    Graph state keeps `{"$blob": <sha256>}` references (plus a few inline header
+    fields) instead of the value, so checkpoints written at every superstep stay
+    small and identical content is stored once.
+
+    Every blob records the threads that stored it (`blob_refs`). Retention calls
+    `release` for the threads it prunes or deletes, and a blob goes once no
+    thread refers to it, without scanning the checkpoint history.
+    """
+
+    def __init__(self, db_path: str, enabled: bool = True, min_bytes: int = 512):
+        self.db_path = db_path
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS blob_refs (
+                digest TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                PRIMARY KEY (digest, thread_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_blob_refs_thread ON blob_refs (thread_id);
+        """)
+        # Blobs are immutable, so decoded values can be cached freely
+        self._fetch = lru_cache(maxsize=1024)(self._fetch_uncached)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def put(self, value: Any, owner: str) -> str:
+        """Store `value` for thread `owner` and return its digest."""
+        raw = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+        digest = hashlib.sha256(raw).hexdigest()
+        conn = self._conn()
+        # Blob and reference in one transaction, so a concurrent release cannot drop the blob in between
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (digest, data, size) VALUES (?, ?, ?)",
+                (digest, zlib.compress(raw), len(raw))
+            )
+            conn.execute("INSERT OR IGNORE INTO blob_refs (digest, thread_id) VALUES (?, ?)", (digest, owner))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return digest
+
+    def _fetch_uncached(self, digest: str) -> Any:
+        row = self._conn().execute("SELECT data FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Blob {digest} not found")
+        return json.loads(zlib.decompress(row[0]))
+
+    def ref(self, value: Any, owner: str, keep: Iterable[str] = ()) -> Any:
+        """Replace `value` with a reference (held by thread `owner`) when compact state
+        is on and it is large enough. For dicts, the `keep` fields are copied next to the reference."""
+        if not self.enabled or value is None or is_ref(value):
+            return value
+        if len(json.dumps(value, separators=(",", ":"), default=str)) < self.min_bytes:
+            return value
+        reference = {BLOB_REF: self.put(value, owner)}
+        if isinstance(value, dict):
+            reference.update({key: value[key] for key in keep if key in value})
+        return reference
+
+    def load(self, value: Any) -> Any:
+        """The full value behind a reference (values that are not references pass through)."""
+        if not is_ref(value):
+            return value
+        loaded = self._fetch(value[BLOB_REF])
+        return dict(loaded) if isinstance(loaded, dict) else loaded
+
+    def expand(self, value: Any) -> Any:
+        """Resolve every reference nested in `value`, e.g. before returning state to a client."""
+        if is_ref(value):
+            return self.expand(self.load(value))
+        if isinstance(value, dict):
+            return {key: self.expand(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.expand(item) for item in value]
+        return value
+
+    def release(self, thread_id: str, keep: Set[str] = frozenset()) -> int:
+        """Drop the thread's references except those in `keep` (digests its remaining
+        checkpoints still use), and delete the blobs no thread refers to any more.
+        Returns blobs deleted."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            released = [
+                digest for (digest,) in conn.execute("SELECT digest FROM blob_refs WHERE thread_id = ?", (thread_id,))
+                if digest not in keep
+            ]
+            conn.executemany(
+                "DELETE FROM blob_refs WHERE digest = ? AND thread_id = ?", [(digest, thread_id) for digest in released]
+            )
+            deleted = 0
+            for digest in released:
+                deleted += conn.execute(
+                    "DELETE FROM blobs WHERE digest = ? AND NOT EXISTS (SELECT 1 FROM blob_refs WHERE digest = ?)",
+                    (digest, digest)
+                ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        count, stored, raw = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        return {"enabled": self.enabled, "blobs": count, "stored_bytes": stored, "raw_bytes": raw}
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and BLOB_REF in value
+
+
+def collect_refs(value: Any, into: Set[str]) -> Set[str]:
+    """Add the digest of every reference nested in `value` to `into`."""
+    if isinstance(value, dict):
+        if BLOB_REF in value:
+            into.add(value[BLOB_REF])
+        for item in value.values():
+            collect_refs(item, into)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            collect_refs(item, into)
+    return into
+
+
+blob_store = BlobStore(
+    local_db_path(),
+    enabled=settings.compact_state.get("enabled", True),
+    min_bytes=settings.compact_state.get("min_blob_bytes", 512)
+)
@@ -0,0 +1,94 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from config import settings
+from db import connect_sqlite, sqlite_path
+
+logger = logging.getLogger("Checkpointer")
+
+
+class PooledSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver with one connection per thread instead of one shared connection
+    behind a global lock. Concurrent runs read in parallel under WAL and only
+    serialize on SQLite's own write lock, for the duration of a single commit.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        self._local = threading.local()
+        super().__init__(connect_sqlite(path), **kwargs)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+        return conn
+
+    @conn.setter
+    def conn(self, value: sqlite3.Connection) -> None:
+        # SqliteSaver.__init__ assigns the constructing thread's connection
+        self._local.conn = value
+
+    @contextmanager
+    def cursor(self, transaction: bool = True) -> Iterator[sqlite3.Cursor]:
+        if not self.is_setup:
+            with self.lock:
+                self.setup()
+        conn = self.conn
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            if transaction:
+                conn.commit()
+            cur.close()
+
+
+def _build_postgres_checkpointer(db_url: str) -> BaseCheckpointSaver:
+    try:
+        from langgraph.checkpoint.postgres import PostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise RuntimeError(
+            "A Postgres default_db requires 'langgraph-checkpoint-postgres' and 'psycopg[pool]'"
+        )
+
+    pool = ConnectionPool(
+        db_url,
+        max_size=settings.checkpoint_pool_size,
+        kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+    )
+    saver = PostgresSaver(pool)
+    saver.setup()
+    return saver
+
+
+def build_checkpointer(db_url: str = None) -> BaseCheckpointSaver:
+    """
+    Create the graph checkpointer from `Config.default_db`.
+    sqlite:///path -> PooledSqliteSaver, postgres(ql)://... -> PostgresSaver on a connection pool.
+    """
+    db_url = db_url or settings.default_db
+    if settings.checkpoint_table != "checkpoints":
+        # Both savers use fixed table names
+        logger.warning(f"checkpoint_table '{settings.checkpoint_table}' is ignored; savers use 'checkpoints'")
+
+    if db_url.startswith(("postgres://", "postgresql://")):
+        logger.info("[Checkpointer] Using Postgres checkpointer")
+        return _build_postgres_checkpointer(db_url)
+
+    path = sqlite_path(db_url)
+    if path is None:
+        raise ValueError(f"Unsupported default_db URL: {db_url}")
+    logger.info(f"[Checkpointer] Using SQLite checkpointer at {path}")
+    return PooledSqliteSaver(path)
@@ -1,6 +1,6 @@
 import json
 import os
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 class Config:
     def __init__(self, config_path: str = "workflow.json"):
@@ -26,6 +26,10 @@ class Config:
     def two_way_tolerance_pct(self) -> float:
         return self._config_data.get("config", {}).get("two_way_tolerance_pct", 5)
     
+    @property
+    def human_review_queue(self) -> str:
+        return self._config_data.get("config", {}).get("human_review_queue", "human_review_queue")
+
     @property
     def checkpoint_table(self) -> str:
         return self._config_data.get("config", {}).get("checkpoint_table", "checkpoints")
@@ -34,6 +38,99 @@ class Config:
     def default_db(self) -> str:
         return self._config_data.get("config", {}).get("default_db", "sqlite:///./demo.db")
 
+    @property
+    def max_concurrent_runs(self) -> int:
+        return self._config_data.get("config", {}).get("max_concurrent_runs", 32)
+
+    @property
+    def batch_concurrency(self) -> int:
+        return self._config_data.get("config", {}).get("batch_concurrency", 8)
+
+    @property
+    def checkpoint_pool_size(self) -> int:
+        return self._config_data.get("config", {}).get("checkpoint_pool_size", 16)
+
+    @property
+    def retention(self) -> Dict[str, Any]:
+        defaults = {
+            "interval_seconds": 3600,
+            "abandoned_ttl_hours": 720,
+            "event_ttl_hours": 24,
+            "vacuum_min_free_ratio": 0.2
+        }
+        return {**defaults, **self._config_data.get("config", {}).get("retention", {})}
+
+    @property
+    def tool_fanout_workers(self) -> int:
+        return self._config_data.get("config", {}).get("tool_fanout_workers", 16)
+
+    @property
+    def tool_cache(self) -> Dict[str, Any]:
+        return self._config_data.get("tool_cache", {})
+
+    @property
+    def bigtool(self) -> Dict[str, Any]:
+        return self._config_data.get("bigtool", {})
+
+    @property
+    def compact_state(self) -> Dict[str, Any]:
+        return self._config_data.get("compact_state", {})
+
+    @property
+    def parse_cache(self) -> Dict[str, Any]:
+        return self._config_data.get("parse_cache", {})
+
+    @property
+    def dedup(self) -> Dict[str, Any]:
+        return self._config_data.get("config", {}).get("dedup", {})
+
+    @property
+    def batching(self) -> Dict[str, Any]:
+        return self._config_data.get("batching", {})
+
+    @property
+    def admission(self) -> Dict[str, Any]:
+        return self._config_data.get("admission", {})
+
+    @property
+    def scheduling(self) -> Dict[str, Any]:
+        return self._config_data.get("scheduling", {})
+
+    @property
+    def timers(self) -> Dict[str, Any]:
+        return self._config_data.get("timers", {})
+
+    @property
+    def execution(self) -> Dict[str, Any]:
+        return self._config_data.get("execution", {})
+
+    @property
+    def po_store(self) -> Dict[str, Any]:
+        return self._config_data.get("po_store", {})
+
+    @property
+    def validation(self) -> Dict[str, Any]:
+        return self._config_data.get("validation", {})
+
+    @property
+    def inputs(self) -> Dict[str, Any]:
+        return self._config_data.get("inputs", {})
+
+    @property
+    def stages(self) -> List[Dict[str, Any]]:
+        return self._config_data.get("stages", [])
+
+    @property
+    def retry_policy(self) -> Dict[str, Any]:
+        return self._config_data.get("error_handling", {}).get("retry_policy", {})
+
+    @property
+    def side_effect_stages(self) -> List[str]:
+        return self._config_data.get("error_handling", {}).get("side_effect_stages", [])
+
+    def get_mcp_server_config(self, server_name: str) -> Dict[str, Any]:
+        return self._config_data.get("mcp_servers", {}).get(server_name, {"transport": "mock"})
+
     def get_stage_config(self, stage_id: str) -> Dict[str, Any]:
         stages = self._config_data.get("stages", [])
         for stage in stages:
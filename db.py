@@ -0,0 +1,48 @@
+import sqlite3
+from typing import Dict, Optional
+
+from config import settings
+
+# Pragmas applied to every SQLite connection the app opens.
+# WAL lets readers proceed during writes; synchronous=NORMAL is durable in WAL mode
+# except for the last transactions on power loss; busy_timeout makes concurrent
+# writers wait for the lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "wal_autocheckpoint": 1000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000,
+}
+
+
+def sqlite_path(db_url: str) -> Optional[str]:
+    """Return the file path of a sqlite:/// URL, or None for any other backend."""
+    if db_url.startswith("sqlite:///"):
+        return db_url[len("sqlite:///"):] or ":memory:"
+    if "://" not in db_url:
+        return db_url
+    return None
+
+
+def connect_sqlite(path: str, **kwargs) -> sqlite3.Connection:
+    """Open a SQLite connection with the shared pragmas applied."""
+    conn = sqlite3.connect(path, timeout=SQLITE_PRAGMAS["busy_timeout"] / 1000, **kwargs)
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma}={value}")
+    return conn
+
+
+def ensure_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+    """Add columns (name -> SQL definition) missing from a table created by an older version."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def local_db_path() -> str:
+    """SQLite file for app-side tables (review queue etc.): the checkpoint DB when it is SQLite."""
+    return sqlite_path(settings.default_db) or "checkpoints.db"
@@ -0,0 +1,143 @@
+import datetime
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from config import settings
+from db import connect_sqlite, local_db_path
+
+# Legal-form suffixes that do not distinguish vendors ("Acme Corp." == "ACME Corporation")
+_VENDOR_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "llc", "ltd", "limited",
+    "plc", "gmbh", "ag", "sa", "bv", "pvt", "private"
+}
+
+
+def normalize_vendor_name(name: Optional[str]) -> str:
+    words = re.sub(r"[^0-9a-z]+", " ", (name or "").casefold()).split()
+    return " ".join(word for word in words if word not in _VENDOR_SUFFIXES)
+
+
+def normalize_invoice_id(invoice_id: Optional[str]) -> str:
+    return re.sub(r"[^0-9a-z]+", "", str(invoice_id or "").casefold())
+
+
+class DedupIndex:
+    """
+    Index of the invoices whose runs are live or completed, used to stop
+    resubmissions before any expensive stage runs. An invoice is registered at
+    INTAKE and released when its run fails, is rejected or is deleted by
+    retention, so a legitimate resubmission is accepted again.
+      - exact: primary key over (vendor tax_id, invoice_id, amount, invoice date);
+        the insert itself is the check, so concurrent resubmissions cannot both win.
+      - near: normalized vendor name plus a log-scale amount bucket, indexed; a hit
+        needs the amount within tolerance and the same normalized invoice_id.
+      - possible: same vendor, amount within tolerance and same invoice date but a
+        different invoice_id. That can be a real second invoice, so it is registered
+        and reported for human review instead of being stopped.
+    Both are single index probes, independent of how many invoices are stored.
+    """
+
+    def __init__(self, db_path: str, amount_tolerance_pct: float = 1.0, table: str = "invoice_index"):
+        self.db_path = db_path
+        self.table = table
+        self.tolerance = amount_tolerance_pct / 100
+        self._local = threading.local()
+        self._conn().executescript(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                exact_key TEXT PRIMARY KEY,
+                near_key TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                invoice_id TEXT,
+                invoice_id_norm TEXT,
+                invoice_date TEXT,
+                amount REAL,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_{table}_near ON {table} (near_key);
+            CREATE INDEX IF NOT EXISTS idx_{table}_thread ON {table} (thread_id);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _bucket(self, amount: float) -> int:
+        # Buckets are one tolerance wide relative to the amount, so near amounts land in adjacent buckets
+        return int(math.floor(math.log(max(abs(amount), 0.01)) / math.log1p(max(self.tolerance, 1e-6))))
+
+    def _keys(self, payload: Dict[str, Any]):
+        vendor = payload.get("vendor_tax_id") or normalize_vendor_name(payload.get("vendor_name"))
+        amount = round(float(payload.get("amount") or 0), 2)
+        exact = "|".join([vendor, normalize_invoice_id(payload.get("invoice_id")), f"{amount:.2f}", str(payload.get("invoice_date") or "")])
+        return hashlib.sha256(exact.encode()).hexdigest(), normalize_vendor_name(payload.get("vendor_name")), amount
+
+    def check_and_register(self, payload: Dict[str, Any], thread_id: str) -> Optional[Dict[str, Any]]:
+        """Register the invoice for `thread_id`, or return the earlier submission it duplicates.
+
+        A returned match of "exact" or "near" is a duplicate (the invoice is not
+        registered); "possible" means the invoice was registered but resembles the
+        returned one closely enough that a human should check it.
+        """
+        exact_key, vendor_norm, amount = self._keys(payload)
+        invoice_id_norm = normalize_invoice_id(payload.get("invoice_id"))
+        invoice_date = payload.get("invoice_date")
+        bucket = self._bucket(amount)
+        conn = self._conn()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT * FROM {self.table} WHERE exact_key = ?", (exact_key,)).fetchone()
+            if row is not None:
+                conn.execute("COMMIT")
+                # Re-running INTAKE for the same thread is not a duplicate
+                return None if row["thread_id"] == thread_id else self._describe(row, "exact")
+
+            near_keys = [f"{vendor_norm}|{b}" for b in (bucket - 1, bucket, bucket + 1)]
+            possible = None
+            for row in conn.execute(
+                f"SELECT * FROM {self.table} WHERE near_key IN (?, ?, ?)", near_keys
+            ).fetchall():
+                same_amount = abs(row["amount"] - amount) <= self.tolerance * max(abs(amount), 0.01)
+                if not same_amount or row["thread_id"] == thread_id:
+                    continue
+                if invoice_id_norm and row["invoice_id_norm"] == invoice_id_norm:
+                    conn.execute("COMMIT")
+                    return self._describe(row, "near")
+                if possible is None and invoice_date and row["invoice_date"] == invoice_date:
+                    possible = self._describe(row, "possible")
+
+            conn.execute(
+                f"INSERT INTO {self.table} (exact_key, near_key, thread_id, invoice_id, invoice_id_norm, invoice_date, amount, created_at) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (exact_key, f"{vendor_norm}|{bucket}", thread_id, payload.get("invoice_id"), invoice_id_norm,
+                 invoice_date, amount, datetime.datetime.now().isoformat())
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return possible
+
+    def release(self, thread_id: str) -> int:
+        """Forget the invoice registered by `thread_id` (its run will not post it). Returns rows deleted."""
+        return self._conn().execute(f"DELETE FROM {self.table} WHERE thread_id = ?", (thread_id,)).rowcount
+
+    def _describe(self, row: sqlite3.Row, match: str) -> Dict[str, Any]:
+        return {
+            "match": match,
+            "thread_id": row["thread_id"],
+            "invoice_id": row["invoice_id"],
+            "amount": row["amount"],
+            "submitted_at": row["created_at"]
+        }
+
+
+dedup_index = DedupIndex(local_db_path(), amount_tolerance_pct=settings.dedup.get("amount_tolerance_pct", 1.0))
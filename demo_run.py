@@ -23,7 +23,8 @@ def run_demo():
         # 1. Start Workflow (Trigger Failure)
         print("\n--- 1. Starting Workflow (Triggering Match Failure) ---")
         payload = {
-            "invoice_id": "INV-2023-001",
+            # Unique per run: a resubmitted invoice_id is stopped at INTAKE as a duplicate
+            "invoice_id": f"INV-{int(time.time())}",
             "vendor_name": "Acme Corp",
             "amount": 9999, # Triggers forced failure in mock
             "currency": "USD",
@@ -49,9 +50,7 @@ def run_demo():
             print("ERROR: No pending reviews found.")
             return
             
-        checkpoint_id = items[0]["checkpoint_id"] # In our mock, we use checkpoint_id as key
-        # Actually main.py uses checkpoint_id as the key in PENDING_REVIEWS
-        # And the list item has "checkpoint_id"
+        checkpoint_id = items[0]["checkpoint_id"] # The review queue is keyed by checkpoint_id
         
         # 3. Submit Decision (CLARIFY)
         print("\n--- 3. Submitting Decision (CLARIFY) ---")
@@ -66,17 +65,18 @@ def run_demo():
         print(f"Decision Response: {resp.status_code}")
         print(json.dumps(resp.json(), indent=2))
         
-        # Expecting RESUMED (as it runs the CLARIFY node) but then PAUSED again at CHECKPOINT_HITL
-        # However, the API might just return RESUMED and leave the state checking to us.
-        # But wait, main.py's decision endpoint runs the graph until interrupt.
-        # So if we loop back to CHECKPOINT_HITL -> interrupt_before HITL_DECISION
-        # It should run CLARIFY -> CHECKPOINT_HITL -> Interrupt.
-        
-        if resp.json().get("status") != "PAUSED":
-             # It might be PAUSED if it looped back and hit the interrupt again.
-             # If it just says RESUMED, it means it started running.
-             # We need to check if it's pending review again.
-             pass
+        # CLARIFY emails the vendor and parks the thread until the reply (or the deadline)
+        if resp.json().get("status") != "WAITING":
+            print("ERROR: Workflow did not wait for the vendor's reply.")
+            return
+        correlation_key = resp.json()["correlation_key"]
+
+        # 3b. Vendor Replies (carries the correlation key from the clarification email)
+        print("\n--- 3b. Vendor Replies to the Clarification Request ---")
+        reply_payload = {"correlation_key": correlation_key, "message": "Line item is a one-off service fee."}
+        resp = requests.post(f"{base_url}/clarification/reply", json=reply_payload)
+        print(f"Reply Response: {resp.status_code}")
+        print(json.dumps(resp.json(), indent=2))
 
         time.sleep(2)
 
@@ -87,13 +87,10 @@ def run_demo():
         
         items = resp.json().get("items", [])
         if not items:
-            print("ERROR: No pending reviews found after CLARIFY loop.")
+            print("ERROR: No pending reviews found after the vendor replied.")
             return
 
-        # Get the new checkpoint ID (or same one if persisted, but typically new in this mock)
-        # Actually LangGraph might keep the same thread but new checkpoint.
-        # main.py logic for PENDING_REVIEWS might need to handle this.
-        # Let's assume there is an item.
+        # CHECKPOINT_HITL queued the thread again under a new checkpoint ID
         checkpoint_id_2 = items[0]["checkpoint_id"]
 
         # 5. Submit Decision (ACCEPT)
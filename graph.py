@@ -1,9 +1,11 @@
-import sqlite3
-from typing import Literal
+from typing import List, Literal, Union
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.sqlite import SqliteSaver
 
 from state import AgentState
+from checkpointer import build_checkpointer
+from metrics import instrument_node, instrument_saver
+from resilience import with_retry
+from validation import validate_output
 from nodes import (
     intake_node, understand_node, prepare_node, retrieve_node,
     match_two_way_node, checkpoint_hitl_node, hitl_decision_node,
@@ -12,10 +14,18 @@ from nodes import (
 )
 
 # --- Conditional Logic ---
+def route_after_intake(state: AgentState) -> Union[Literal["END"], List[str]]:
+    if state.get("status") in ("DUPLICATE", "INVALID"):
+        return "END"
+    return ["UNDERSTAND", "PREPARE"]
+
 def route_after_match(state: AgentState) -> Literal["CHECKPOINT_HITL", "RECONCILE"]:
     match_result = state["MATCH_TWO_WAY"].get("match_result")
     if match_result == "FAILED":
         return "CHECKPOINT_HITL"
+    # Same vendor, amount and date as an earlier invoice under another number: a human decides
+    if state["INTAKE"].get("possible_duplicate_of"):
+        return "CHECKPOINT_HITL"
     return "RECONCILE"
 
 def route_after_hitl(state: AgentState) -> Literal["RECONCILE", "CLARIFY", "END"]:
@@ -29,29 +39,46 @@ def route_after_hitl(state: AgentState) -> Literal["RECONCILE", "CLARIFY", "END"
     return "END"
 
 
+def _stage(stage: str, fn):
+    # Timed into metrics/audit_log around the whole stage, retries included;
+    # each attempt's output is checked against the stage's output_schema
+    return instrument_node(stage, with_retry(stage, validate_output(stage, fn)))
+
+
 def build_graph():
     workflow = StateGraph(AgentState)
 
-    # Add Nodes
-    workflow.add_node("INTAKE", intake_node)
-    workflow.add_node("UNDERSTAND", understand_node)
-    workflow.add_node("PREPARE", prepare_node)
-    workflow.add_node("RETRIEVE", retrieve_node)
-    workflow.add_node("MATCH_TWO_WAY", match_two_way_node)
-    workflow.add_node("CHECKPOINT_HITL", checkpoint_hitl_node)
-    workflow.add_node("HITL_DECISION", hitl_decision_node)
-    workflow.add_node("RECONCILE", reconcile_node)
-    workflow.add_node("APPROVE", approve_node)
-    workflow.add_node("POSTING", posting_node)
-    workflow.add_node("NOTIFY", notify_node)
-    workflow.add_node("COMPLETE", complete_node)
-    workflow.add_node("CLARIFY", clarify_node)
+    # Add Nodes (each one timed into the metrics registry and the state's audit_log,
+    # with the stage's retry/timeout policy from workflow.json)
+    workflow.add_node("INTAKE", _stage("INTAKE", intake_node))
+    workflow.add_node("UNDERSTAND", _stage("UNDERSTAND", understand_node))
+    workflow.add_node("PREPARE", _stage("PREPARE", prepare_node))
+    workflow.add_node("RETRIEVE", _stage("RETRIEVE", retrieve_node))
+    workflow.add_node("MATCH_TWO_WAY", _stage("MATCH_TWO_WAY", match_two_way_node))
+    workflow.add_node("CHECKPOINT_HITL", _stage("CHECKPOINT_HITL", checkpoint_hitl_node))
+    workflow.add_node("HITL_DECISION", _stage("HITL_DECISION", hitl_decision_node))
+    workflow.add_node("RECONCILE", _stage("RECONCILE", reconcile_node))
+    workflow.add_node("APPROVE", _stage("APPROVE", approve_node))
+    workflow.add_node("POSTING", _stage("POSTING", posting_node))
+    workflow.add_node("NOTIFY", _stage("NOTIFY", notify_node))
+    workflow.add_node("COMPLETE", _stage("COMPLETE", complete_node))
+    workflow.add_node("CLARIFY", _stage("CLARIFY", clarify_node))
 
     # Add Edges
     workflow.set_entry_point("INTAKE")
-    workflow.add_edge("INTAKE", "UNDERSTAND")
-    workflow.add_edge("UNDERSTAND", "PREPARE")
-    workflow.add_edge("PREPARE", "RETRIEVE")
+    # UNDERSTAND (OCR/parsing) and PREPARE (vendor normalization) are independent,
+    # so they run as parallel branches and RETRIEVE waits for both.
+    # Duplicates and invoices that fail schema validation end right after INTAKE.
+    workflow.add_conditional_edges(
+        "INTAKE",
+        route_after_intake,
+        {
+            "UNDERSTAND": "UNDERSTAND",
+            "PREPARE": "PREPARE",
+            "END": END
+        }
+    )
+    workflow.add_edge(["UNDERSTAND", "PREPARE"], "RETRIEVE")
     workflow.add_edge("RETRIEVE", "MATCH_TWO_WAY")
     
     # Conditional Edge after Match
@@ -84,17 +111,17 @@ def build_graph():
     workflow.add_edge("NOTIFY", "COMPLETE")
     workflow.add_edge("COMPLETE", END)
     
-    # Loop back from CLARIFY to CHECKPOINT_HITL
+    # Loop back from CLARIFY to CHECKPOINT_HITL once the vendor replied or the
+    # reply deadline passed (the thread is parked in between, see interrupt_after)
     workflow.add_edge("CLARIFY", "CHECKPOINT_HITL")
 
-    # Setup Checkpointer
-    # We use a connection pool or just a connection for the saver
-    conn = sqlite3.connect("checkpoints.db", check_same_thread=False)
-    memory = SqliteSaver(conn)
+    # Setup Checkpointer (backend and location come from config.default_db)
+    memory = instrument_saver(build_checkpointer())
 
     # Compile with interrupt
-    # We want to stop *before* HITL_DECISION runs, so the human can provide input.
-    app = workflow.compile(checkpointer=memory, interrupt_before=["HITL_DECISION"])
+    # We want to stop *before* HITL_DECISION runs, so the human can provide input,
+    # and *after* CLARIFY, which parks the thread on a timer until the vendor replies.
+    app = workflow.compile(checkpointer=memory, interrupt_before=["HITL_DECISION"], interrupt_after=["CLARIFY"])
     
     return app
 
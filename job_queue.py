@@ -0,0 +1,206 @@
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import settings
+from db import connect_sqlite, ensure_columns, local_db_path
+from scheduling import DEFAULT_LANE, WeightedLanes, lane_weights
+
+logger = logging.getLogger("JobQueue")
+
+
+class JobQueue:
+    """
+    Durable queue of workflow jobs (start / resume / retry / wake) shared by the API and worker processes.
+    A worker claims the oldest available job under a lease; while it runs, the worker
+    renews the lease. A job whose lease expires (worker crashed or hung) becomes
+    claimable again, up to `max_attempts` claims. Failed start jobs are retried with
+    backoff; everything else ends in DONE or FAILED with the result/error stored.
+
+    Jobs carry a priority lane and score: claims share out the lanes by weight and
+    take the highest score within a lane, except that a job waiting longer than
+    `starvation_seconds` is claimed first.
+    """
+
+    def __init__(self, db_path: str, table: str = "workflow_jobs", max_attempts: int = 3,
+                 weights: Optional[Dict[str, int]] = None, starvation_seconds: float = 30.0):
+        self.db_path = db_path
+        self.table = table
+        self.max_attempts = max_attempts
+        self.lanes = WeightedLanes(weights or {DEFAULT_LANE: 1})
+        self.starvation_seconds = starvation_seconds
+        self._local = threading.local()
+        self._conn().executescript(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'QUEUED',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+        """)
+        ensure_columns(self._conn(), table, {
+            "lane": f"TEXT NOT NULL DEFAULT '{DEFAULT_LANE}'",
+            "priority": "REAL NOT NULL DEFAULT 0"
+        })
+        self._conn().executescript(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_ready ON {table} (status, available_at, job_id);
+            CREATE INDEX IF NOT EXISTS idx_{table}_lane ON {table} (status, lane, priority, job_id);
+            CREATE INDEX IF NOT EXISTS idx_{table}_lease ON {table} (status, lease_expires_at);
+            CREATE INDEX IF NOT EXISTS idx_{table}_thread ON {table} (thread_id, job_id);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, kind: str, thread_id: str, payload: Dict[str, Any], max_attempts: Optional[int] = None,
+                priority: Optional[Dict[str, Any]] = None) -> int:
+        """Queue a job; `priority` is a {"lane", "score"} dict from scheduling.compute_priority."""
+        now = datetime.datetime.now().isoformat()
+        priority = priority or {}
+        cur = self._conn().execute(
+            f"INSERT INTO {self.table} (kind, thread_id, payload, max_attempts, available_at, lane, priority, created_at, updated_at) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, thread_id, json.dumps(payload, default=str), max_attempts or self.max_attempts, time.time(),
+             priority.get("lane", DEFAULT_LANE), priority.get("score", 0), now, now)
+        )
+        return cur.lastrowid
+
+    def _next_job_id(self, conn: sqlite3.Connection, now: float) -> Optional[int]:
+        """Which job to claim: an expired lease, else a starving job, else the best job of the lane picked by weight."""
+        row = conn.execute(
+            f"SELECT job_id FROM {self.table} WHERE status = 'RUNNING' AND lease_expires_at < ? "
+            f"ORDER BY lease_expires_at LIMIT 1", (now,)
+        ).fetchone()
+        if row is None:
+            row = conn.execute(
+                f"SELECT job_id FROM {self.table} WHERE status = 'QUEUED' AND available_at <= ? "
+                f"ORDER BY available_at, job_id LIMIT 1", (now - self.starvation_seconds,)
+            ).fetchone()
+        if row is None:
+            backlogged = [lane for (lane,) in conn.execute(
+                f"SELECT DISTINCT lane FROM {self.table} WHERE status = 'QUEUED' AND available_at <= ?", (now,)
+            )]
+            # Lanes missing from the weights (e.g. renamed in the config) are still served
+            lane = self.lanes.pick(backlogged) or (backlogged[0] if backlogged else None)
+            if lane is None:
+                return None
+            row = conn.execute(
+                f"SELECT job_id FROM {self.table} WHERE status = 'QUEUED' AND available_at <= ? AND lane = ? "
+                f"ORDER BY priority DESC, job_id LIMIT 1", (now, lane)
+            ).fetchone()
+        return row["job_id"] if row else None
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Lease the next runnable job (QUEUED and due, or RUNNING with an expired lease)."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases that used up their attempts are not picked up again
+            conn.execute(
+                f"UPDATE {self.table} SET status = 'FAILED', error = 'Lease expired after final attempt', "
+                f"lease_owner = NULL, updated_at = ? "
+                f"WHERE status = 'RUNNING' AND lease_expires_at < ? AND attempts >= max_attempts",
+                (datetime.datetime.now().isoformat(), now)
+            )
+            job_id = self._next_job_id(conn, now)
+            if job_id is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                f"UPDATE {self.table} SET status = 'RUNNING', attempts = attempts + 1, lease_owner = ?, "
+                f"lease_expires_at = ?, updated_at = ? WHERE job_id = ?",
+                (worker_id, now + lease_seconds, datetime.datetime.now().isoformat(), job_id)
+            )
+            job = conn.execute(f"SELECT * FROM {self.table} WHERE job_id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row(job)
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Extend the lease; False if the job is no longer leased to this worker."""
+        cur = self._conn().execute(
+            f"UPDATE {self.table} SET lease_expires_at = ? WHERE job_id = ? AND lease_owner = ? AND status = 'RUNNING'",
+            (time.time() + lease_seconds, job_id, worker_id)
+        )
+        return cur.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, result: Dict[str, Any]) -> None:
+        self._conn().execute(
+            f"UPDATE {self.table} SET status = 'DONE', result = ?, lease_owner = NULL, updated_at = ? "
+            f"WHERE job_id = ? AND lease_owner = ?",
+            (json.dumps(result, default=str), datetime.datetime.now().isoformat(), job_id, worker_id)
+        )
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry: bool = True, backoff_seconds: float = 1.0) -> None:
+        """Record a failed attempt: requeue with backoff while attempts remain, else mark FAILED."""
+        conn = self._conn()
+        job = conn.execute(f"SELECT attempts, max_attempts FROM {self.table} WHERE job_id = ?", (job_id,)).fetchone()
+        if retry and job and job["attempts"] < job["max_attempts"]:
+            conn.execute(
+                f"UPDATE {self.table} SET status = 'QUEUED', error = ?, available_at = ?, lease_owner = NULL, "
+                f"updated_at = ? WHERE job_id = ? AND lease_owner = ?",
+                (error, time.time() + backoff_seconds * 2 ** (job["attempts"] - 1),
+                 datetime.datetime.now().isoformat(), job_id, worker_id)
+            )
+        else:
+            conn.execute(
+                f"UPDATE {self.table} SET status = 'FAILED', error = ?, lease_owner = NULL, updated_at = ? "
+                f"WHERE job_id = ? AND lease_owner = ?",
+                (error, datetime.datetime.now().isoformat(), job_id, worker_id)
+            )
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        return self._row(self._conn().execute(f"SELECT * FROM {self.table} WHERE job_id = ?", (job_id,)).fetchone())
+
+    def latest_for_thread(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        return self._row(self._conn().execute(
+            f"SELECT * FROM {self.table} WHERE thread_id = ? ORDER BY job_id DESC LIMIT 1", (thread_id,)
+        ).fetchone())
+
+    def count(self, status: str = "QUEUED") -> int:
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table} WHERE status = ?", (status,)).fetchone()[0]
+
+    def prune(self, before: str) -> int:
+        """Delete finished jobs last updated before the ISO timestamp `before`."""
+        cur = self._conn().execute(
+            f"DELETE FROM {self.table} WHERE status IN ('DONE', 'FAILED') AND updated_at < ?", (before,)
+        )
+        return cur.rowcount
+
+
+job_queue = JobQueue(
+    local_db_path(),
+    max_attempts=settings.execution.get("max_attempts", 3),
+    weights=lane_weights(),
+    starvation_seconds=settings.scheduling.get("starvation_seconds", 30)
+)
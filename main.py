@@ -1,15 +1,37 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
+import logging
+import functools
+import json
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import uuid
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 import threading
 import os
 
 from graph import app
-from state import AgentState
+from config import settings
+from review_queue import review_queue
+from review_events import review_events
+from retention import build_retention
+from mcp_client import common_client, atlas_client
+from tool_cache import tool_cache
+from parse_cache import parse_cache
+from bigtool import bigtool
+from po_store import po_store
+from runner import new_initial_state, stream_run, run_start, execute_job
+from job_queue import job_queue
+from posting import posting_batcher, notify_batcher
+from metrics import registry
+from ratelimit import AdmissionController, Throttled
+from scheduling import PriorityExecutor, lane_weights
+from timers import TimerScheduler, timer_store
+from validation import validators
+
+logger = logging.getLogger("API")
 
 api = FastAPI(title="Langie - Invoice Processing Agent")
 
@@ -20,15 +42,101 @@ api.mount("/static", StaticFiles(directory="static"), name="static")
 async def read_index():
     return FileResponse('static/index.html')
 
-# --- In-Memory Queue for Demo ---
-# In a real app, this would be Redis or a DB table populated by the CHECKPOINT_HITL node
-PENDING_REVIEWS = {}
+retention = build_retention(app.checkpointer)
+BACKGROUND_TASKS: List[asyncio.Task] = []
+
+async def _retention_loop():
+    interval = settings.retention["interval_seconds"]
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(retention.run)
+        except Exception:
+            logger.exception("Retention sweep failed")
+
+async def _po_sync_loop():
+    interval = settings.po_store.get("sync_interval_seconds", 60)
+    while True:
+        try:
+            await asyncio.to_thread(po_store.sync, atlas_client)
+        except Exception:
+            logger.exception("PO store delta sync failed")
+        await asyncio.sleep(interval)
+
+@api.on_event("startup")
+async def start_background_services():
+    review_events.start()
+    timer_scheduler.start()
+    BACKGROUND_TASKS.append(asyncio.create_task(_retention_loop()))
+    BACKGROUND_TASKS.append(asyncio.create_task(_po_sync_loop()))
+
+@api.on_event("shutdown")
+async def stop_background_services():
+    await review_events.stop()
+    await timer_scheduler.stop()
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    await common_client.aclose()
+    await atlas_client.aclose()
+
+# --- Workflow Execution ---
+# LangGraph's sync invoke blocks, so graph runs never execute on the event loop.
+# They go to a bounded pool; handlers either await the result or return at once.
+# The pool schedules by priority lane (due date, amount, vendor tier), not FIFO.
+WORKFLOW_EXECUTOR = PriorityExecutor(
+    max_workers=settings.max_concurrent_runs,
+    weights=lane_weights(),
+    starvation_seconds=settings.scheduling.get("starvation_seconds", 30),
+    thread_name_prefix="workflow"
+)
+
+# Runs submitted in background mode that have not finished yet (or failed).
+# Finished runs are answered from the checkpointer via app.get_state.
+ACTIVE_RUNS: Dict[str, str] = {}
+RUN_ERRORS: Dict[str, str] = {}
+
+registry.gauge("review_queue_pending", "Reviews waiting for a human decision.", callback=lambda: review_queue.count("PENDING"))
+registry.gauge("workflow_background_runs", "Background runs queued or running.", callback=lambda: len(ACTIVE_RUNS))
+registry.gauge("workflow_jobs_queued", "Jobs waiting in the durable queue for a worker.", callback=lambda: job_queue.count("QUEUED"))
+
+# New runs are admitted up to a cap; beyond it requests queue briefly, then get 429.
+# In queue mode the shared job backlog is the watermark that sheds load.
+admission = AdmissionController(
+    max_in_flight=settings.admission.get("max_in_flight", 2 * settings.max_concurrent_runs),
+    max_waiting=settings.admission.get("max_waiting", 256),
+    max_wait_seconds=settings.admission.get("max_wait_seconds", 10.0),
+    retry_after_seconds=settings.admission.get("retry_after_seconds", 5),
+    backlog=lambda: job_queue.count("QUEUED"),
+    backlog_watermark=settings.admission.get("job_queue_watermark")
+)
+registry.gauge("api_admission_in_flight", "Admitted workflow runs not finished yet.", callback=lambda: admission.in_flight)
+registry.gauge("api_admission_waiting", "Requests waiting for admission.", callback=lambda: admission.waiting)
+
+@api.exception_handler(Throttled)
+async def throttled_handler(request: Request, exc: Throttled):
+    return JSONResponse(
+        status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(int(round(exc.retry_after)))}
+    )
+
+# "inline": graph runs on WORKFLOW_EXECUTOR in this process.
+# "queue": start/resume/retry/wake jobs go to the durable job queue and run in worker.py processes.
+EXECUTION_MODE = settings.execution.get("mode", "inline")
+
+async def _wake_parked(timer: Dict[str, Any]) -> None:
+    """Timer scheduler callback: resume a parked thread in the background (pool or job queue)."""
+    job = {"thread_id": timer["thread_id"], "reason": timer["wake_reason"], "reply": timer["reply"]}
+    priority = {"lane": timer["lane"], "score": timer["priority"]} if timer["lane"] else None
+    await _execute("wake", timer["thread_id"], job, background=True, priority=priority)
 
-class InvoiceInput(BaseModel):
-    invoice_id: str
-    vendor_name: str
-    amount: float = 0
-    # ... other fields
+# Threads parked by CLARIFY wait here (durably) for the vendor's reply or their deadline
+timer_scheduler = TimerScheduler(
+    timer_store,
+    wake=_wake_parked,
+    batch_size=settings.timers.get("batch_size", 500),
+    lease_seconds=settings.timers.get("wake_lease_seconds", 300),
+    max_sleep_seconds=settings.timers.get("max_sleep_seconds", 30)
+)
+registry.gauge("workflow_timers_parked", "Threads parked on a timer (waiting for a vendor reply).", callback=lambda: timer_store.count("PARKED"))
 
 class DecisionInput(BaseModel):
     checkpoint_id: str
@@ -36,97 +144,486 @@ class DecisionInput(BaseModel):
     notes: Optional[str] = None
     reviewer_id: str
 
+class ClarificationReply(BaseModel):
+    correlation_key: str
+    message: Optional[str] = None
+    attachments: List[str] = []
+
+
+def _run_tracked(thread_id: str, fn, *args, on_done=None) -> None:
+    """Background wrapper: keeps ACTIVE_RUNS/RUN_ERRORS in sync for the status endpoint."""
+    ACTIVE_RUNS[thread_id] = "RUNNING"
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.exception(f"Background run failed for thread {thread_id}")
+        RUN_ERRORS[thread_id] = str(e)
+    finally:
+        ACTIVE_RUNS.pop(thread_id, None)
+        if on_done is not None:
+            on_done()
+
+
+def _submit_background(thread_id: str, fn, *args, on_done=None, priority=None) -> None:
+    ACTIVE_RUNS[thread_id] = "QUEUED"
+    RUN_ERRORS.pop(thread_id, None)
+    WORKFLOW_EXECUTOR.submit_to(priority, functools.partial(_run_tracked, thread_id, fn, *args, on_done=on_done))
+
+
+async def _run_in_executor(fn, *args, priority=None):
+    return await asyncio.wrap_future(WORKFLOW_EXECUTOR.submit_to(priority, fn, *args))
+
+
+async def _wait_for_job(job_id: int) -> Dict[str, Any]:
+    """Poll a queued job until a worker finishes it; raises if it failed."""
+    interval = settings.execution.get("poll_interval_ms", 50) / 1000
+    while True:
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job["status"] == "DONE":
+            return job["result"]
+        if job["status"] == "FAILED":
+            raise RuntimeError(job["error"] or "Job failed")
+        await asyncio.sleep(interval)
+
+
+async def _execute(kind: str, thread_id: str, job: Dict[str, Any], background: bool = False,
+                   priority: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Run a start/resume/retry/wake job: on this process's pool (inline mode) or through
+    the durable job queue for worker processes (queue mode), scheduled by the invoice's
+    `priority` lane in both. Background callers get QUEUED back at once.
+
+    New runs must be admitted first (raises Throttled when shed); resumes and retries
+    are not, so work already in the system can always finish.
+    """
+    release = None
+    if kind == "start":
+        await admission.acquire()
+        release = admission.release
+    try:
+        if EXECUTION_MODE == "queue":
+            job_id = await asyncio.to_thread(job_queue.enqueue, kind, thread_id, job, None, priority)
+            if background:
+                return {"status": "QUEUED", "thread_id": thread_id, "job_id": job_id}
+            return await _wait_for_job(job_id)
+
+        if background:
+            # The slot is held until the background run finishes
+            _submit_background(thread_id, execute_job, kind, job, on_done=release, priority=priority)
+            release = None
+            return {"status": "QUEUED", "thread_id": thread_id}
+        return await _run_in_executor(execute_job, kind, job, priority=priority)
+    finally:
+        if release is not None:
+            release()
+
+
+async def _iterate_in_executor(gen_fn, *args, on_done=None, priority=None) -> AsyncIterator[Any]:
+    """Drive a blocking generator on the workflow pool and hand its items to the loop as they appear.
+
+    `on_done` is called exactly once as soon as iteration starts: from the pool thread
+    once the generator is exhausted or fails, or here if it cannot be submitted.
+    """
+    loop = asyncio.get_running_loop()
+    items: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def _drain():
+        try:
+            for item in gen_fn(*args):
+                loop.call_soon_threadsafe(items.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(items.put_nowait, e)
+        finally:
+            if on_done is not None:
+                on_done()
+            loop.call_soon_threadsafe(items.put_nowait, done)
+
+    try:
+        WORKFLOW_EXECUTOR.submit_to(priority, _drain)
+    except BaseException:
+        if on_done is not None:
+            on_done()
+        raise
+    while True:
+        item = await items.get()
+        if item is done:
+            return
+        yield item
+
+
+def _validate_invoice(payload: Dict[str, Any]) -> None:
+    """Reject a payload that does not match inputs.invoice_payload (422), before a run is admitted."""
+    errors = validators.invoice_errors(payload)
+    if errors:
+        raise HTTPException(status_code=422, detail={"message": "Invalid invoice payload", "errors": errors})
+
+
 @api.post("/workflow/start")
-def start_workflow(payload: Dict[str, Any]):
-    """Start a new invoice processing workflow."""
-    thread_id = str(uuid.uuid4())
-    
-    # Initial State
-    initial_state: AgentState = {
-        "workflow_id": thread_id,
-        "status": "RUNNING",
-        "invoice_payload": payload,
-        "errors": [],
-        "audit_log": []
+async def start_workflow(payload: Dict[str, Any], background: bool = False):
+    """Start a new invoice processing workflow.
+
+    Payloads that do not match `inputs.invoice_payload` in workflow.json are rejected
+    with 422. With `background=true` the run is enqueued and the thread_id returned at
+    once; poll `GET /workflow/{thread_id}` for progress.
+    """
+    _validate_invoice(payload)
+    initial_state = new_initial_state(payload)
+    thread_id = initial_state["workflow_id"]
+
+    try:
+        return await _execute("start", thread_id, {"initial_state": initial_state}, background, initial_state["priority"])
+    except Throttled:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.post("/workflow/stream")
+async def stream_workflow(payload: Dict[str, Any], request: Request):
+    """Start a new workflow and stream each stage's output as soon as its node returns.
+
+    NDJSON by default (`{"stage": ..., "output": ...}` lines, then a final line with
+    `status` PAUSED/COMPLETED/DUPLICATE/FAILED); Server-Sent Events when the client accepts
+    `text/event-stream`. The run continues in the background if the client goes away.
+    Streamed runs always execute in the API process, whatever the execution mode.
+    """
+    _validate_invoice(payload)
+    await admission.acquire()
+    # Once the event generator starts, the run releases the slot when it ends.
+    # Until then the slot is ours: released if building the response fails, or
+    # after the response if the client left before the generator ever ran.
+    run_started = False
+
+    def _release_unless_started():
+        nonlocal run_started
+        if not run_started:
+            run_started = True
+            admission.release()
+
+    try:
+        initial_state = new_initial_state(payload)
+        thread_id = initial_state["workflow_id"]
+        sse = "text/event-stream" in request.headers.get("accept", "")
+
+        async def _events():
+            nonlocal run_started
+            run_started = True
+            async for item in _iterate_in_executor(
+                stream_run, initial_state, thread_id, on_done=admission.release, priority=initial_state["priority"]
+            ):
+                if isinstance(item, Exception):
+                    logger.error(f"Streamed run failed for thread {thread_id}: {item}")
+                    item = {"status": "FAILED", "thread_id": thread_id, "error": str(item)}
+                if sse:
+                    yield f"event: {'stage' if 'stage' in item else 'outcome'}\ndata: {json.dumps(item, default=str)}\n\n"
+                else:
+                    yield json.dumps(item, default=str) + "\n"
+
+        return StreamingResponse(
+            _events(),
+            media_type="text/event-stream" if sse else "application/x-ndjson",
+            headers={"X-Thread-Id": thread_id},
+            background=BackgroundTask(_release_unless_started)
+        )
+    except BaseException:
+        _release_unless_started()
+        raise
+
+def _parse_batch(body: bytes, content_type: str) -> List[Any]:
+    """Split a batch body (JSON array or NDJSON) into invoice payloads.
+
+    Unparseable NDJSON lines are kept as exceptions so they can be reported
+    per item instead of failing the whole batch.
+    """
+    if "ndjson" not in content_type and body.lstrip().startswith(b"["):
+        return json.loads(body)
+
+    payloads = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            payloads.append(json.loads(line))
+        except ValueError as e:
+            payloads.append(e)
+    return payloads
+
+
+async def _run_batch_item(index: int, payload: Any) -> Dict[str, Any]:
+    """Run one invoice of a batch and summarize the outcome (never raises)."""
+    if isinstance(payload, Exception) or not isinstance(payload, dict):
+        return {"index": index, "status": "FAILED", "error": f"Invalid invoice payload: {payload}"}
+    errors = validators.invoice_errors(payload)
+    if errors:
+        return {"index": index, "invoice_id": payload.get("invoice_id"), "status": "INVALID", "errors": errors}
+
+    initial_state = new_initial_state(payload)
+    thread_id = initial_state["workflow_id"]
+    result = {"index": index, "invoice_id": payload.get("invoice_id"), "thread_id": thread_id}
+    try:
+        outcome = await _execute("start", thread_id, {"initial_state": initial_state}, priority=initial_state["priority"])
+    except Throttled as e:
+        return {**result, "status": "REJECTED", "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        logger.exception(f"Batch item {index} failed")
+        return {**result, "status": "FAILED", "error": str(e)}
+
+    result["status"] = outcome["status"]
+    if outcome["status"] == "PAUSED":
+        result["checkpoint_id"] = outcome["checkpoint_id"]
+    elif outcome["status"] == "DUPLICATE":
+        result["duplicate_of"] = outcome["duplicate_of"]
+    elif outcome["status"] == "FAILED":
+        result["failed_stage"] = outcome["failed_stage"]
+        result["error"] = outcome["error"]
+    return result
+
+
+@api.post("/workflow/batch")
+async def start_batch(request: Request, concurrency: Optional[int] = None):
+    """Start one workflow per invoice in a JSON array or NDJSON body.
+
+    Results are streamed back as NDJSON, one line per invoice in completion order
+    (COMPLETED, PAUSED with checkpoint_id, DUPLICATE with duplicate_of, INVALID with the
+    schema errors, REJECTED with retry_after when shed by admission control, or FAILED
+    with failed_stage). `index` refers to the
+    invoice's position in the request.
+    """
+    concurrency = concurrency or settings.batch_concurrency
+    concurrency = max(1, min(concurrency, settings.max_concurrent_runs))
+
+    # The body has to be fully read before the response starts streaming
+    try:
+        payloads = _parse_batch(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {e}")
+    if not isinstance(payloads, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON")
+
+    async def _results():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def _run_item(index: int, payload: Any):
+            async with slots:
+                return await _run_batch_item(index, payload)
+
+        tasks = [asyncio.create_task(_run_item(i, p)) for i, p in enumerate(payloads)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(_results(), media_type="application/x-ndjson")
+
+@api.get("/workflow/{thread_id}")
+def get_workflow_status(thread_id: str):
+    """Report the current status of a workflow thread from the checkpointer."""
+    if thread_id in ACTIVE_RUNS:
+        return {"thread_id": thread_id, "status": ACTIVE_RUNS[thread_id]}
+    if thread_id in RUN_ERRORS:
+        return {"thread_id": thread_id, "status": "FAILED", "error": RUN_ERRORS[thread_id]}
+    if EXECUTION_MODE == "queue":
+        job = job_queue.latest_for_thread(thread_id)
+        if job and job["status"] in ("QUEUED", "RUNNING"):
+            return {"thread_id": thread_id, "status": job["status"], "job_id": job["job_id"], "attempts": job["attempts"]}
+        if job and job["status"] == "FAILED":
+            return {"thread_id": thread_id, "status": "FAILED", "error": job["error"], "job_id": job["job_id"]}
+
+    snapshot = app.get_state({"configurable": {"thread_id": thread_id}})
+    if not snapshot.values:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+
+    values = snapshot.values
+    response = {
+        "thread_id": thread_id,
+        "next": list(snapshot.next),
+        "completed_stages": [key for key in values if key.isupper() and values[key] is not None],
     }
-    
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    # Run the graph until the first interruption or end
-    # We run it in a separate thread or just await it if it was async, 
-    # but LangGraph sync invoke blocks. 
-    # For this demo, we'll block.
-    
-    # We need to catch the interruption.
-    # invoke() returns the final state. If interrupted, it returns the state at interruption.
-    
+    if values.get("status") == "FAILED":
+        # Stopped at the last good checkpoint; POST /workflow/{thread_id}/retry resumes it
+        response["status"] = "FAILED"
+        response["errors"] = values.get("errors", [])
+    elif values.get("status") == "WAITING":
+        # Parked after CLARIFY until the vendor replies or the deadline passes
+        response["status"] = "WAITING"
+        response["correlation_key"] = values["CLARIFY"]["correlation_key"]
+        response["reply_deadline"] = values["CLARIFY"]["reply_deadline"]
+    elif values.get("status") == "DUPLICATE":
+        # (A FAILED thread retried after a resubmission took its invoice still has stages pending)
+        response["status"] = "DUPLICATE"
+        response["duplicate_of"] = values["INTAKE"]["duplicate_of"]
+    elif snapshot.next:
+        response["status"] = "PAUSED"
+        if "CHECKPOINT_HITL" in values:
+            response["checkpoint_id"] = values["CHECKPOINT_HITL"]["checkpoint_id"]
+    elif values.get("status") == "COMPLETED":
+        response["status"] = "COMPLETED"
+        response["final_payload"] = values["COMPLETE"]["final_payload"]
+    elif values.get("status") == "INVALID":
+        response["status"] = "INVALID"
+        response["errors"] = values["INTAKE"]["validation_errors"]
+    else:
+        # Ended without reaching COMPLETE (e.g. an unknown human decision)
+        response["status"] = "ENDED"
+    return response
+
+@api.post("/workflow/{thread_id}/retry")
+async def retry_workflow(thread_id: str, background: bool = False):
+    """Resume a FAILED workflow from its last successful checkpoint.
+
+    Only the stage that failed and the ones after it run again; completed stages
+    (OCR, ERP lookups, ...) are not redone.
+    """
+    snapshot = await asyncio.to_thread(app.get_state, {"configurable": {"thread_id": thread_id}})
+    if not snapshot.values:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if snapshot.values.get("status") != "FAILED":
+        raise HTTPException(status_code=409, detail=f"Workflow is {snapshot.values.get('status')}, not FAILED")
+
     try:
-        final_state = app.invoke(initial_state, config=config)
-        
-        # Check if we are at the checkpoint
-        snapshot = app.get_state(config)
-        if snapshot.next:
-            # We are paused.
-            # In a real app, the node would have pushed to the queue.
-            # Here we simulate the queue population based on the state.
-            if "CHECKPOINT_HITL" in snapshot.values:
-                ckpt_data = snapshot.values["CHECKPOINT_HITL"]
-                PENDING_REVIEWS[ckpt_data["checkpoint_id"]] = {
-                    "checkpoint_id": ckpt_data["checkpoint_id"],
-                    "thread_id": thread_id,
-                    "invoice_id": payload.get("invoice_id"),
-                    "amount": payload.get("amount"),
-                    "reason": ckpt_data.get("paused_reason")
-                }
-                return {"status": "PAUSED", "thread_id": thread_id, "checkpoint_id": ckpt_data["checkpoint_id"], "message": "Workflow paused for human review."}
-        
-        return {"status": "COMPLETED", "thread_id": thread_id, "final_state": final_state}
-        
+        return await _execute("retry", thread_id, {"thread_id": thread_id}, background, snapshot.values.get("priority"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api.get("/human-review/pending")
-def list_pending_reviews():
-    """List all workflows waiting for human review."""
-    return {"items": list(PENDING_REVIEWS.values())}
+def list_pending_reviews(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    vendor_name: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    status: str = "PENDING",
+):
+    """List workflows waiting for human review, one page at a time, most urgent first
+    (the invoice's scheduling priority, then oldest first).
+
+    Pass the returned `next_cursor` back as `cursor` to fetch the next page.
+    `last_event_id` is the outbox position read before the page; open the event
+    stream from the first page's value to receive every change made since.
+    """
+    limit = max(1, min(limit, 500))
+    # Read before listing: replaying from here may repeat a change, never miss one
+    last_event_id = review_queue.last_event_id()
+    try:
+        items, next_cursor = review_queue.list(
+            status=status, vendor_name=vendor_name, min_amount=min_amount,
+            max_amount=max_amount, cursor=cursor, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor, "last_event_id": last_event_id}
+
+@api.get("/human-review/stream")
+async def stream_review_events(request: Request, last_event_id: Optional[int] = None):
+    """Server-sent events for review queue changes.
+
+    Emits `review_added`, `review_decided` and `review_repaused` (queued again
+    after CLARIFY) with the review row as data. Pass the snapshot's
+    `last_event_id` to start from it; browsers resend Last-Event-ID on reconnect,
+    which takes precedence, and get the events they missed.
+    """
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        review_events.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api.post("/human-review/decision")
-def submit_decision(decision_input: DecisionInput):
+async def submit_decision(decision_input: DecisionInput, background: bool = False):
     """Submit a human decision to resume the workflow."""
-    if decision_input.checkpoint_id not in PENDING_REVIEWS:
+    # Claim the review so a concurrent submission for the same checkpoint gets a 404
+    review_data = review_queue.claim(decision_input.checkpoint_id, decision_input.decision, decision_input.reviewer_id)
+    if review_data is None:
         raise HTTPException(status_code=404, detail="Checkpoint not found")
-    
-    review_data = PENDING_REVIEWS[decision_input.checkpoint_id]
-    thread_id = review_data["thread_id"]
-    
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    # Update state with decision
-    app.update_state(config, {"HITL_DECISION": {"human_decision": decision_input.decision, "reviewer_id": decision_input.reviewer_id}})
-    
-    # Resume
-    # We use None as input to resume from the current state
-    app.invoke(None, config=config)
-    
-    # Cleanup queue
-    if decision_input.checkpoint_id in PENDING_REVIEWS:
-        del PENDING_REVIEWS[decision_input.checkpoint_id]
-
-    # Check if we are paused again
-    snapshot = app.get_state(config)
-    if snapshot.next:
-        if "CHECKPOINT_HITL" in snapshot.values:
-            ckpt_data = snapshot.values["CHECKPOINT_HITL"]
-            PENDING_REVIEWS[ckpt_data["checkpoint_id"]] = {
-                "checkpoint_id": ckpt_data["checkpoint_id"],
-                "thread_id": thread_id,
-                "invoice_id": review_data["invoice_id"], # Reuse from previous
-                "amount": review_data["amount"],
-                "reason": ckpt_data.get("paused_reason")
-            }
-            return {"status": "PAUSED", "next_stage": "CLARIFY"}
-    
-    return {"status": "RESUMED", "next_stage": "RECONCILE" if decision_input.decision == "ACCEPT" else "END"}
+
+    job = {"review": review_data, "decision": decision_input.decision, "reviewer_id": decision_input.reviewer_id}
+    try:
+        priority = {"lane": review_data.get("lane"), "score": review_data.get("priority", 0)} if review_data.get("lane") else None
+        outcome = await _execute("resume", review_data["thread_id"], job, background, priority)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if outcome.get("status") == "REFUSED":
+        raise HTTPException(status_code=409, detail=outcome["message"])
+    return outcome
+
+@api.post("/clarification/reply")
+async def submit_clarification_reply(reply: ClarificationReply):
+    """Deliver a vendor's reply to a clarification request.
+
+    The thread parked by CLARIFY under this correlation key is woken up and goes
+    back to human review; the reply is recorded in its CLARIFY output.
+    """
+    timer = await asyncio.to_thread(
+        timer_store.reply, reply.correlation_key, {"message": reply.message, "attachments": reply.attachments}
+    )
+    if timer is None:
+        existing = await asyncio.to_thread(timer_store.get_by_key, reply.correlation_key)
+        if existing is None:
+            raise HTTPException(status_code=404, detail="Unknown correlation key")
+        raise HTTPException(status_code=409, detail=f"Thread already woken ({existing['wake_reason']})")
+    return {"status": "ACCEPTED", "thread_id": timer["thread_id"]}
+
+@api.post("/admin/retention/run")
+async def run_retention():
+    """Run a checkpoint retention sweep now and report what it reclaimed."""
+    return await asyncio.to_thread(retention.run)
+
+@api.get("/admin/retention")
+def get_retention_report():
+    """Report of the most recent retention sweep."""
+    return {"policy": retention.policy, "last_report": retention.last_report}
+
+@api.get("/admin/cache")
+def get_cache_stats():
+    """Hit/miss counters and sizes of the MCP tool result cache and the OCR parse cache."""
+    return {"tool_cache": tool_cache.stats(), "parse_cache": parse_cache.stats()}
+
+@api.get("/admin/tools")
+def get_tool_health():
+    """Per-provider latency, error rate, cost and circuit state seen by BigtoolPicker."""
+    return {"policy": bigtool.policy, "tools": bigtool.stats()}
+
+@api.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage/tool latency histograms, outcome counters and queue gauges (Prometheus text format)."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@api.get("/admin/batching")
+def get_batching_stats():
+    """Items, batches and average batch size of the POSTING and NOTIFY micro-batchers."""
+    return {"posting": posting_batcher.stats(), "notify": notify_batcher.stats()}
+
+@api.get("/admin/scheduler")
+def get_scheduler_stats():
+    """Queued/dispatched runs and the oldest wait per priority lane of the workflow pool."""
+    return {"lanes": WORKFLOW_EXECUTOR.stats(), "starvation_seconds": WORKFLOW_EXECUTOR.starvation_seconds}
+
+@api.get("/admin/timers")
+def get_timer_stats():
+    """Parked/waking timers, wakeups so far and time to the next due timer."""
+    return timer_scheduler.stats()
+
+@api.get("/admin/limits")
+def get_limits():
+    """API admission state and the per-server/per-tool MCP rate limits with current in-flight calls."""
+    return {
+        "admission": admission.stats(),
+        "mcp": {"COMMON": common_client.limiter.stats(), "ATLAS": atlas_client.limiter.stats()}
+    }
+
+@api.post("/admin/po-store/sync")
+async def sync_po_store():
+    """Pull PO/GRN changes from the ERP into the local replica now."""
+    return await asyncio.to_thread(po_store.sync, atlas_client)
+
+@api.get("/admin/po-store")
+def get_po_store_stats():
+    """Size, sync watermark and hit/miss counters of the local PO/GRN replica."""
+    return {"po_store": po_store.stats()}
 
 if __name__ == "__main__":
     uvicorn.run(api, host="0.0.0.0", port=8000)
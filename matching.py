@@ -0,0 +1,158 @@
+from typing import Any, Dict, List
+
+import numpy as np
+
+_EPS = 1e-9
+
+
+def _line_arrays(lines: List[Dict[str, Any]]):
+    """(qty, unit_price, total) arrays for a list of line items; missing fields are derived."""
+    qty = np.array([float(line.get("qty") or 1) for line in lines], dtype=float)
+    total = np.array([float(line.get("total") or 0) for line in lines], dtype=float)
+    unit_price = np.array([
+        float(line["unit_price"]) if line.get("unit_price") is not None else 0.0 for line in lines
+    ], dtype=float)
+    # Fill whichever of unit_price/total is missing from the other
+    unit_price = np.where(unit_price > 0, unit_price, total / np.maximum(qty, _EPS))
+    total = np.where(total > 0, total, unit_price * qty)
+    return qty, unit_price, total
+
+
+def score_lines(inv_lines: List[Dict[str, Any]], po_lines: List[Dict[str, Any]], tolerance: float) -> np.ndarray:
+    """
+    Score every invoice line against every PO line at once: (n_invoice, n_po) matrix.
+    A pair scores 0 unless the unit price is within tolerance and the invoiced
+    quantity does not exceed the ordered quantity by more than the tolerance;
+    otherwise 1 minus the mean relative price/quantity deviation.
+    """
+    inv_qty, inv_price, _ = _line_arrays(inv_lines)
+    po_qty, po_price, _ = _line_arrays(po_lines)
+
+    price_dev = np.abs(inv_price[:, None] - po_price[None, :]) / np.maximum(po_price[None, :], _EPS)
+    qty_dev = np.abs(inv_qty[:, None] - po_qty[None, :]) / np.maximum(po_qty[None, :], _EPS)
+    within = (price_dev <= tolerance) & (inv_qty[:, None] <= po_qty[None, :] * (1 + tolerance))
+    return np.where(within, np.clip(1 - (price_dev + qty_dev) / 2, 0, 1), 0.0)
+
+
+def assign_lines(scores: np.ndarray) -> np.ndarray:
+    """
+    One-to-one assignment of invoice lines (rows) to PO lines (columns).
+    Each round every unassigned row bids for its best free column and each column
+    goes to its highest bidder, so rounds scale with conflicts, not with line count.
+    Returns the PO line index per invoice line (-1 when unmatched).
+    """
+    n, m = scores.shape
+    assignment = np.full(n, -1)
+    free_cols = np.ones(m, dtype=bool)
+    open_rows = np.arange(n)
+    while open_rows.size and free_cols.any():
+        bids = np.where(free_cols[None, :], scores[open_rows], -1.0)
+        best_cols = bids.argmax(axis=1)
+        best_scores = bids[np.arange(open_rows.size), best_cols]
+        bidding = best_scores > 0
+        if not bidding.any():
+            break
+        rows, cols, vals = open_rows[bidding], best_cols[bidding], best_scores[bidding]
+
+        # Highest bid per column wins: sort by column, then score descending
+        order = np.lexsort((-vals, cols))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = cols[order][1:] != cols[order][:-1]
+        winners = order[first]
+
+        assignment[rows[winners]] = cols[winners]
+        free_cols[cols[winners]] = False
+        open_rows = rows[np.setdiff1d(np.arange(rows.size), winners)]
+    return assignment
+
+
+def two_way_match(
+    invoice_amount: float,
+    invoice_lines: List[Dict[str, Any]],
+    purchase_orders: List[Dict[str, Any]],
+    match_threshold: float,
+    tolerance_pct: float,
+) -> Dict[str, Any]:
+    """
+    Match an invoice to candidate POs at header and line level.
+    Returns the MATCH_TWO_WAY output: match_score, match_result, tolerance_pct
+    (the header variance found) and match_evidence.
+    """
+    tolerance = tolerance_pct / 100
+    invoice_amount = float(invoice_amount or 0)
+
+    if not purchase_orders:
+        return {
+            "match_score": 0.0,
+            "match_result": "FAILED",
+            "tolerance_pct": 100.0,
+            "match_evidence": {"reason": "No candidate purchase orders found"}
+        }
+
+    po_lines, po_line_refs = [], []
+    for po in purchase_orders:
+        for index, line in enumerate(po.get("lines", [])):
+            po_lines.append(line)
+            po_line_refs.append((po["po_number"], index))
+
+    matched_lines, unmatched_lines = [], []
+    line_score = None
+    matched_po_numbers = set()
+    if invoice_lines and po_lines:
+        scores = score_lines(invoice_lines, po_lines, tolerance)
+        assignment = assign_lines(scores)
+        _, _, inv_totals = _line_arrays(invoice_lines)
+        assigned = assignment >= 0
+        line_scores = np.where(assigned, scores[np.arange(len(invoice_lines)), np.maximum(assignment, 0)], 0.0)
+        # Value-weighted share of the invoice that found a PO line
+        line_score = float((line_scores * inv_totals).sum() / max(inv_totals.sum(), _EPS))
+
+        for i, j in enumerate(assignment.tolist()):
+            if j < 0:
+                unmatched_lines.append(i)
+                continue
+            po_number, po_line = po_line_refs[j]
+            matched_po_numbers.add(po_number)
+            matched_lines.append({
+                "invoice_line": i, "po_number": po_number, "po_line": po_line,
+                "score": round(float(line_scores[i]), 4)
+            })
+
+    # Header: compare against the POs the lines landed on, else the closest single PO
+    if matched_po_numbers:
+        po_total = sum(float(po.get("amount") or 0) for po in purchase_orders if po["po_number"] in matched_po_numbers)
+    else:
+        po_amounts = np.array([float(po.get("amount") or 0) for po in purchase_orders])
+        closest = int(np.abs(po_amounts - invoice_amount).argmin())
+        po_total = float(po_amounts[closest])
+        matched_po_numbers = {purchase_orders[closest]["po_number"]}
+    header_variance = abs(invoice_amount - po_total) / max(po_total, _EPS)
+    header_score = max(0.0, 1 - header_variance)
+
+    match_score = header_score if line_score is None else (header_score + line_score) / 2
+    header_ok = header_variance <= tolerance
+    matched = header_ok and match_score >= match_threshold and not unmatched_lines
+
+    if matched:
+        reason = "Perfect match" if header_variance == 0 and match_score == 1 else "Matched within tolerance"
+    elif not header_ok:
+        reason = f"Invoice amount differs from PO total by {header_variance * 100:.1f}% (tolerance {tolerance_pct}%)"
+    elif unmatched_lines:
+        reason = f"{len(unmatched_lines)} of {len(invoice_lines)} invoice lines have no matching PO line"
+    else:
+        reason = f"Match score {match_score:.2f} below threshold {match_threshold}"
+
+    return {
+        "match_score": round(match_score, 4),
+        "match_result": "MATCHED" if matched else "FAILED",
+        "tolerance_pct": round(header_variance * 100, 2),
+        "match_evidence": {
+            "reason": reason,
+            "matched_pos": sorted(matched_po_numbers),
+            "po_total": po_total,
+            "invoice_amount": invoice_amount,
+            "line_score": None if line_score is None else round(line_score, 4),
+            "matched_lines": matched_lines,
+            "unmatched_invoice_lines": unmatched_lines
+        }
+    }
@@ -1,92 +1,530 @@
+import asyncio
+import hashlib
+import itertools
+import json
 import logging
-from typing import Any, Dict
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import httpx
+
+from config import settings
+from bigtool import bigtool
+from tool_cache import tool_cache
+from metrics import TOOL_CALLS, TOOL_DURATION
+from ratelimit import ServerLimiter
 
 logger = logging.getLogger("MCPClient")
 
+MCP_PROTOCOL_VERSION = "2025-03-26"
+
+
+class MCPError(Exception):
+    """Raised when an MCP server returns an error or an invalid response."""
+
+
+def mock_tool_response(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Canned tool results used by the in-process mock and the stand-in MCP server."""
+    # Mock responses based on tool name
+    if tool_name == "normalize_vendor":
+        return {"normalized_name": arguments.get("name", "").upper().strip(), "tax_id": "MOCK-TAX-ID-123"}
+
+    elif tool_name == "compute_flags":
+        return {"missing_info": [], "risk_score": 10}
+
+    elif tool_name == "enrich_vendor":
+        return {"enrichment_meta": {"founded": 2000, "employees": 500}}
+
+    elif tool_name == "parse_invoice_lines":
+        # Mock parsing logic: "OCR" recovers the submitted lines, or one line for the total
+        amount = arguments.get("amount") or 100
+        line_items = arguments.get("line_items") or [{"desc": "Item 1", "qty": 1, "unit_price": amount, "total": amount}]
+        invoice_id = arguments.get("invoice_id")
+        return {
+            "invoice_text": "Mock Invoice Text",
+            "parsed_line_items": line_items,
+            "detected_pos": [f"PO-{invoice_id}" if invoice_id else "PO-999"],
+            "currency": "USD",
+            "parsed_dates": {"invoice_date": "2023-10-01", "due_date": "2023-11-01"}
+        }
+
+    elif tool_name == "fetch_erp_data":
+        # Mock ERP: an open PO for the requested amount.
+        # For demo purposes, an amount of 9999 finds only a PO for 100, so matching fails.
+        amount = arguments.get("amount") or 100
+        if amount == 9999:
+            amount = 100
+        po_numbers = arguments.get("po_numbers") or ["PO-999"]
+        return {
+            "matched_pos": [{
+                "po_number": po_numbers[0],
+                "vendor_tax_id": arguments.get("vendor_tax_id"),
+                "status": "OPEN",
+                "amount": amount,
+                "lines": [{"desc": "Item 1", "qty": 1, "unit_price": amount, "total": amount}]
+            }],
+            "matched_grns": [],
+            "history": []
+        }
+
+    elif tool_name == "fetch_erp_delta":
+        # Mock ERP change feed: nothing modified since the watermark
+        return {"purchase_orders": [], "grns": [], "watermark": arguments.get("since"), "has_more": False}
+
+    elif tool_name == "two_way_match":
+        # Simple mock logic: if amount matches PO amount, it's a match
+        invoice_amt = arguments.get("invoice_amount", 0)
+        po_amt = arguments.get("po_amount", 0)
+        threshold = arguments.get("threshold", 0.9)
+
+        # For demo purposes, let's make it fail if invoice amount is 9999
+        if invoice_amt == 9999:
+            return {
+                "match_score": 0.5,
+                "match_result": "FAILED",
+                "tolerance_pct": 0,
+                "match_evidence": {"reason": "Forced failure for demo"}
+            }
+
+        return {
+            "match_score": 1.0,
+            "match_result": "MATCHED",
+            "tolerance_pct": 0,
+            "match_evidence": {"reason": "Perfect match"}
+        }
+
+    elif tool_name == "create_accounting_entries":
+        return {
+            "accounting_entries": [{"debit": "Expense", "credit": "AP", "amount": arguments.get("amount")}],
+            "reconciliation_report": {"status": "balanced"}
+        }
+
+    elif tool_name == "post_to_erp":
+        return {
+            "posted": True,
+            "erp_txn_id": "TXN-777",
+            "scheduled_payment_id": "PAY-888"
+        }
+
+    elif tool_name == "post_to_erp_batch":
+        # Mock ERP bulk posting: one result per entry; the idempotency key fixes the txn id
+        results = []
+        for entry in arguments.get("entries", []):
+            ref = hashlib.sha256(entry["idempotency_key"].encode()).hexdigest()[:8].upper()
+            results.append({
+                "idempotency_key": entry["idempotency_key"],
+                "posted": True,
+                "erp_txn_id": f"TXN-{ref}",
+                "scheduled_payment_id": f"PAY-{ref}"
+            })
+        return {"results": results}
+
+    elif tool_name == "send_notification":
+        return {
+            "notify_status": {"email": "sent"},
+            "notified_parties": ["vendor@example.com", "finance@internal.com"]
+        }
+
+    return {"status": "mock_success", "data": "default_mock_response"}
+
+
+def _tool_result(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Unwrap a JSON-RPC tools/call response into the tool's structured result."""
+    if "error" in response:
+        raise MCPError(f"MCP error {response['error'].get('code')}: {response['error'].get('message')}")
+    result = response.get("result", {})
+    if result.get("isError"):
+        raise MCPError(f"Tool error: {result.get('content')}")
+    if "structuredContent" in result:
+        return result["structuredContent"]
+    for item in result.get("content", []):
+        if item.get("type") == "text":
+            return json.loads(item["text"])
+    raise MCPError("Tool returned no structured or text content")
+
+
+def _initialize_request(request_id: int) -> Dict[str, Any]:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "initialize",
+        "params": {
+            "protocolVersion": MCP_PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": settings.workflow_name, "version": "1.0"}
+        }
+    }
+
+
+class MockTransport:
+    """In-process transport returning canned responses (demo/default)."""
+
+    def call(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return mock_tool_response(tool_name, arguments)
+
+    async def acall(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return mock_tool_response(tool_name, arguments)
+
+    def close(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+class HttpTransport:
+    """
+    MCP over streamable HTTP. One pooled httpx client per server keeps
+    connections warm across invoices; the session is initialized once.
+    """
+
+    def __init__(self, url: str, timeout: float = 10.0, max_connections: int = 32, keepalive_expiry: float = 60.0):
+        self.url = url
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._client = httpx.Client(limits=self.limits, timeout=timeout)
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._ids = itertools.count(1)
+        self._session_id: Optional[str] = None
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Accept": "application/json, text/event-stream"}
+        if self._session_id:
+            headers["Mcp-Session-Id"] = self._session_id
+        return headers
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> Dict[str, Any]:
+        response.raise_for_status()
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            # Single-response SSE stream: take the last data line
+            data = [line[5:].strip() for line in response.text.splitlines() if line.startswith("data:")]
+            if not data:
+                raise MCPError("Empty event stream from MCP server")
+            return json.loads(data[-1])
+        return response.json()
+
+    def _ensure_session(self) -> None:
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            response = self._client.post(self.url, json=_initialize_request(next(self._ids)), headers=self._headers())
+            self._parse(response)
+            self._session_id = response.headers.get("mcp-session-id")
+            self._client.post(
+                self.url, json={"jsonrpc": "2.0", "method": "notifications/initialized"}, headers=self._headers()
+            )
+            self._initialized = True
+
+    def _request(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "jsonrpc": "2.0",
+            "id": next(self._ids),
+            "method": "tools/call",
+            "params": {"name": tool_name, "arguments": arguments}
+        }
+
+    def call(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        self._ensure_session()
+        response = self._client.post(
+            self.url, json=self._request(tool_name, arguments), headers=self._headers(),
+            timeout=timeout or self.timeout
+        )
+        return _tool_result(self._parse(response))
+
+    async def acall(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        # The handshake is sync and happens once per server
+        await asyncio.to_thread(self._ensure_session)
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        response = await self._aclient.post(
+            self.url, json=self._request(tool_name, arguments), headers=self._headers(),
+            timeout=timeout or self.timeout
+        )
+        return _tool_result(self._parse(response))
+
+    def close(self) -> None:
+        """Close both clients; from a running event loop use `aclose` instead."""
+        self._client.close()
+        if self._aclient is not None:
+            aclient, self._aclient = self._aclient, None
+            asyncio.run(aclient.aclose())
+
+    async def aclose(self) -> None:
+        self._client.close()
+        if self._aclient is not None:
+            aclient, self._aclient = self._aclient, None
+            await aclient.aclose()
+
+
+class _StdioProcess:
+    """One MCP server process. Responses are read from the raw stdout fd through our
+    own line buffer: a buffered reader could hold a complete line that select()
+    then never reports as readable."""
+
+    def __init__(self, command: List[str]):
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._fd = self.proc.stdout.fileno()
+        self._buffer = b""
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self.proc.stdin.write(json.dumps(message).encode() + b"\n")
+        self.proc.stdin.flush()
+
+    def read_line(self, deadline: float, timeout: float) -> bytes:
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._fd], [], [], remaining)[0]:
+                raise TimeoutError(f"MCP stdio server did not answer within {timeout}s")
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                raise MCPError("MCP stdio server exited")
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line
+
+    def exchange(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        self.send(message)
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self.read_line(deadline, timeout)
+            if not line.strip():
+                continue
+            response = json.loads(line)
+            # Skip server notifications/requests until our response arrives
+            if response.get("id") == message["id"]:
+                return response
+
+    def kill(self) -> None:
+        self.proc.kill()
+
+
+class StdioTransport:
+    """
+    MCP over stdio. Keeps a pool of long-lived server processes so calls reuse an
+    initialized session instead of spawning a process per invoice.
+    """
+
+    def __init__(self, command: List[str], pool_size: int = 4, timeout: float = 10.0):
+        self.command = command
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._size = pool_size
+        self._spawned = 0
+        # Guards the idle list, the process count and the set of live processes;
+        # notified whenever a process is returned or a pool slot frees up
+        self._cond = threading.Condition()
+        self._idle: List[_StdioProcess] = []
+        # Every live process, idle or checked out, so close() can kill them all
+        self._procs: Set[_StdioProcess] = set()
+        self._closed = False
+
+    def _spawn(self) -> _StdioProcess:
+        # Runs outside the lock: a slow handshake does not hold up other callers
+        proc = _StdioProcess(self.command)
+        with self._cond:
+            self._procs.add(proc)
+        try:
+            proc.exchange(_initialize_request(next(self._ids)), self.timeout)
+            proc.send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+        except Exception:
+            self._discard(proc)
+            raise
+        return proc
+
+    def _discard(self, proc: _StdioProcess) -> None:
+        """Kill a process and free its pool slot; a waiting caller spawns the replacement."""
+        proc.kill()
+        with self._cond:
+            self._procs.discard(proc)
+            self._spawned -= 1
+            self._cond.notify()
+
+    def _release(self, proc: _StdioProcess) -> None:
+        with self._cond:
+            if not self._closed:
+                self._idle.append(proc)
+                self._cond.notify()
+                return
+        self._discard(proc)
+
+    def _checkout(self, timeout: float) -> _StdioProcess:
+        """An idle process, a new one while the pool is below size, or the next one
+        returned within `timeout` (TimeoutError otherwise)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise MCPError("MCP stdio transport is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._spawned < self._size:
+                    self._spawned += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No MCP stdio process free within {timeout}s (pool size {self._size})")
+                self._cond.wait(remaining)
+        return self._spawn()
+
+    def call(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        timeout = timeout or self.timeout
+        proc = self._checkout(timeout)
+        message = {
+            "jsonrpc": "2.0",
+            "id": next(self._ids),
+            "method": "tools/call",
+            "params": {"name": tool_name, "arguments": arguments}
+        }
+        try:
+            response = proc.exchange(message, timeout)
+        except Exception:
+            # The process may hold a stale response (or close() killed it); replace it
+            self._discard(proc)
+            raise
+        self._release(proc)
+        return _tool_result(response)
+
+    async def acall(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.call, tool_name, arguments, timeout)
+
+    def close(self) -> None:
+        """Kill every server process, including those in the middle of a call (which then fail)."""
+        with self._cond:
+            self._closed = True
+            procs = list(self._procs)
+            self._idle.clear()
+            self._cond.notify_all()
+        for proc in procs:
+            proc.kill()
+
+    async def aclose(self) -> None:
+        self.close()
+
+
+def build_transport(server_config: Dict[str, Any]):
+    kind = server_config.get("transport", "mock")
+    if kind == "http":
+        return HttpTransport(
+            server_config["url"],
+            timeout=server_config.get("timeout_seconds", 10.0),
+            max_connections=server_config.get("max_connections", 32),
+            keepalive_expiry=server_config.get("keepalive_seconds", 60.0)
+        )
+    if kind == "stdio":
+        return StdioTransport(
+            server_config["command"],
+            pool_size=server_config.get("pool_size", 4),
+            timeout=server_config.get("timeout_seconds", 10.0)
+        )
+    if kind == "mock":
+        return MockTransport()
+    raise ValueError(f"Unknown MCP transport: {kind}")
+
+
 class MCPClient:
-    def __init__(self, server_name: str):
+    def __init__(self, server_name: str, transport=None, limiter: Optional[ServerLimiter] = None):
         self.server_name = server_name
+        self.transport = transport or MockTransport()
+        # Cache hits skip the limiter; only calls that reach the server count
+        self.limiter = limiter or ServerLimiter(server_name)
 
-    def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    def call_tool(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None,
+                  track: Optional[str] = None) -> Dict[str, Any]:
         """
-        Simulates calling a tool on an MCP server.
-        In a real implementation, this would make an RPC/HTTP call to the MCP server.
+        Calls a tool on the MCP server through the configured transport.
+
+        `track` names the Bigtool provider behind the call: calls that reach the
+        server (not cache hits) are recorded against its health.
         """
+        cache_key = tool_cache.key(self.server_name, tool_name, arguments)
+        if cache_key:
+            cached = tool_cache.get(tool_name, cache_key)
+            if cached is not None:
+                TOOL_CALLS.inc(server=self.server_name, tool=tool_name, outcome="cached")
+                return cached
+
         logger.info(f"[{self.server_name}] Calling tool '{tool_name}' with args: {arguments.keys()}")
-        
-        # Mock responses based on tool name
-        if tool_name == "normalize_vendor":
-            return {"normalized_name": arguments.get("name", "").upper().strip(), "tax_id": "MOCK-TAX-ID-123"}
-        
-        elif tool_name == "compute_flags":
-            return {"missing_info": [], "risk_score": 10}
-        
-        elif tool_name == "enrich_vendor":
-            return {"enrichment_meta": {"founded": 2000, "employees": 500}}
-        
-        elif tool_name == "parse_invoice_lines":
-            # Mock parsing logic
-            return {
-                "invoice_text": "Mock Invoice Text",
-                "parsed_line_items": [{"desc": "Item 1", "qty": 1, "unit_price": 100, "total": 100}],
-                "detected_pos": ["PO-999"],
-                "currency": "USD",
-                "parsed_dates": {"invoice_date": "2023-10-01", "due_date": "2023-11-01"}
-            }
-        
-        elif tool_name == "fetch_erp_data":
-            return {
-                "matched_pos": [{"po_number": "PO-999", "amount": 100}],
-                "matched_grns": [],
-                "history": []
-            }
-        
-        elif tool_name == "two_way_match":
-            # Simple mock logic: if amount matches PO amount, it's a match
-            invoice_amt = arguments.get("invoice_amount", 0)
-            po_amt = arguments.get("po_amount", 0)
-            threshold = arguments.get("threshold", 0.9)
-            
-            # For demo purposes, let's make it fail if invoice amount is 9999
-            if invoice_amt == 9999:
-                return {
-                    "match_score": 0.5,
-                    "match_result": "FAILED",
-                    "tolerance_pct": 0,
-                    "match_evidence": {"reason": "Forced failure for demo"}
-                }
-            
-            return {
-                "match_score": 1.0,
-                "match_result": "MATCHED",
-                "tolerance_pct": 0,
-                "match_evidence": {"reason": "Perfect match"}
-            }
-            
-        elif tool_name == "create_accounting_entries":
-            return {
-                "accounting_entries": [{"debit": "Expense", "credit": "AP", "amount": arguments.get("amount")}],
-                "reconciliation_report": {"status": "balanced"}
-            }
-            
-        elif tool_name == "post_to_erp":
-            return {
-                "posted": True,
-                "erp_txn_id": "TXN-777",
-                "scheduled_payment_id": "PAY-888"
-            }
-            
-        elif tool_name == "send_notification":
-            return {
-                "notify_status": {"email": "sent"},
-                "notified_parties": ["vendor@example.com", "finance@internal.com"]
-            }
+        with self.limiter.limit(tool_name):
+            started = time.perf_counter()
+            try:
+                with bigtool.track(track) if track else nullcontext():
+                    result = self.transport.call(tool_name, arguments, timeout)
+            except Exception:
+                self._observe(tool_name, started, "error")
+                raise
+            self._observe(tool_name, started, "ok")
+        if cache_key:
+            tool_cache.set(tool_name, cache_key, result)
+        return result
+
+    async def acall_tool(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None,
+                         track: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of call_tool; shares the transport's connection pool."""
+        cache_key = tool_cache.key(self.server_name, tool_name, arguments)
+        if cache_key:
+            cached = await asyncio.to_thread(tool_cache.get, tool_name, cache_key)
+            if cached is not None:
+                TOOL_CALLS.inc(server=self.server_name, tool=tool_name, outcome="cached")
+                return cached
+
+        logger.info(f"[{self.server_name}] Calling tool '{tool_name}' (async) with args: {arguments.keys()}")
+        async with self.limiter.alimit(tool_name):
+            started = time.perf_counter()
+            try:
+                with bigtool.track(track) if track else nullcontext():
+                    result = await self.transport.acall(tool_name, arguments, timeout)
+            except Exception:
+                self._observe(tool_name, started, "error")
+                raise
+            self._observe(tool_name, started, "ok")
+        if cache_key:
+            await asyncio.to_thread(tool_cache.set, tool_name, cache_key, result)
+        return result
 
-        return {"status": "mock_success", "data": "default_mock_response"}
+    def _observe(self, tool_name: str, started: float, outcome: str) -> None:
+        TOOL_DURATION.observe(time.perf_counter() - started, server=self.server_name, tool=tool_name, outcome=outcome)
+        TOOL_CALLS.inc(server=self.server_name, tool=tool_name, outcome=outcome)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+# Nodes are sync (SqliteSaver has no async API), so independent tool calls inside
+# a node fan out on this shared pool instead of an event loop.
+_fanout_executor = ThreadPoolExecutor(max_workers=settings.tool_fanout_workers, thread_name_prefix="mcp-fanout")
+
+def run_concurrently(*calls: Callable[[], Any]) -> List[Any]:
+    """Run independent zero-arg calls in parallel; results come back in call order."""
+    futures = [_fanout_executor.submit(call) for call in calls]
+    return [future.result() for future in futures]
 
 # Singleton instances for the two servers
-common_client = MCPClient("COMMON")
-atlas_client = MCPClient("ATLAS")
+def build_client(server_name: str) -> MCPClient:
+    server_config = settings.get_mcp_server_config(server_name)
+    return MCPClient(
+        server_name, build_transport(server_config), ServerLimiter(server_name, server_config.get("rate_limit"))
+    )
+
+common_client = build_client("COMMON")
+atlas_client = build_client("ATLAS")
 
 def get_mcp_client(server_name: str) -> MCPClient:
     if "COMMON" in server_name:
@@ -0,0 +1,91 @@
+"""
+Local stand-in MCP server serving the mock tool responses.
+
+HTTP:  python mcp_server.py --port 9001 [--latency-ms 20]
+stdio: python mcp_server.py --stdio
+
+Point a server at it in workflow.json, e.g.
+"mcp_servers": {"COMMON": {"transport": "http", "url": "http://localhost:9001/mcp"}}
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+
+from mcp_client import MCP_PROTOCOL_VERSION, mock_tool_response
+
+LATENCY_SECONDS = 0.0
+
+
+def handle_message(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Handle one JSON-RPC message. Returns None for notifications."""
+    if "id" not in message:
+        return None
+
+    method = message.get("method")
+    response = {"jsonrpc": "2.0", "id": message["id"]}
+    if method == "initialize":
+        response["result"] = {
+            "protocolVersion": MCP_PROTOCOL_VERSION,
+            "capabilities": {"tools": {}},
+            "serverInfo": {"name": "mock-mcp-server", "version": "1.0"}
+        }
+    elif method == "tools/call":
+        if LATENCY_SECONDS:
+            time.sleep(LATENCY_SECONDS)
+        params = message.get("params", {})
+        result = mock_tool_response(params.get("name"), params.get("arguments", {}))
+        response["result"] = {
+            "content": [{"type": "text", "text": json.dumps(result)}],
+            "structuredContent": result,
+            "isError": False
+        }
+    elif method == "ping":
+        response["result"] = {}
+    else:
+        response["error"] = {"code": -32601, "message": f"Method not found: {method}"}
+    return response
+
+
+api = FastAPI(title="Mock MCP Server")
+
+
+@api.post("/mcp")
+def mcp_endpoint(message: Dict[str, Any]):
+    response = handle_message(message)
+    if response is None:
+        return Response(status_code=202)
+    headers = {}
+    if message.get("method") == "initialize":
+        headers["Mcp-Session-Id"] = str(uuid.uuid4())
+    return JSONResponse(response, headers=headers)
+
+
+def serve_stdio() -> None:
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        response = handle_message(json.loads(line))
+        if response is not None:
+            sys.stdout.write(json.dumps(response) + "\n")
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in MCP server for local testing")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--stdio", action="store_true")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated per-call latency")
+    args = parser.parse_args()
+
+    LATENCY_SECONDS = args.latency_ms / 1000
+    if args.stdio:
+        serve_stdio()
+    else:
+        uvicorn.run(api, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,193 @@
+import datetime
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge whose value is either set directly or read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], float]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                return [f"{self.name} {float(self.callback())}"]
+            except Exception:
+                return []
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """(count, sum) per label set."""
+        with self._lock:
+            return {key: (counts[-1], total[0]) for key, (counts, total) in self._values.items()}
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total[0]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal in-process registry rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), callback: Callable[[], float] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback=callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram("invoice_stage_duration_seconds", "Wall time of each workflow stage.", ("stage", "outcome"))
+STAGE_RUNS = registry.counter("invoice_stage_runs_total", "Workflow stage executions by outcome.", ("stage", "outcome"))
+TOOL_DURATION = registry.histogram("mcp_tool_call_duration_seconds", "Latency of MCP tool calls.", ("server", "tool", "outcome"))
+TOOL_CALLS = registry.counter("mcp_tool_calls_total", "MCP tool calls by outcome (ok, error, cached).", ("server", "tool", "outcome"))
+CHECKPOINT_WRITE = registry.histogram("checkpoint_write_duration_seconds", "Time spent persisting checkpoints and pending writes.", ("operation",))
+
+
+def instrument_node(stage: str, fn: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Wrap a graph node: time it, count outcomes and append its timing to the state's audit_log."""
+
+    @functools.wraps(fn)
+    def _node(state):
+        started_at = datetime.datetime.now().isoformat()
+        started = time.perf_counter()
+        try:
+            update = fn(state)
+        except Exception:
+            elapsed = time.perf_counter() - started
+            STAGE_DURATION.observe(elapsed, stage=stage, outcome="error")
+            STAGE_RUNS.inc(stage=stage, outcome="error")
+            raise
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage, outcome="ok")
+        STAGE_RUNS.inc(stage=stage, outcome="ok")
+        entry = {"stage": stage, "started_at": started_at, "duration_ms": round(elapsed * 1000, 3)}
+        return {**(update or {}), "audit_log": [entry]}
+
+    return _node
+
+
+def instrument_saver(saver):
+    """Time the checkpoint writes of any checkpoint saver instance."""
+    for operation in ("put", "put_writes"):
+        method = getattr(saver, operation)
+
+        @functools.wraps(method)
+        def _timed(*args, _method=method, _operation=operation, **kwargs):
+            with CHECKPOINT_WRITE.time(operation=_operation):
+                return _method(*args, **kwargs)
+
+        setattr(saver, operation, _timed)
+    return saver
@@ -1,10 +1,19 @@
 import uuid
 import datetime
+import time
 from typing import Dict, Any
 from state import AgentState
 from config import settings
-from mcp_client import get_mcp_client
+from mcp_client import get_mcp_client, run_concurrently
 from bigtool import bigtool
+from matching import two_way_match
+from timers import timer_store
+from validation import validators
+from po_store import po_store
+from blob_store import blob_store
+from parse_cache import parse_cache
+from dedup_index import dedup_index
+from posting import post_invoice, notify_invoice
 
 
 def update_state(state: AgentState, key: str, value: Dict[str, Any]) -> Dict[str, Any]:
@@ -13,13 +22,26 @@ def update_state(state: AgentState, key: str, value: Dict[str, Any]) -> Dict[str
 
 def intake_node(state: AgentState) -> Dict[str, Any]:
     """INTAKE: Validate and persist."""
-    payload = state["invoice_payload"]
-    
+    payload = blob_store.load(state["invoice_payload"])
+
+    # Malformed invoices stop here, before any OCR/ERP call (and before dedup registers them)
+    validation_errors = validators.invoice_errors(payload)
+    if validation_errors:
+        return {
+            "INTAKE": {"validated": False, "validation_errors": validation_errors, "engest_ts": datetime.datetime.now().isoformat()},
+            "status": "INVALID"
+        }
+
+    # Resubmissions stop here, before OCR/ERP/posting run again
+    duplicate_of = dedup_index.check_and_register(payload, state["workflow_id"])
+    if duplicate_of and duplicate_of["match"] != "possible":
+        return {
+            "INTAKE": {"validated": False, "duplicate_of": duplicate_of, "engest_ts": datetime.datetime.now().isoformat()},
+            "status": "DUPLICATE"
+        }
+
     # Tool selection (Storage)
-    storage_tool = bigtool.select("storage", context={"type": "invoice"})
-    
-    # MCP Call (COMMON)
-    # In a real app, we'd call a validation tool here.
+    storage_tool = bigtool.select("storage", context={"type": "invoice"}, stage="INTAKE")
     
     output = {
         "raw_id": str(uuid.uuid4()),
@@ -27,18 +49,39 @@ def intake_node(state: AgentState) -> Dict[str, Any]:
         "validated": True,
         "storage_backend": storage_tool
     }
+    if duplicate_of:
+        # Same vendor, amount and date under another invoice number: the run goes on, but to human review
+        output["possible_duplicate_of"] = duplicate_of
     return {"INTAKE": output}
 
 def understand_node(state: AgentState) -> Dict[str, Any]:
     """UNDERSTAND: OCR and Parsing."""
+    payload = blob_store.load(state["invoice_payload"])
+
     # Tool selection (OCR)
-    ocr_tool = bigtool.select("ocr", context={"attachments": state["invoice_payload"].get("attachments")})
+    ocr_tool = bigtool.select("ocr", context={"attachments": payload.get("attachments")}, stage="UNDERSTAND")
     
     # MCP Call (ATLAS for OCR, COMMON for NLP)
     # Simulating a combined call or multiple calls
     mcp = get_mcp_client("COMMON")
-    parsed_data = mcp.call_tool("parse_invoice_lines", {})
+
+    # Same documents through the same provider parse the same way: skip OCR on a hit
+    cache_key = parse_cache.key(payload.get("attachments"), ocr_tool)
+    parsed_data = parse_cache.get(cache_key) if cache_key else None
+    if parsed_data is None:
+        started = time.perf_counter()
+        parsed_data = mcp.call_tool("parse_invoice_lines", {
+            "attachments": payload.get("attachments", []),
+            "line_items": payload.get("line_items"),
+            "amount": payload.get("amount"),
+            "invoice_id": payload.get("invoice_id")
+        }, track=ocr_tool)
+        if cache_key:
+            parse_cache.set(cache_key, parsed_data, time.perf_counter() - started)
     
+    # Bulky parse results are stored once; checkpoints carry references to them
+    parsed_data["invoice_text"] = blob_store.ref(parsed_data.get("invoice_text"), state["workflow_id"])
+    parsed_data["parsed_line_items"] = blob_store.ref(parsed_data.get("parsed_line_items"), state["workflow_id"])
     output = {
         "parsed_invoice": parsed_data,
         "ocr_provider": ocr_tool
@@ -46,23 +89,39 @@ def understand_node(state: AgentState) -> Dict[str, Any]:
     return {"UNDERSTAND": output}
 
 def prepare_node(state: AgentState) -> Dict[str, Any]:
-    """PREPARE: Normalize and Enrich."""
-    vendor_name = state["invoice_payload"].get("vendor_name")
+    """PREPARE: Normalize and Enrich.
+
+    Runs in parallel with UNDERSTAND (it only needs the raw payload). Inside the
+    node, normalize -> enrich is a dependent chain while compute_flags is
+    independent, so the two run concurrently.
+    """
+    payload = blob_store.load(state["invoice_payload"])
+    vendor_name = payload.get("vendor_name")
     
     # Tool selection (Enrichment)
-    enrich_tool = bigtool.select("enrichment", context={"vendor": vendor_name})
+    enrich_tool = bigtool.select("enrichment", context={"vendor": vendor_name}, stage="PREPARE")
     
     # MCP Calls
     common = get_mcp_client("COMMON")
     atlas = get_mcp_client("ATLAS")
     
-    norm_data = common.call_tool("normalize_vendor", {"name": vendor_name})
-    enrich_data = atlas.call_tool("enrich_vendor", {"name": norm_data["normalized_name"]})
-    flags = common.call_tool("compute_flags", {})
+    def normalize_and_enrich():
+        norm_data = common.call_tool("normalize_vendor", {"name": vendor_name})
+        enrich_data = atlas.call_tool("enrich_vendor", {"name": norm_data["normalized_name"]}, track=enrich_tool)
+        return {**norm_data, **enrich_data}
+
+    vendor_profile, flags = run_concurrently(
+        normalize_and_enrich,
+        lambda: common.call_tool("compute_flags", {})
+    )
     
     output = {
-        "vendor_profile": {**norm_data, **enrich_data},
-        "normalized_invoice": state["UNDERSTAND"]["parsed_invoice"], # Pass through for now
+        "vendor_profile": vendor_profile,
+        "normalized_invoice": blob_store.ref({
+            "amount": float(payload.get("amount") or 0),
+            "currency": (payload.get("currency") or "USD").upper(),
+            "line_items": payload.get("line_items", [])
+        }, state["workflow_id"], keep=("amount", "currency")),
         "flags": flags,
         "enrichment_provider": enrich_tool
     }
@@ -70,12 +129,26 @@ def prepare_node(state: AgentState) -> Dict[str, Any]:
 
 def retrieve_node(state: AgentState) -> Dict[str, Any]:
     """RETRIEVE: Fetch ERP data."""
+    vendor_tax_id = state["PREPARE"]["vendor_profile"]["tax_id"]
+    po_numbers = state["UNDERSTAND"]["parsed_invoice"].get("detected_pos", [])
+    amount = state["invoice_payload"].get("amount")
+
+    # Local replica first; only a miss goes to the ERP
+    erp_data = po_store.lookup(vendor_tax_id, po_numbers, amount)
+    if erp_data is not None:
+        return {"RETRIEVE": {**erp_data, "erp_connector": "po_store"}}
+
     # Tool selection (ERP)
-    erp_tool = bigtool.select("erp_connector", context={"env": "sandbox"})
+    erp_tool = bigtool.select("erp_connector", context={"env": "sandbox"}, stage="RETRIEVE")
     
     # MCP Call (ATLAS)
     atlas = get_mcp_client("ATLAS")
-    erp_data = atlas.call_tool("fetch_erp_data", {"vendor_tax_id": state["PREPARE"]["vendor_profile"]["tax_id"]})
+    erp_data = atlas.call_tool("fetch_erp_data", {
+        "vendor_tax_id": vendor_tax_id,
+        "po_numbers": po_numbers,
+        "amount": amount
+    }, track=erp_tool)
+    po_store.upsert(erp_data.get("matched_pos", []), erp_data.get("matched_grns", []), vendor_tax_id)
     
     output = {
         **erp_data,
@@ -85,41 +158,52 @@ def retrieve_node(state: AgentState) -> Dict[str, Any]:
 
 def match_two_way_node(state: AgentState) -> Dict[str, Any]:
     """MATCH_TWO_WAY: Match Invoice to PO."""
-    # MCP Call (COMMON)
-    common = get_mcp_client("COMMON")
-    
-    invoice_amt = state["invoice_payload"].get("amount")
-    # Mocking PO amount logic
-    po_amt = 100 # Default mock
-    if state["RETRIEVE"]["matched_pos"]:
-        po_amt = state["RETRIEVE"]["matched_pos"][0]["amount"]
-        
-    match_result = common.call_tool("two_way_match", {
-        "invoice_amount": invoice_amt,
-        "po_amount": po_amt,
-        "threshold": settings.match_threshold
-    })
+    # Line-level matching runs locally (vectorized) instead of a per-invoice MCP call
+    match_result = two_way_match(
+        invoice_amount=state["invoice_payload"].get("amount"),
+        invoice_lines=blob_store.load(state["UNDERSTAND"]["parsed_invoice"].get("parsed_line_items")) or [],
+        purchase_orders=state["RETRIEVE"]["matched_pos"],
+        match_threshold=settings.match_threshold,
+        tolerance_pct=settings.two_way_tolerance_pct
+    )
     
     return {"MATCH_TWO_WAY": match_result}
 
 def checkpoint_hitl_node(state: AgentState) -> Dict[str, Any]:
     """CHECKPOINT_HITL: Prepare for Human Review."""
     # Tool selection (DB)
-    db_tool = bigtool.select("db", context={"usage": "checkpoints"})
+    db_tool = bigtool.select("db", context={"usage": "checkpoints"}, stage="CHECKPOINT_HITL")
     
     checkpoint_id = str(uuid.uuid4())
     review_url = f"http://localhost:8000/review/{checkpoint_id}"
     
-    # In a real app, we would persist the state to a separate DB table here if needed,
-    # but LangGraph checkpointer handles the main state persistence.
-    # This node explicitly "pushes to human review queue".
-    
+    # LangGraph checkpointer handles the main state persistence. The runner pushes
+    # the review onto the queue once this output is committed and the run paused.
+    paused_reason = state["MATCH_TWO_WAY"]["match_evidence"].get("reason")
+    # Back from a CLARIFY wait: the reviewer needs the outcome of the clarification
+    clarify = state.get("CLARIFY") or {}
+    if clarify.get("status") == "REPLIED":
+        paused_reason = f"Vendor replied to clarification request {clarify['correlation_key']}"
+    elif clarify.get("status") == "TIMED_OUT":
+        paused_reason = f"No vendor reply to clarification request {clarify['correlation_key']} by {clarify['reply_deadline']}"
+    possible_duplicate_of = state.get("INTAKE", {}).get("possible_duplicate_of")
+    if possible_duplicate_of:
+        duplicate_reason = (
+            f"Possible duplicate of invoice {possible_duplicate_of['invoice_id']} "
+            f"(thread {possible_duplicate_of['thread_id']}): same vendor, amount and date"
+        )
+        # A clean match paused only for the suspected duplicate
+        matched = state["MATCH_TWO_WAY"].get("match_result") != "FAILED" and not clarify.get("status")
+        paused_reason = duplicate_reason if matched else f"{duplicate_reason}; {paused_reason}"
+
     output = {
         "checkpoint_id": checkpoint_id,
         "review_url": review_url,
-        "paused_reason": state["MATCH_TWO_WAY"]["match_evidence"].get("reason"),
+        "paused_reason": paused_reason,
         "db_tool": db_tool
     }
+    if possible_duplicate_of:
+        output["possible_duplicate_of"] = possible_duplicate_of
     return {"CHECKPOINT_HITL": output}
 
 def hitl_decision_node(state: AgentState) -> Dict[str, Any]:
@@ -162,34 +246,45 @@ def approve_node(state: AgentState) -> Dict[str, Any]:
 
 def posting_node(state: AgentState) -> Dict[str, Any]:
     """POSTING: Post to ERP."""
-    erp_tool = bigtool.select("erp_connector")
-    atlas = get_mcp_client("ATLAS")
-    result = atlas.call_tool("post_to_erp", {})
+    # Micro-batched bulk posting; the thread's idempotency key makes re-runs replay the first result
+    payload = state["invoice_payload"]
+    result = post_invoice(state["workflow_id"], {
+        "invoice_id": payload["invoice_id"],
+        "vendor_tax_id": state["PREPARE"]["vendor_profile"].get("tax_id"),
+        "amount": payload["amount"],
+        "currency": payload.get("currency", "USD"),
+        "accounting_entries": state["RECONCILE"].get("accounting_entries", [])
+    })
     
-    return {"POSTING": {**result, "erp_connector": erp_tool}}
+    return {"POSTING": result}
 
 def notify_node(state: AgentState) -> Dict[str, Any]:
     """NOTIFY: Send notifications."""
-    email_tool = bigtool.select("email")
-    atlas = get_mcp_client("ATLAS")
-    result = atlas.call_tool("send_notification", {})
+    # Invoices of the same vendor finishing close together share one email
+    payload = state["invoice_payload"]
+    result = notify_invoice(state["PREPARE"]["vendor_profile"].get("normalized_name") or payload.get("vendor_name"), {
+        "invoice_id": payload["invoice_id"],
+        "amount": payload["amount"],
+        "erp_txn_id": state["POSTING"].get("erp_txn_id")
+    })
     
-    return {"NOTIFY": {**result, "email_provider": email_tool}}
+    return {"NOTIFY": result}
 
 def complete_node(state: AgentState) -> Dict[str, Any]:
     """COMPLETE: Finalize."""
-    db_tool = bigtool.select("db")
+    db_tool = bigtool.select("db", stage="COMPLETE")
     
     final_payload = {
         "invoice_id": state["invoice_payload"]["invoice_id"],
         "status": "COMPLETED",
-        "erp_txn": state["POSTING"]["erp_txn_id"]
+        "erp_txn": state["POSTING"].get("erp_txn_id")
     }
     
     return {
         "COMPLETE": {
             "final_payload": final_payload,
-            "audit_log": ["Log entry 1", "Log entry 2"], # Mock
+            # Per-stage timings recorded so far (COMPLETE's own entry is appended after it returns)
+            "audit_log": list(state.get("audit_log", [])),
             "status": "COMPLETED",
             "audit_db": db_tool
         },
@@ -197,10 +292,28 @@ def complete_node(state: AgentState) -> Dict[str, Any]:
     }
 
 def clarify_node(state: AgentState) -> Dict[str, Any]:
-    """CLARIFY: Request clarification from vendor."""
-    email_tool = bigtool.select("email")
+    """CLARIFY: Request clarification from vendor and park the thread until the reply or the deadline."""
+    email_tool = bigtool.select("email", stage="CLARIFY")
     atlas = get_mcp_client("ATLAS")
-    # In a real app, this would send a specific clarification email
-    result = atlas.call_tool("send_notification", {"type": "clarification_request"})
-    
-    return {"CLARIFY": {**result, "email_provider": email_tool, "status": "REQUESTED"}}
+    # The key goes out with the email and comes back with the vendor's reply. It is
+    # fixed per round, so a retried attempt parks the same timer again.
+    clarify_round = sum(1 for entry in state.get("audit_log", []) if entry.get("stage") == "CLARIFY") + 1
+    round_id = uuid.uuid5(uuid.NAMESPACE_URL, f"{state['workflow_id']}/clarify/{clarify_round}")
+    correlation_key = f"clr-{round_id.hex[:16]}"
+    deadline = time.time() + settings.timers.get("clarify_reply_hours", 72) * 3600
+    result = atlas.call_tool(
+        "send_notification", {"type": "clarification_request", "correlation_key": correlation_key}, track=email_tool
+    )
+
+    # The thread stops after this node (interrupt_after) and the timer scheduler resumes it
+    timer_store.park(state["workflow_id"], correlation_key, "CLARIFY", deadline, state.get("priority"))
+    return {
+        "CLARIFY": {
+            **result,
+            "email_provider": email_tool,
+            "status": "WAITING",
+            "correlation_key": correlation_key,
+            "reply_deadline": datetime.datetime.fromtimestamp(deadline).isoformat()
+        },
+        "status": "WAITING"
+    }
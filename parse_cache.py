@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from db import connect_sqlite
+
+
+def attachment_digest(attachment: str, root: Optional[str] = None) -> Optional[str]:
+    """SHA-256 of an attachment's bytes: the file's content when it is a readable path
+    inside `root`, the payload of an inline `data:` URI, else None (a bare name says
+    nothing about content). Relative paths are resolved against `root`; without a
+    root no file is read, since the path comes from the invoice payload."""
+    digest = hashlib.sha256()
+    if attachment.startswith("data:"):
+        digest.update(attachment.encode())
+        return digest.hexdigest()
+    path = _attachment_path(attachment, root)
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _attachment_path(attachment: str, root: Optional[str]) -> Optional[str]:
+    """The real path of an attachment if it stays inside `root` (after symlinks and ..)."""
+    if not root:
+        return None
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, attachment))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+class ParseCache:
+    """
+    Cache of UNDERSTAND parse results keyed by the attachments' content hash and the
+    OCR provider, so resubmitted documents and CLARIFY re-entries skip OCR.
+    Memory tier: LRU bounded by total entry size. Disk tier (SQLite): bounded by
+    total size, least recently used rows evicted first. Triggers keep the disk
+    total in a one-row table, so a write only scans when it goes over budget.
+    Attachments are only read from under `attachment_root`.
+    Each entry remembers how long its OCR took, which hits report as time saved.
+    """
+
+    def __init__(self, max_memory_bytes: int, disk_path: Optional[str] = None, max_disk_bytes: int = 0,
+                 attachment_root: Optional[str] = None):
+        self.max_memory_bytes = max_memory_bytes
+        self.attachment_root = attachment_root
+        self.disk_path = disk_path if max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_bytes = 0
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0, "ocr_seconds_saved": 0.0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if self.disk_path:
+            self._disk().execute(
+                "CREATE TABLE IF NOT EXISTS parse_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "ocr_seconds REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._disk().execute("CREATE INDEX IF NOT EXISTS idx_parse_cache_last_used ON parse_cache (last_used)")
+            self._disk().executescript("""
+                CREATE TABLE IF NOT EXISTS parse_cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL);
+                INSERT OR IGNORE INTO parse_cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM parse_cache;
+                CREATE TRIGGER IF NOT EXISTS parse_cache_size_insert AFTER INSERT ON parse_cache
+                    BEGIN UPDATE parse_cache_size SET total = total + NEW.size WHERE id = 0; END;
+                CREATE TRIGGER IF NOT EXISTS parse_cache_size_update AFTER UPDATE OF size ON parse_cache
+                    BEGIN UPDATE parse_cache_size SET total = total - OLD.size + NEW.size WHERE id = 0; END;
+                CREATE TRIGGER IF NOT EXISTS parse_cache_size_delete AFTER DELETE ON parse_cache
+                    BEGIN UPDATE parse_cache_size SET total = total - OLD.size WHERE id = 0; END;
+            """)
+
+    def _disk(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.disk_path, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def key(self, attachments: List[str], ocr_provider: str) -> Optional[str]:
+        """Cache key for a document set, or None when any attachment's content is unavailable."""
+        if not attachments:
+            return None
+        digests = [attachment_digest(attachment, self.attachment_root) for attachment in attachments]
+        if None in digests:
+            return None
+        return hashlib.sha256(json.dumps([ocr_provider, digests]).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["ocr_seconds_saved"] += entry[2]
+                return json.loads(entry[0])
+
+        if self.disk_path:
+            conn = self._disk()
+            row = conn.execute("SELECT value, ocr_seconds FROM parse_cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE parse_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._stats["ocr_seconds_saved"] += row[1]
+                    self._store(key, row[0], row[1])
+                return json.loads(row[0])
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def _store(self, key: str, raw: str, ocr_seconds: float) -> None:
+        # Caller holds self._lock
+        size = len(raw)
+        if size > self.max_memory_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous[1]
+        self._entries[key] = (raw, size, ocr_seconds)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._stats["evictions"] += 1
+
+    def set(self, key: str, value: Dict[str, Any], ocr_seconds: float) -> None:
+        raw = json.dumps(value, default=str)
+        with self._lock:
+            self._store(key, raw, ocr_seconds)
+        if self.disk_path and len(raw) <= self.max_disk_bytes:
+            conn = self._disk()
+            # An upsert, not INSERT OR REPLACE: REPLACE's implicit delete skips the size trigger
+            conn.execute(
+                "INSERT INTO parse_cache (key, value, size, ocr_seconds, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "ocr_seconds = excluded.ocr_seconds, last_used = excluded.last_used",
+                (key, raw, len(raw), ocr_seconds, time.time())
+            )
+            self._evict_disk(conn)
+
+    def _disk_bytes(self, conn) -> int:
+        return conn.execute("SELECT total FROM parse_cache_size WHERE id = 0").fetchone()[0]
+
+    def _evict_disk(self, conn, batch: int = 64) -> None:
+        total = self._disk_bytes(conn)
+        evicted = 0
+        # Least recently used first, a batch at a time, until back under budget
+        while total > self.max_disk_bytes:
+            rows = conn.execute("SELECT key, size FROM parse_cache ORDER BY last_used LIMIT ?", (batch,)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_disk_bytes:
+                    break
+                conn.execute("DELETE FROM parse_cache WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+            total = self._disk_bytes(conn)
+        with self._lock:
+            self._stats["disk_evictions"] += evicted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "ocr_seconds_saved": round(self._stats["ocr_seconds_saved"], 3),
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "hit_ratio": round((self._stats["hits"] + self._stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+            }
+
+
+parse_cache = ParseCache(
+    settings.parse_cache.get("max_memory_bytes", 64 * 1024 * 1024),
+    disk_path=settings.parse_cache.get("disk_path", "parse_cache.db"),
+    max_disk_bytes=settings.parse_cache.get("max_disk_bytes", 1024 * 1024 * 1024),
+    attachment_root=settings.parse_cache.get("attachment_root", "attachments")
+)
@@ -0,0 +1,174 @@
+import datetime
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from db import connect_sqlite
+
+logger = logging.getLogger("POStore")
+
+
+class POStore:
+    """
+    Local replica of open POs and GRNs so RETRIEVE can resolve candidates without
+    an ERP round trip. Indexed by PO number, (vendor tax_id, status) and
+    (vendor tax_id, amount bucket). Filled by incremental delta pulls against a
+    last-modified watermark and by write-through of ERP fallback results.
+    """
+
+    def __init__(self, db_path: str, amount_bucket_size: float = 100.0, sync_batch_size: int = 1000):
+        self.db_path = db_path
+        self.amount_bucket_size = amount_bucket_size
+        self.sync_batch_size = sync_batch_size
+        self._local = threading.local()
+        self._stats = {"hits": 0, "misses": 0, "synced_pos": 0, "synced_grns": 0}
+        self._stats_lock = threading.Lock()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS purchase_orders (
+                po_number TEXT PRIMARY KEY,
+                vendor_tax_id TEXT,
+                amount REAL,
+                amount_bucket INTEGER,
+                status TEXT NOT NULL DEFAULT 'OPEN',
+                last_modified TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_po_vendor_status ON purchase_orders (vendor_tax_id, status);
+            CREATE INDEX IF NOT EXISTS idx_po_vendor_bucket ON purchase_orders (vendor_tax_id, amount_bucket);
+            CREATE TABLE IF NOT EXISTS grns (
+                grn_number TEXT PRIMARY KEY,
+                po_number TEXT NOT NULL,
+                last_modified TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_grn_po ON grns (po_number);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                source TEXT PRIMARY KEY,
+                watermark TEXT
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _bucket(self, amount: Optional[float]) -> Optional[int]:
+        return None if amount is None else int(float(amount) // self.amount_bucket_size)
+
+    def _count(self, stat: str, value: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[stat] += value
+
+    def upsert(self, purchase_orders: List[Dict[str, Any]], grns: List[Dict[str, Any]], vendor_tax_id: str = None) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO purchase_orders "
+                "(po_number, vendor_tax_id, amount, amount_bucket, status, last_modified, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(
+                    po["po_number"], po.get("vendor_tax_id", vendor_tax_id), po.get("amount"),
+                    self._bucket(po.get("amount")), po.get("status", "OPEN"),
+                    po.get("last_modified", datetime.datetime.now().isoformat()), json.dumps(po)
+                ) for po in purchase_orders]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO grns (grn_number, po_number, last_modified, data) VALUES (?, ?, ?, ?)",
+                [(
+                    grn["grn_number"], grn["po_number"],
+                    grn.get("last_modified", datetime.datetime.now().isoformat()), json.dumps(grn)
+                ) for grn in grns]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def lookup(self, vendor_tax_id: str, po_numbers: List[str], amount: Optional[float]) -> Optional[Dict[str, Any]]:
+        """
+        Resolve RETRIEVE output locally. Referenced PO numbers must all be present
+        and open; without references, open POs of the vendor in the invoice
+        amount's bucket (or a neighbouring one) are the candidates.
+        Returns None on a miss so the caller can fall back to the ERP.
+        """
+        conn = self._conn()
+        if po_numbers:
+            rows = conn.execute(
+                f"SELECT data FROM purchase_orders WHERE po_number IN ({', '.join('?' for _ in po_numbers)}) "
+                f"AND vendor_tax_id = ? AND status = 'OPEN'",
+                list(po_numbers) + [vendor_tax_id]
+            ).fetchall()
+            if len(rows) < len(set(po_numbers)):
+                rows = []
+        elif amount is not None:
+            bucket = self._bucket(amount)
+            rows = conn.execute(
+                "SELECT data FROM purchase_orders WHERE vendor_tax_id = ? AND amount_bucket BETWEEN ? AND ? AND status = 'OPEN'",
+                (vendor_tax_id, bucket - 1, bucket + 1)
+            ).fetchall()
+        else:
+            rows = []
+
+        if not rows:
+            self._count("misses")
+            return None
+
+        pos = [json.loads(row[0]) for row in rows]
+        matched = [po["po_number"] for po in pos]
+        grn_rows = conn.execute(
+            f"SELECT data FROM grns WHERE po_number IN ({', '.join('?' for _ in matched)})", matched
+        ).fetchall()
+        self._count("hits")
+        return {
+            "matched_pos": pos,
+            "matched_grns": [json.loads(row[0]) for row in grn_rows],
+            "history": []
+        }
+
+    def watermark(self, source: str = "erp") -> Optional[str]:
+        row = self._conn().execute("SELECT watermark FROM sync_state WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, client, source: str = "erp") -> Dict[str, Any]:
+        """Pull POs/GRNs modified since the stored watermark until the ERP reports no more."""
+        since = self.watermark(source)
+        pulled_pos = pulled_grns = 0
+        while True:
+            delta = client.call_tool("fetch_erp_delta", {"since": since, "limit": self.sync_batch_size})
+            purchase_orders, grns = delta.get("purchase_orders", []), delta.get("grns", [])
+            if purchase_orders or grns:
+                self.upsert(purchase_orders, grns)
+            pulled_pos += len(purchase_orders)
+            pulled_grns += len(grns)
+            if delta.get("watermark") and delta["watermark"] != since:
+                since = delta["watermark"]
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO sync_state (source, watermark) VALUES (?, ?)", (source, since)
+                )
+            if not delta.get("has_more"):
+                break
+        self._count("synced_pos", pulled_pos)
+        self._count("synced_grns", pulled_grns)
+        logger.info(f"[POStore] Synced {pulled_pos} POs and {pulled_grns} GRNs (watermark {since})")
+        return {"purchase_orders": pulled_pos, "grns": pulled_grns, "watermark": since}
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["open_pos"] = conn.execute("SELECT COUNT(*) FROM purchase_orders WHERE status = 'OPEN'").fetchone()[0]
+        stats["grns"] = conn.execute("SELECT COUNT(*) FROM grns").fetchone()[0]
+        stats["watermark"] = self.watermark()
+        return stats
+
+
+po_store = POStore(
+    settings.po_store.get("db_path", "po_store.db"),
+    amount_bucket_size=settings.po_store.get("amount_bucket_size", 100.0),
+    sync_batch_size=settings.po_store.get("sync_batch_size", 1000)
+)
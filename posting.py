@@ -0,0 +1,167 @@
+import datetime
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from bigtool import bigtool
+from config import settings
+from db import connect_sqlite, local_db_path
+from mcp_client import MCPError, get_mcp_client
+
+logger = logging.getLogger("Posting")
+
+
+class PostingFailed(MCPError):
+    """The ERP batch came back without posting this invoice. Transient: the stage
+    retries it (the idempotency key keeps an eventual double post out)."""
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many workflow threads and hands them to `flush_fn`
+    in one call, once `max_batch_size` items are waiting or `max_wait_ms` after the
+    first one arrived. Items can be grouped (e.g. per vendor); each group is
+    batched separately. `submit` blocks until the item's own result is back.
+    """
+
+    def __init__(self, name: str, flush_fn: Callable[[str, List[Any]], List[Any]], max_batch_size: int = 50, max_wait_ms: float = 50):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[str, List[tuple]] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+        self._stats = {"items": 0, "batches": 0}
+
+    def submit(self, item: Any, group: str = "") -> Any:
+        future: Future = Future()
+        batch = None
+        with self._lock:
+            pending = self._pending.setdefault(group, [])
+            pending.append((item, future))
+            if len(pending) >= self.max_batch_size:
+                batch = self._take(group)
+            elif len(pending) == 1:
+                timer = threading.Timer(self.max_wait, self._flush_group, args=(group,))
+                timer.daemon = True
+                self._timers[group] = timer
+                timer.start()
+        if batch:
+            self._flush(group, batch)
+        return future.result()
+
+    def _take(self, group: str) -> List[tuple]:
+        # Caller holds self._lock
+        timer = self._timers.pop(group, None)
+        if timer:
+            timer.cancel()
+        return self._pending.pop(group, [])
+
+    def _flush_group(self, group: str) -> None:
+        with self._lock:
+            batch = self._take(group)
+        if batch:
+            self._flush(group, batch)
+
+    def _flush(self, group: str, batch: List[tuple]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = self.flush_fn(group, items)
+        except Exception as e:
+            logger.error(f"[{self.name}] Batch of {len(items)} failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self._stats["items"] += len(items)
+            self._stats["batches"] += 1
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = sum(len(items) for items in self._pending.values())
+        stats["avg_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
+
+
+class PostingLedger:
+    """Idempotency ledger: the ERP result of every posted key, so retries and resumes never post twice."""
+
+    def __init__(self, db_path: str, table: str = "posting_ledger"):
+        self.db_path = db_path
+        self.table = table
+        self._local = threading.local()
+        self._conn().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (idempotency_key TEXT PRIMARY KEY, result TEXT NOT NULL, posted_at TEXT NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f"SELECT result FROM {self.table} WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record(self, results: Dict[str, Dict[str, Any]]) -> None:
+        now = datetime.datetime.now().isoformat()
+        self._conn().executemany(
+            f"INSERT OR IGNORE INTO {self.table} (idempotency_key, result, posted_at) VALUES (?, ?, ?)",
+            [(key, json.dumps(result), now) for key, result in results.items()]
+        )
+
+
+def idempotency_key(thread_id: str) -> str:
+    """Stable per workflow thread: every attempt to post the same invoice carries the same key."""
+    return "post-" + hashlib.sha256(thread_id.encode()).hexdigest()[:32]
+
+
+def _post_batch(_: str, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    erp_tool = bigtool.select("erp_connector", stage="POSTING")
+    response = get_mcp_client("ATLAS").call_tool("post_to_erp_batch", {"entries": entries}, track=erp_tool)
+    by_key = {result["idempotency_key"]: {**result, "erp_connector": erp_tool} for result in response.get("results", [])}
+    ledger.record({key: result for key, result in by_key.items() if result.get("posted")})
+    return [
+        by_key.get(entry["idempotency_key"], {"posted": False, "error": "No result returned for entry"})
+        for entry in entries
+    ]
+
+
+def _notify_vendor(vendor: str, invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    email_tool = bigtool.select("email", stage="NOTIFY")
+    result = get_mcp_client("ATLAS").call_tool("send_notification", {"vendor": vendor, "invoices": invoices}, track=email_tool)
+    # One email per vendor covers every invoice in the batch
+    return [{**result, "email_provider": email_tool, "coalesced_invoices": len(invoices)} for _ in invoices]
+
+
+def post_invoice(thread_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Post one approved invoice through the micro-batcher; already-posted threads return their recorded result.
+    Raises PostingFailed when the ERP did not post it, so the run never completes unposted."""
+    key = idempotency_key(thread_id)
+    posted = ledger.get(key)
+    if posted is not None:
+        return {**posted, "replayed": True}
+    result = posting_batcher.submit({**entry, "idempotency_key": key})
+    if not result.get("posted"):
+        raise PostingFailed(f"ERP did not post invoice {entry.get('invoice_id')}: {result.get('error', 'no reason given')}")
+    return result
+
+
+def notify_invoice(vendor: str, invoice: Dict[str, Any]) -> Dict[str, Any]:
+    return notify_batcher.submit(invoice, group=vendor or "")
+
+
+ledger = PostingLedger(local_db_path())
+posting_batcher = MicroBatcher("POSTING", _post_batch, **settings.batching.get("posting", {}))
+notify_batcher = MicroBatcher("NOTIFY", _notify_vendor, **settings.batching.get("notify", {}))
@@ -0,0 +1,253 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger("RateLimit")
+
+THROTTLE_WAIT = registry.histogram(
+    "mcp_rate_limit_wait_seconds", "Time MCP calls spent waiting for a rate-limit token or in-flight slot.",
+    ("server", "tool"), buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+THROTTLED = registry.counter("mcp_rate_limited_total", "MCP calls rejected after waiting too long for capacity.", ("server", "tool"))
+ADMISSION = registry.counter("api_admission_total", "Admission decisions for new workflow runs.", ("outcome",))
+
+
+class Throttled(Exception):
+    """Raised when a call or request could not get capacity in time; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket with reservations: a caller takes a token (going into debt if
+    needed) and is told how long to sleep, so waiters are served in arrival order."""
+
+    def __init__(self, rate_per_second: float, burst: Optional[float] = None):
+        self.rate = float(rate_per_second)
+        self.burst = float(burst or max(1.0, rate_per_second))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """Take a token; returns the seconds to wait before using it, or None if that exceeds max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1.0 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1.0
+            return wait
+
+    def refund(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1.0)
+
+
+class _Limit:
+    """Rate and concurrency limit for one scope (a server or one of its tools)."""
+
+    def __init__(self, options: Dict[str, Any]):
+        rate = options.get("rate_per_second")
+        self.bucket = TokenBucket(rate, options.get("burst")) if rate else None
+        self.max_in_flight = options.get("max_in_flight")
+        self.slots = threading.BoundedSemaphore(self.max_in_flight) if self.max_in_flight else None
+        self.in_flight = 0
+
+
+class ServerLimiter:
+    """
+    Client-side limits for one MCP server: a token bucket and an in-flight cap for
+    the server as a whole, and optionally per tool. Calls over the limit wait
+    (backpressure) for up to `max_wait_seconds`, then fail with Throttled.
+    """
+
+    def __init__(self, server_name: str, options: Optional[Dict[str, Any]] = None):
+        options = options or {}
+        self.server_name = server_name
+        self.max_wait = options.get("max_wait_seconds", 30.0)
+        self._server = _Limit(options)
+        self._tools = {tool: _Limit(tool_options) for tool, tool_options in options.get("tools", {}).items()}
+        self._lock = threading.Lock()
+        self.waited = 0
+        self.rejected = 0
+
+    def _scopes(self, tool_name: str) -> List[_Limit]:
+        return [limit for limit in (self._tools.get(tool_name), self._server) if limit is not None]
+
+    def acquire(self, tool_name: str) -> List[_Limit]:
+        """Block until the call may proceed; returns the scopes to release afterwards."""
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        held: List[_Limit] = []
+        try:
+            # In-flight slots first (tool, then server), then a token from each bucket
+            for limit in self._scopes(tool_name):
+                if limit.slots is not None:
+                    if not limit.slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                        raise self._throttled(tool_name, "in-flight limit")
+                    with self._lock:
+                        limit.in_flight += 1
+                    held.append(limit)
+
+            reserved: List[TokenBucket] = []
+            wait = 0.0
+            for limit in self._scopes(tool_name):
+                if limit.bucket is None:
+                    continue
+                delay = limit.bucket.reserve(max(0.0, deadline - time.monotonic()))
+                if delay is None:
+                    for bucket in reserved:
+                        bucket.refund()
+                    raise self._throttled(tool_name, "rate limit")
+                reserved.append(limit.bucket)
+                wait = max(wait, delay)
+            if wait:
+                time.sleep(wait)
+        except Throttled:
+            self.release(held)
+            raise
+
+        elapsed = time.monotonic() - started
+        THROTTLE_WAIT.observe(elapsed, server=self.server_name, tool=tool_name)
+        if elapsed > 0.001:
+            with self._lock:
+                self.waited += 1
+        return held
+
+    def release(self, held: List[_Limit]) -> None:
+        for limit in held:
+            with self._lock:
+                limit.in_flight -= 1
+            limit.slots.release()
+
+    def _throttled(self, tool_name: str, reason: str) -> Throttled:
+        with self._lock:
+            self.rejected += 1
+        THROTTLED.inc(server=self.server_name, tool=tool_name)
+        return Throttled(f"{self.server_name}.{tool_name}: {reason} not available within {self.max_wait}s", self.max_wait)
+
+    @contextmanager
+    def limit(self, tool_name: str):
+        held = self.acquire(tool_name)
+        try:
+            yield
+        finally:
+            self.release(held)
+
+    @asynccontextmanager
+    async def alimit(self, tool_name: str):
+        # Waiting blocks, so it happens off the event loop
+        held = await asyncio.to_thread(self.acquire, tool_name)
+        try:
+            yield
+        finally:
+            self.release(held)
+
+    def stats(self) -> Dict[str, Any]:
+        def _describe(limit: _Limit) -> Dict[str, Any]:
+            return {
+                "rate_per_second": limit.bucket.rate if limit.bucket else None,
+                "max_in_flight": limit.max_in_flight,
+                "in_flight": limit.in_flight
+            }
+
+        return {
+            **_describe(self._server),
+            "waited_calls": self.waited,
+            "rejected_calls": self.rejected,
+            "tools": {tool: _describe(limit) for tool, limit in self._tools.items()}
+        }
+
+
+class AdmissionController:
+    """
+    Admission control for new workflow runs on the API. Up to `max_in_flight` runs
+    are admitted at once; further requests wait in FIFO order (up to `max_waiting`
+    of them, for at most `max_wait_seconds`) and are shed beyond that. When a shared
+    backlog (the durable job queue) is past its watermark, requests are shed at once.
+    Shed requests raise Throttled, which the API turns into 429 with Retry-After.
+    """
+
+    def __init__(self, max_in_flight: int, max_waiting: int, max_wait_seconds: float, retry_after_seconds: float,
+                 backlog: Optional[Callable[[], int]] = None, backlog_watermark: Optional[int] = None):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.backlog = backlog
+        self.backlog_watermark = backlog_watermark
+        self.in_flight = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = collections.deque()
+        # Runs finish on worker threads, so the state is guarded by a thread lock
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _shed(self, reason: str) -> Throttled:
+        ADMISSION.inc(outcome="rejected")
+        return Throttled(f"Server busy ({reason}), retry later", self.retry_after_seconds)
+
+    async def acquire(self) -> None:
+        """Wait for a run slot; raises Throttled if the request is shed."""
+        if self.backlog is not None and self.backlog_watermark and self.backlog() >= self.backlog_watermark:
+            raise self._shed("job queue above watermark")
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                ADMISSION.inc(outcome="admitted")
+                return
+            if len(self._waiters) >= self.max_waiting:
+                raise self._shed("admission queue full")
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1], self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            # (a slot handed over at the last moment is given back by _hand_over)
+            raise self._shed("timed out waiting for a run slot")
+        ADMISSION.inc(outcome="queued")
+
+    def release(self) -> None:
+        """Free a run slot (thread-safe); hands it straight to the oldest waiter, if any."""
+        with self._lock:
+            if self._waiters:
+                loop, future = self._waiters.popleft()
+                loop.call_soon_threadsafe(self._hand_over, future)
+                return
+            self.in_flight -= 1
+
+    def _hand_over(self, future: asyncio.Future) -> None:
+        if future.done():
+            # The waiter gave up in the meantime: pass the slot on
+            self.release()
+        else:
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "backlog": self.backlog() if self.backlog is not None else None,
+            "backlog_watermark": self.backlog_watermark
+        }
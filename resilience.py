@@ -0,0 +1,130 @@
+import contextvars
+import datetime
+import functools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from config import settings
+from mcp_client import MCPError
+from metrics import registry
+from ratelimit import Throttled
+
+logger = logging.getLogger("Resilience")
+
+STAGE_RETRIES = registry.counter("invoice_stage_retries_total", "Stage attempts that failed and were retried.", ("stage",))
+
+# Failures worth another attempt: remote/tool errors, timeouts and throttling.
+# Anything else (bad data, bugs) fails the stage on the first attempt.
+TRANSIENT_ERRORS = (MCPError, httpx.HTTPError, TimeoutError, ConnectionError, Throttled)
+
+# Attempts with a timeout run here so the caller can stop waiting. The timeout
+# counts from when the attempt starts running; one still queued when it expires
+# is cancelled and never runs. A running attempt cannot be cancelled: it finishes
+# in the background while the retry runs. Timeouts are therefore only configured
+# for stages that are safe to run twice: reads (UNDERSTAND, PREPARE, RETRIEVE)
+# and POSTING, whose idempotency key replays the first result.
+_attempt_executor = ThreadPoolExecutor(max_workers=2 * settings.max_concurrent_runs, thread_name_prefix="stage")
+
+
+class StageTimeout(TimeoutError):
+    """A stage attempt ran longer than its timeout_seconds."""
+
+
+class StageFailed(Exception):
+    """A stage failed on its last allowed attempt; the run stops at its last checkpoint."""
+
+    def __init__(self, stage: str, attempts: int, cause: BaseException, failures: List[Dict[str, Any]]):
+        super().__init__(f"{stage} failed after {attempts} attempt(s): {type(cause).__name__}: {cause}")
+        self.stage = stage
+        self.attempts = attempts
+        self.cause = cause
+        # One entry per failed attempt, for the state's `errors`
+        self.failures = failures
+
+
+def stage_policy(stage: str) -> Dict[str, Any]:
+    """error_handling.retry_policy overridden by the stage's own `retry` block in workflow.json.
+
+    Stages in error_handling.side_effect_stages (pausing for review, messaging the
+    vendor and parking on a timer, sending notifications) run exactly once: no
+    retries and no timeout.
+    """
+    policy = {**settings.retry_policy, **settings.get_stage_config(stage).get("retry", {})}
+    if stage in settings.side_effect_stages:
+        policy.update(max_retries=0, timeout_seconds=None)
+    return policy
+
+
+def backoff_delay(policy: Dict[str, Any], retry: int) -> float:
+    """Delay before the `retry`-th retry (1-based): exponential, capped at max_backoff_seconds,
+    with the `jitter` fraction of it randomized so retries from many runs spread out."""
+    delay = min(policy.get("backoff_seconds", 2) * 2 ** (retry - 1), policy.get("max_backoff_seconds", 30))
+    jitter = policy.get("jitter", 0.5)
+    return delay * (1 - jitter) + random.uniform(0, delay * jitter)
+
+
+def _attempt(fn: Callable, state: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+    if not timeout:
+        return fn(state)
+    started = threading.Event()
+    started_at: List[float] = []
+
+    def _run():
+        started_at.append(time.monotonic())
+        started.set()
+        return fn(state)
+
+    future = _attempt_executor.submit(contextvars.copy_context().run, _run)
+    # Waiting for a free stage thread does not count against the attempt
+    if not started.wait(timeout):
+        if future.cancel():
+            raise StageTimeout(f"attempt did not start within {timeout}s (stage threads busy)")
+        started.wait()
+    try:
+        return future.result(timeout=max(0.0, started_at[0] + timeout - time.monotonic()))
+    except FutureTimeout:
+        future.cancel()
+        raise StageTimeout(f"attempt exceeded {timeout}s") from None
+
+
+def with_retry(stage: str, fn: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Wrap a graph node with its stage's timeout and retry policy.
+
+    Failed attempts that were retried are appended to the state's `errors`. When the
+    last attempt fails the node raises StageFailed (carrying every attempt's error), so
+    the checkpoint of the previous stage stays the latest one and the stage can be
+    retried from there.
+    """
+    policy = stage_policy(stage)
+    max_attempts = 1 + max(0, policy.get("max_retries", 0))
+    timeout = policy.get("timeout_seconds")
+
+    @functools.wraps(fn)
+    def _node(state):
+        failures: List[Dict[str, Any]] = []
+        for attempt in range(1, max_attempts + 1):
+            try:
+                update = _attempt(fn, state, timeout)
+            except Exception as e:
+                failures.append({
+                    "stage": stage, "attempt": attempt, "error": f"{type(e).__name__}: {e}",
+                    "at": datetime.datetime.now().isoformat()
+                })
+                if attempt == max_attempts or not isinstance(e, TRANSIENT_ERRORS):
+                    raise StageFailed(stage, attempt, e, failures) from e
+                delay = backoff_delay(policy, attempt)
+                logger.warning(f"[{stage}] Attempt {attempt}/{max_attempts} failed ({e}); retrying in {delay:.2f}s")
+                STAGE_RETRIES.inc(stage=stage)
+                time.sleep(delay)
+                continue
+            if failures:
+                return {**(update or {}), "errors": failures}
+            return update
+
+    return _node
@@ -0,0 +1,173 @@
+import datetime
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from blob_store import blob_store, collect_refs
+from checkpointer import PooledSqliteSaver
+from config import settings
+from dedup_index import dedup_index
+from db import connect_sqlite
+from job_queue import job_queue
+from review_queue import ReviewQueue, review_queue
+from timers import timer_store
+
+logger = logging.getLogger("Retention")
+
+# 100ns intervals between the UUID epoch (1582-10-15) and the Unix epoch
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_time(checkpoint_id: str) -> float:
+    """Unix time encoded in a LangGraph (uuid6) checkpoint id."""
+    hex_id = checkpoint_id.replace("-", "")
+    ticks = (int(hex_id[0:12], 16) << 12) | int(hex_id[13:16], 16)
+    return (ticks - _UUID_EPOCH_OFFSET) / 1e7
+
+
+class CheckpointRetention:
+    """
+    Keeps the checkpoint store from growing without bound:
+      - COMPLETED threads keep only their latest checkpoint (get_state still works)
+      - threads idle longer than the TTL that are not COMPLETED and not waiting
+        on a human review or a parked timer (vendor reply) are deleted, with
+        their dedup index entries
+      - blobs only the pruned checkpoints or deleted threads referred to are deleted
+      - the WAL is truncated and the DB vacuumed once enough pages are free
+    Thread candidates are found from checkpoint ids (uuid6 embeds the write time),
+    so a sweep only deserializes the threads it may actually touch.
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver, queue: ReviewQueue, policy: Dict[str, Any]):
+        self.saver = saver
+        self.queue = queue
+        self.policy = policy
+        self.last_report: Optional[Dict[str, Any]] = None
+        # Blobs deleted by the current sweep, as threads are pruned or deleted
+        self.blobs_deleted = 0
+
+    @property
+    def is_sqlite(self) -> bool:
+        return isinstance(self.saver, PooledSqliteSaver)
+
+    def _latest_values(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        ckpt = self.saver.get_tuple({"configurable": {"thread_id": thread_id}})
+        if ckpt is None:
+            return None
+        return ckpt.checkpoint["channel_values"]
+
+    def _latest_status(self, thread_id: str) -> Optional[str]:
+        return (self._latest_values(thread_id) or {}).get("status")
+
+    def prune_completed(self) -> int:
+        """Drop the step history of COMPLETED threads. Returns checkpoints deleted."""
+        if not self.is_sqlite:
+            return 0
+        with self.saver.cursor(transaction=False) as cur:
+            candidates = cur.execute(
+                "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints WHERE checkpoint_ns = '' "
+                "GROUP BY thread_id HAVING COUNT(*) > 1"
+            ).fetchall()
+
+        deleted = 0
+        for thread_id, latest_id in candidates:
+            values = self._latest_values(thread_id)
+            if (values or {}).get("status") != "COMPLETED":
+                continue
+            with self.saver.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id != ?",
+                    (thread_id, latest_id)
+                )
+                deleted += cur.rowcount
+                cur.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = '' AND checkpoint_id != ?",
+                    (thread_id, latest_id)
+                )
+            # Blobs only the dropped steps used (e.g. a retried stage's first output) go with them
+            self.blobs_deleted += blob_store.release(thread_id, keep=collect_refs(values, set()))
+        return deleted
+
+    def expire_abandoned(self) -> int:
+        """Delete non-completed threads with no activity for `abandoned_ttl_hours`. Returns threads deleted."""
+        if not self.is_sqlite:
+            return 0
+        cutoff = time.time() - self.policy["abandoned_ttl_hours"] * 3600
+        with self.saver.cursor(transaction=False) as cur:
+            latest = cur.execute(
+                "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"
+            ).fetchall()
+
+        expired = 0
+        for thread_id, latest_id in latest:
+            if checkpoint_time(latest_id) >= cutoff:
+                continue
+            if self._latest_status(thread_id) == "COMPLETED" or self.queue.has_pending(thread_id) or timer_store.is_parked(thread_id):
+                continue
+            self.saver.delete_thread(thread_id)
+            self.blobs_deleted += blob_store.release(thread_id)
+            dedup_index.release(thread_id)
+            expired += 1
+        return expired
+
+    def _db_files(self) -> List[str]:
+        return [self.saver.path + suffix for suffix in ("", "-wal", "-shm")]
+
+    def _db_bytes(self) -> int:
+        return sum(os.path.getsize(path) for path in self._db_files() if os.path.exists(path))
+
+    def compact(self) -> bool:
+        """Checkpoint/truncate the WAL, and VACUUM when enough of the file is free pages."""
+        conn = connect_sqlite(self.saver.path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            vacuumed = False
+            if page_count and free_pages / page_count >= self.policy["vacuum_min_free_ratio"]:
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                vacuumed = True
+            return vacuumed
+        finally:
+            conn.close()
+
+    def run(self) -> Dict[str, Any]:
+        """Run one full retention sweep and return a report."""
+        started = time.perf_counter()
+        bytes_before = self._db_bytes() if self.is_sqlite else 0
+
+        self.blobs_deleted = 0
+        pruned = self.prune_completed()
+        expired = self.expire_abandoned()
+        event_cutoff = datetime.datetime.now() - datetime.timedelta(hours=self.policy["event_ttl_hours"])
+        pruned_events = self.queue.prune_events(event_cutoff.isoformat())
+        pruned_jobs = job_queue.prune(event_cutoff.isoformat())
+        pruned_timers = timer_store.prune(event_cutoff.isoformat())
+        vacuumed = self.compact() if self.is_sqlite else False
+
+        bytes_after = self._db_bytes() if self.is_sqlite else 0
+        report = {
+            "pruned_checkpoints": pruned,
+            "expired_threads": expired,
+            "deleted_blobs": self.blobs_deleted,
+            "pruned_review_events": pruned_events,
+            "pruned_jobs": pruned_jobs,
+            "pruned_timers": pruned_timers,
+            "vacuumed": vacuumed,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_reclaimed": max(0, bytes_before - bytes_after),
+            "duration_s": round(time.perf_counter() - started, 3),
+            "finished_at": datetime.datetime.now().isoformat(),
+        }
+        logger.info(f"[Retention] {report}")
+        self.last_report = report
+        return report
+
+
+def build_retention(saver: BaseCheckpointSaver) -> CheckpointRetention:
+    return CheckpointRetention(saver, review_queue, settings.retention)
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set
+
+from review_queue import ReviewQueue, review_queue
+
+logger = logging.getLogger("ReviewEvents")
+
+
+class ReviewEventBroadcaster:
+    """
+    Fans review queue deltas out to connected dashboards.
+
+    A single task tails the queue's event outbox and pushes each new event to every
+    subscriber, so database load does not grow with the number of open browsers.
+    Changes made in this process wake the tail immediately; changes from other
+    processes (workers, other uvicorn workers) are picked up within `poll_interval`.
+
+    Subscriber queues hold at most `max_pending` events. A dashboard that falls
+    further behind is disconnected; its browser reconnects with Last-Event-ID and
+    catches up from the outbox instead of growing server memory.
+    """
+
+    def __init__(self, queue: ReviewQueue, poll_interval: float = 1.0, max_pending: int = 1000):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.max_pending = max_pending
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_event_id = 0
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._last_event_id = self.queue.last_event_id()
+        self.queue.add_listener(self._notify)
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _notify(self) -> None:
+        # Called from graph/executor threads
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _tail(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                async for event in self._read_outbox(self._last_event_id):
+                    self._last_event_id = event["event_id"]
+                    for subscriber in list(self._subscribers):
+                        self._deliver(subscriber, event)
+            except Exception:
+                logger.exception("[ReviewEvents] Failed to read review events")
+
+    async def _read_outbox(self, after_id: int):
+        """Yield every outbox event after `after_id`, a page at a time."""
+        while True:
+            events = await asyncio.to_thread(self.queue.events_since, after_id)
+            for event in events:
+                yield event
+            if not events:
+                return
+            after_id = events[-1]["event_id"]
+
+    def _deliver(self, subscriber: asyncio.Queue, event: Dict[str, Any]) -> None:
+        try:
+            subscriber.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: replace its backlog with a disconnect marker
+            logger.warning("[ReviewEvents] Dropping a subscriber that fell behind")
+            self.unsubscribe(subscriber)
+            while not subscriber.empty():
+                subscriber.get_nowait()
+            subscriber.put_nowait(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        subscriber: asyncio.Queue = asyncio.Queue(maxsize=self.max_pending)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: asyncio.Queue) -> None:
+        self._subscribers.discard(subscriber)
+
+    async def stream(self, last_event_id: Optional[int] = None, keepalive: float = 15.0):
+        """
+        Yield server-sent events. With `last_event_id` (the snapshot's event id, or
+        the browser's Last-Event-ID on reconnect) the missed events are replayed from
+        the outbox first. Ends when the subscriber is dropped for falling behind.
+        """
+        subscriber = self.subscribe()
+        try:
+            sent_id = last_event_id or 0
+            if last_event_id is not None:
+                async for event in self._read_outbox(last_event_id):
+                    sent_id = event["event_id"]
+                    yield format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                # Skip anything already replayed from the outbox
+                if event["event_id"] <= sent_id:
+                    continue
+                sent_id = event["event_id"]
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = {key: value for key, value in event.items() if key not in ("event_id", "event_type")}
+    return f"id: {event['event_id']}\nevent: {event['event_type']}\ndata: {json.dumps(data)}\n\n"
+
+
+review_events = ReviewEventBroadcaster(review_queue)
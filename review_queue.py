@@ -0,0 +1,259 @@
+import base64
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from db import connect_sqlite, ensure_columns, local_db_path
+
+logger = logging.getLogger("ReviewQueue")
+
+class ReviewQueue:
+    """
+    Durable human review queue stored in SQLite next to the checkpoints.
+    Once a pause at HITL_DECISION is committed, `runner.enqueue_review` inserts a
+    PENDING row keyed on the checkpoint CHECKPOINT_HITL recorded; the decision API claims it.
+    Listing is in priority order (the invoice's scheduling score, then oldest first)
+    with keyset pagination on (priority, created_at, checkpoint_id), so a page costs
+    the same no matter how deep the backlog is.
+
+    Every change is also appended to an `<table>_events` outbox in the same
+    transaction, with a copy of the row as it was written, so listeners in any
+    process can follow the queue as deltas and replay them in order.
+    """
+
+    def __init__(self, db_path: str, table: str = "human_review_queue"):
+        self.db_path = db_path
+        self.table = table
+        self.events_table = f"{table}_events"
+        self._local = threading.local()
+        self._listeners: List[Callable[[], None]] = []
+        self._setup()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; graph nodes and API handlers run on different threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _setup(self) -> None:
+        t = self.table
+        self._conn().executescript(f"""
+            CREATE TABLE IF NOT EXISTS {t} (
+                checkpoint_id TEXT PRIMARY KEY,
+                thread_id TEXT NOT NULL,
+                invoice_id TEXT,
+                vendor_name TEXT,
+                amount REAL,
+                reason TEXT,
+                review_url TEXT,
+                status TEXT NOT NULL DEFAULT 'PENDING',
+                created_at TEXT NOT NULL,
+                decision TEXT,
+                reviewer_id TEXT,
+                decided_at TEXT
+            );
+        """)
+        ensure_columns(self._conn(), t, {"lane": "TEXT", "priority": "REAL NOT NULL DEFAULT 0"})
+        self._conn().executescript(f"""
+            CREATE INDEX IF NOT EXISTS idx_{t}_status_created ON {t} (status, created_at, checkpoint_id);
+            CREATE INDEX IF NOT EXISTS idx_{t}_priority ON {t} (status, priority DESC, created_at, checkpoint_id);
+            -- The vendor filter is ordered by priority like the rest of the queue; replaces idx_{t}_vendor
+            DROP INDEX IF EXISTS idx_{t}_vendor;
+            CREATE INDEX IF NOT EXISTS idx_{t}_vendor_priority ON {t} (status, vendor_name, priority DESC, created_at, checkpoint_id);
+            CREATE INDEX IF NOT EXISTS idx_{t}_amount ON {t} (status, amount);
+            CREATE INDEX IF NOT EXISTS idx_{t}_thread ON {t} (thread_id);
+            CREATE TABLE IF NOT EXISTS {self.events_table} (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_type TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+        """)
+        ensure_columns(self._conn(), self.events_table, {"row_json": "TEXT"})
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Register a callback fired (on the writer's thread) after every queue change."""
+        self._listeners.append(callback)
+
+    def _write(self, statements: List[Tuple[str, Any]], event_type: str, checkpoint_id: str, thread_id: str) -> int:
+        """Run the statements plus an outbox event in one transaction. Returns the last rowcount."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowcount = 0
+            for sql, params in statements:
+                rowcount = conn.execute(sql, params).rowcount
+            if rowcount:
+                # Snapshot the row now; replaying the event later must not show a newer state
+                row = conn.execute(f"SELECT * FROM {self.table} WHERE checkpoint_id = ?", (checkpoint_id,)).fetchone()
+                conn.execute(
+                    f"INSERT INTO {self.events_table} (event_type, checkpoint_id, thread_id, created_at, row_json) "
+                    f"VALUES (?, ?, ?, ?, ?)",
+                    (event_type, checkpoint_id, thread_id, datetime.datetime.now().isoformat(),
+                     json.dumps(dict(row)) if row else None)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if rowcount:
+            for callback in self._listeners:
+                callback()
+        return rowcount
+
+    def add(self, item: Dict[str, Any]) -> None:
+        """Push a paused workflow onto the queue as PENDING. Idempotent: a checkpoint
+        already queued (pending or decided) is left as it is."""
+        row = {
+            "checkpoint_id": item["checkpoint_id"],
+            "thread_id": item["thread_id"],
+            "invoice_id": item.get("invoice_id"),
+            "vendor_name": item.get("vendor_name"),
+            "amount": item.get("amount"),
+            "reason": item.get("reason"),
+            "review_url": item.get("review_url"),
+            "lane": (item.get("priority") or {}).get("lane"),
+            "priority": (item.get("priority") or {}).get("score", 0),
+            "created_at": datetime.datetime.now().isoformat(),
+        }
+        # A thread that was decided before and is queued again came back from CLARIFY
+        repaused = self._conn().execute(
+            f"SELECT 1 FROM {self.table} WHERE thread_id = ? AND status = 'DECIDED' LIMIT 1", (row["thread_id"],)
+        ).fetchone()
+        added = self._write(
+            [(f"INSERT OR IGNORE INTO {self.table} ({', '.join(row)}) "
+              f"VALUES ({', '.join('?' for _ in row)})", list(row.values()))],
+            "review_repaused" if repaused else "review_added", row["checkpoint_id"], row["thread_id"]
+        )
+        if added:
+            logger.info(f"[ReviewQueue] Queued checkpoint {row['checkpoint_id']} for thread {row['thread_id']}")
+
+    def get(self, checkpoint_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f"SELECT * FROM {self.table} WHERE checkpoint_id = ?", (checkpoint_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, checkpoint_id: str, decision: str, reviewer_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically move a PENDING review to DECIDED. Returns the review, or None if
+        it does not exist or was already decided (e.g. by another reviewer or worker).
+        """
+        review = self.get(checkpoint_id)
+        if review is None:
+            return None
+        claimed = self._write(
+            [(f"UPDATE {self.table} SET status = 'DECIDED', decision = ?, reviewer_id = ?, decided_at = ? "
+              f"WHERE checkpoint_id = ? AND status = 'PENDING'",
+              (decision, reviewer_id, datetime.datetime.now().isoformat(), checkpoint_id))],
+            "review_decided", checkpoint_id, review["thread_id"]
+        )
+        if not claimed:
+            return None
+        return self.get(checkpoint_id)
+
+    def release(self, checkpoint_id: str) -> None:
+        """Put a claimed review back to PENDING (the resume failed)."""
+        review = self.get(checkpoint_id)
+        if review is None:
+            return
+        self._write(
+            [(f"UPDATE {self.table} SET status = 'PENDING', decision = NULL, reviewer_id = NULL, decided_at = NULL "
+              f"WHERE checkpoint_id = ? AND status = 'DECIDED'", (checkpoint_id,))],
+            "review_added", checkpoint_id, review["thread_id"]
+        )
+
+    def list(
+        self,
+        status: str = "PENDING",
+        vendor_name: Optional[str] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return one page of reviews (most urgent first) and the cursor for the next page."""
+        clauses, params = ["status = ?"], [status]
+        if vendor_name is not None:
+            clauses.append("vendor_name = ?")
+            params.append(vendor_name)
+        if min_amount is not None:
+            clauses.append("amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            clauses.append("amount <= ?")
+            params.append(max_amount)
+        if cursor:
+            priority, created_at, checkpoint_id = decode_cursor(cursor)
+            clauses.append("(priority < ? OR (priority = ? AND (created_at, checkpoint_id) > (?, ?)))")
+            params.extend([priority, priority, created_at, checkpoint_id])
+
+        rows = self._conn().execute(
+            f"SELECT * FROM {self.table} WHERE {' AND '.join(clauses)} "
+            f"ORDER BY priority DESC, created_at, checkpoint_id LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last["priority"], last["created_at"], last["checkpoint_id"])
+        return items, next_cursor
+
+    def events_since(self, event_id: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """Outbox events after `event_id`, each with the review row as of that event."""
+        rows = self._conn().execute(
+            f"SELECT event_id, event_type, checkpoint_id, thread_id, created_at AS event_ts, row_json "
+            f"FROM {self.events_table} WHERE event_id > ? ORDER BY event_id LIMIT ?",
+            (event_id, limit)
+        ).fetchall()
+        events = []
+        for row in rows:
+            event = dict(row)
+            # Events written before row_json existed carry only the ids
+            event.update(json.loads(event.pop("row_json") or "{}"))
+            events.append(event)
+        return events
+
+    def count(self, status: str = "PENDING") -> int:
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table} WHERE status = ?", (status,)).fetchone()[0]
+
+    def has_pending(self, thread_id: str) -> bool:
+        row = self._conn().execute(
+            f"SELECT 1 FROM {self.table} WHERE thread_id = ? AND status = 'PENDING' LIMIT 1", (thread_id,)
+        ).fetchone()
+        return row is not None
+
+    def prune_events(self, before: str) -> int:
+        """Delete outbox events created before the ISO timestamp `before`."""
+        cur = self._conn().execute(f"DELETE FROM {self.events_table} WHERE created_at < ?", (before,))
+        return cur.rowcount
+
+    def last_event_id(self) -> int:
+        row = self._conn().execute(f"SELECT MAX(event_id) FROM {self.events_table}").fetchone()
+        return row[0] or 0
+
+
+def encode_cursor(priority: float, created_at: str, checkpoint_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([priority, created_at, checkpoint_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str, str]:
+    try:
+        priority, created_at, checkpoint_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return priority, created_at, checkpoint_id
+
+
+# Global queue instance (shared by the CHECKPOINT_HITL node and the API)
+review_queue = ReviewQueue(local_db_path(), table=settings.human_review_queue)
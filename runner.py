@@ -0,0 +1,244 @@
+import datetime
+import uuid
+from typing import Any, Dict, Iterator, Optional
+
+from langgraph.errors import InvalidUpdateError
+
+from graph import app
+from state import AgentState
+from review_queue import review_queue
+from blob_store import blob_store, PAYLOAD_HEADER
+from dedup_index import dedup_index
+from resilience import StageFailed
+from scheduling import compute_priority
+from timers import timer_store
+
+# Graph execution shared by the API (inline mode) and the worker processes (queue mode).
+
+
+def new_initial_state(payload: Dict[str, Any]) -> AgentState:
+    thread_id = str(uuid.uuid4())
+    return {
+        "workflow_id": thread_id,
+        "status": "RUNNING",
+        "priority": compute_priority(payload),
+        # Compact state: the raw payload is stored once, the state keeps a reference
+        "invoice_payload": blob_store.ref(payload, thread_id, keep=PAYLOAD_HEADER),
+        "errors": [],
+        "audit_log": []
+    }
+
+
+def update_in_place(config: Dict[str, Any], update: Dict[str, Any]) -> None:
+    """Write to a thread's state without changing which stages run next.
+
+    update_state applies the write as the stage that wrote last, so the pending
+    (failed or not yet run) stages stay pending.
+    """
+    try:
+        app.update_state(config, update)
+    except InvalidUpdateError:
+        # Parallel branches wrote the last step together; either one will do
+        audit_log = app.get_state(config).values.get("audit_log") or []
+        app.update_state(config, update, as_node=audit_log[-1]["stage"])
+
+
+def record_failure(thread_id: str, error: StageFailed) -> None:
+    """Mark the thread FAILED and append the failed attempts to its `errors`.
+    Its invoice leaves the dedup index until the run is retried."""
+    failures = [dict(entry) for entry in error.failures]
+    failures[-1]["final"] = True
+    update_in_place({"configurable": {"thread_id": thread_id}}, {"status": "FAILED", "errors": failures})
+    dedup_index.release(thread_id)
+
+
+def enqueue_review(thread_id: str, values: Dict[str, Any]) -> str:
+    """Push a thread paused at HITL_DECISION onto the review queue; returns its checkpoint_id.
+
+    Runs only once the pause is committed, so a review never points at a checkpoint
+    that was not saved. Keyed on the checkpoint_id CHECKPOINT_HITL recorded: queueing
+    the same pause again (a recovered run) is a no-op.
+    """
+    checkpoint = values["CHECKPOINT_HITL"]
+    payload = values["invoice_payload"]
+    review_queue.add({
+        "checkpoint_id": checkpoint["checkpoint_id"],
+        "thread_id": thread_id,
+        "invoice_id": payload.get("invoice_id"),
+        "vendor_name": payload.get("vendor_name"),
+        "amount": payload.get("amount"),
+        "reason": checkpoint.get("paused_reason"),
+        "review_url": checkpoint.get("review_url"),
+        "priority": values.get("priority")
+    })
+    return checkpoint["checkpoint_id"]
+
+
+def stream_run(graph_input: Any, thread_id: str) -> Iterator[Dict[str, Any]]:
+    """Run a thread until the next interruption or end, yielding each stage's output
+    as its node returns and then the outcome (blocking).
+
+    `updates` reports the interrupt itself and `values` carries the latest state,
+    so no get_state round trip is needed afterwards. A stage that fails all its
+    attempts ends the run with a FAILED outcome; the thread stays at the last good
+    checkpoint for run_retry.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    values: Dict[str, Any] = {}
+    paused = False
+    try:
+        for mode, chunk in app.stream(graph_input, config=config, stream_mode=["updates", "values"]):
+            if mode == "values":
+                values = chunk
+            elif "__interrupt__" in chunk:
+                paused = True
+            else:
+                for stage, update in chunk.items():
+                    yield {"stage": stage, "output": blob_store.expand((update or {}).get(stage, update))}
+    except StageFailed as e:
+        record_failure(thread_id, e)
+        yield {"status": "FAILED", "thread_id": thread_id, "failed_stage": e.stage, "error": str(e)}
+        return
+
+    # (CLARIFY has parked the thread on a timer)
+    if paused and values.get("status") == "WAITING":
+        clarify = values["CLARIFY"]
+        yield {
+            "status": "WAITING", "thread_id": thread_id, "correlation_key": clarify["correlation_key"],
+            "reply_deadline": clarify["reply_deadline"], "message": "Workflow waiting for the vendor's reply."
+        }
+    elif paused and "CHECKPOINT_HITL" in values:
+        checkpoint_id = enqueue_review(thread_id, values)
+        yield {"status": "PAUSED", "thread_id": thread_id, "checkpoint_id": checkpoint_id, "message": "Workflow paused for human review."}
+    elif values.get("status") == "DUPLICATE":
+        yield {"status": "DUPLICATE", "thread_id": thread_id, "duplicate_of": values["INTAKE"]["duplicate_of"]}
+    elif values.get("status") == "INVALID":
+        yield {"status": "INVALID", "thread_id": thread_id, "errors": values["INTAKE"]["validation_errors"]}
+    else:
+        if "COMPLETE" not in values:
+            # Ended at HITL_DECISION without ACCEPT: the invoice was rejected, not posted
+            dedup_index.release(thread_id)
+        yield {"status": "COMPLETED", "thread_id": thread_id, "final_state": blob_store.expand(values)}
+
+
+def run_start(initial_state: AgentState, recover: bool = False) -> Dict[str, Any]:
+    """Run a new workflow until the first interruption or end (blocking).
+
+    With `recover` (a re-run after a crashed attempt), a thread that already has
+    checkpoints continues from the last one instead of starting over.
+    """
+    thread_id = initial_state["workflow_id"]
+    graph_input = initial_state
+    if recover and app.get_state({"configurable": {"thread_id": thread_id}}).values:
+        graph_input = None
+    outcome = None
+    for outcome in stream_run(graph_input, thread_id):
+        pass
+    return outcome
+
+
+def run_resume(review_data: Dict[str, Any], decision: str, reviewer_id: str, recover: bool = False) -> Dict[str, Any]:
+    """Apply a human decision and resume the paused thread (blocking).
+
+    Refused (REFUSED outcome, nothing applied) unless the thread is paused before
+    HITL_DECISION on this review's checkpoint. With `recover` (a re-run after a
+    crashed resume job) a thread that already holds this decision continues its run.
+    """
+    thread_id = review_data["thread_id"]
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = app.get_state(config)
+    on_checkpoint = (snapshot.values.get("CHECKPOINT_HITL") or {}).get("checkpoint_id") == review_data["checkpoint_id"]
+    awaiting = on_checkpoint and "HITL_DECISION" in snapshot.next
+    applied = (snapshot.values.get("HITL_DECISION") or {}).get("human_decision") == decision
+    if not awaiting and not (recover and on_checkpoint and applied):
+        return {
+            "status": "REFUSED", "thread_id": thread_id, "checkpoint_id": review_data["checkpoint_id"],
+            "message": "Thread is not waiting for a decision on this checkpoint."
+        }
+
+    try:
+        if awaiting:
+            app.update_state(config, {"HITL_DECISION": {"human_decision": decision, "reviewer_id": reviewer_id}})
+
+        # Resume
+        # We use None as input to resume from the current state
+        for outcome in stream_run(None, thread_id):
+            pass
+    except Exception:
+        # Hand the review back so the decision can be resubmitted
+        review_queue.release(review_data["checkpoint_id"])
+        raise
+
+    # The decision stands; a failed stage after it is retried with run_retry
+    if outcome["status"] == "FAILED":
+        return outcome
+
+    # CLARIFY parked the thread until the vendor replies or the deadline passes
+    if outcome["status"] == "WAITING":
+        return {**outcome, "next_stage": "CHECKPOINT_HITL"}
+
+    return {"status": "RESUMED", "next_stage": "RECONCILE" if decision == "ACCEPT" else "END"}
+
+
+def run_retry(thread_id: str) -> Dict[str, Any]:
+    """Re-run a FAILED thread from its last good checkpoint: only the stage that
+    failed (and what follows it) runs again (blocking).
+
+    The invoice is registered in the dedup index again first; if a resubmission
+    took it over while the thread was FAILED, the thread ends DUPLICATE instead.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    values = app.get_state(config).values
+    duplicate_of = dedup_index.check_and_register(blob_store.load(values["invoice_payload"]), thread_id)
+    if duplicate_of and duplicate_of["match"] != "possible":
+        update_in_place(config, {"status": "DUPLICATE", "INTAKE": {**values["INTAKE"], "duplicate_of": duplicate_of}})
+        return {"status": "DUPLICATE", "thread_id": thread_id, "duplicate_of": duplicate_of}
+    update_in_place(config, {"status": "RUNNING"})
+    outcome = None
+    for outcome in stream_run(None, thread_id):
+        pass
+    return outcome
+
+
+def run_wake(thread_id: str, reason: str, reply: Optional[Dict[str, Any]] = None, recover: bool = False) -> Dict[str, Any]:
+    """Resume a thread parked by CLARIFY, with the vendor's reply or because its
+    reply deadline passed; it goes back to CHECKPOINT_HITL for review (blocking).
+
+    The caller holds the timer's lease. Only the waker that marks the timer DONE
+    resumes the thread, so a reply racing the deadline wakes it once. With `recover`
+    (a re-run after a crashed wake job) a thread already woken continues its run.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = app.get_state(config)
+    if "CLARIFY" in snapshot.next:
+        # Parked from inside CLARIFY, but its checkpoint is not written yet: the lease lapses and the timer fires again
+        return {"status": "NOT_READY", "thread_id": thread_id}
+    woken = timer_store.complete(thread_id)
+    if not woken and not (recover and "CHECKPOINT_HITL" in snapshot.next):
+        return {"status": "SKIPPED", "thread_id": thread_id}
+
+    if snapshot.values.get("status") == "WAITING":
+        clarify = {
+            **snapshot.values["CLARIFY"],
+            "status": "REPLIED" if reason == "reply" else "TIMED_OUT",
+            "reply": reply,
+            "woken_at": datetime.datetime.now().isoformat()
+        }
+        update_in_place(config, {"status": "RUNNING", "CLARIFY": clarify})
+    outcome = None
+    for outcome in stream_run(None, thread_id):
+        pass
+    return outcome
+
+
+def execute_job(kind: str, payload: Dict[str, Any], recover: bool = False) -> Dict[str, Any]:
+    """Run one start/resume/retry/wake job as described by its (JSON) payload."""
+    if kind == "start":
+        return run_start(payload["initial_state"], recover=recover)
+    if kind == "resume":
+        return run_resume(payload["review"], payload["decision"], payload["reviewer_id"], recover=recover)
+    if kind == "retry":
+        return run_retry(payload["thread_id"])
+    if kind == "wake":
+        return run_wake(payload["thread_id"], payload["reason"], payload.get("reply"), recover=recover)
+    raise ValueError(f"Unknown job kind: {kind}")
@@ -1,9 +1,12 @@
-from typing import TypedDict, List, Dict, Any, Optional
+import operator
+from typing import TypedDict, List, Dict, Any, Optional, Annotated
 
 class AgentState(TypedDict):
     # Workflow Metadata
     workflow_id: str
-    status: str # "RUNNING", "PAUSED", "COMPLETED", "FAILED", "REQUIRES_MANUAL_HANDLING"
+    # Scheduling priority from the payload ({"lane", "score", "reasons"}); orders runs and reviews
+    priority: Dict[str, Any]
+    status: str # "RUNNING", "PAUSED", "WAITING", "COMPLETED", "FAILED", "REQUIRES_MANUAL_HANDLING"
     
     # Input Data
     invoice_payload: Dict[str, Any]
@@ -24,5 +27,7 @@ class AgentState(TypedDict):
     CLARIFY: Optional[Dict[str, Any]]
 
     # Shared Context
-    errors: List[str]
-    audit_log: List[Dict[str, Any]]
+    # One entry per failed stage attempt (stage, attempt, error, at); appended by the retry wrapper
+    errors: Annotated[List[Dict[str, Any]], operator.add]
+    # Appended to by every stage (per-stage timings); parallel branches both write it
+    audit_log: Annotated[List[Dict[str, Any]], operator.add]
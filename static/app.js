@@ -5,13 +5,13 @@ const $ = (s) => document.querySelector(s);
 const $$ = (s) => document.querySelectorAll(s);
 
 // State
-let isPolling = false;
+// Pending reviews keyed by checkpoint_id, kept current by the event stream
+const pendingReviews = new Map();
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
-    // Start Poll
-    setInterval(pollPendingReviews, 3000);
-    pollPendingReviews();
+    // Initial snapshot, then live deltas from the snapshot's position
+    loadPendingReviews().then(subscribeReviewEvents);
 
     // Handle Start Form
     $('#start-form').addEventListener('submit', async (e) => {
@@ -40,7 +40,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 setGlobalStatus(`Workflow Completed!`, "success");
             } else if (data.status === "PAUSED") {
                 setGlobalStatus(`Workflow Paused: ${data.message}`, "warning");
-                pollPendingReviews(); // Refresh immediately
+            } else if (data.status === "DUPLICATE") {
+                setGlobalStatus(`Duplicate of invoice ${data.duplicate_of.invoice_id} (thread ${data.duplicate_of.thread_id})`, "warning");
             } else {
                 setGlobalStatus(`Status: ${data.status}`, "info");
             }
@@ -52,17 +53,51 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 });
 
-// Polling
-async function pollPendingReviews() {
+// Queue sync
+// Resolves to the outbox event id the snapshot was read at (null if it failed)
+async function loadPendingReviews() {
     try {
-        const res = await fetch(`${API_BASE}/human-review/pending`);
-        const data = await res.json();
-        renderQueue(data.items);
+        pendingReviews.clear();
+        let cursor = null;
+        let snapshotEventId = null;
+        do {
+            const params = new URLSearchParams({ limit: 500 });
+            if (cursor) params.set('cursor', cursor);
+            const res = await fetch(`${API_BASE}/human-review/pending?${params}`);
+            const data = await res.json();
+            // The first page's position covers changes made while later pages load
+            if (snapshotEventId === null) snapshotEventId = data.last_event_id;
+            data.items.forEach(item => pendingReviews.set(item.checkpoint_id, item));
+            cursor = data.next_cursor;
+        } while (cursor);
+        renderQueue([...pendingReviews.values()]);
+        return snapshotEventId;
     } catch (err) {
-        console.error("Polling error", err);
+        console.error("Failed to load pending reviews", err);
+        return null;
     }
 }
 
+function subscribeReviewEvents(snapshotEventId) {
+    // Replay from the snapshot; after that EventSource reconnects on its own
+    // and resumes from the Last-Event-ID it saw
+    const params = snapshotEventId != null ? `?last_event_id=${snapshotEventId}` : '';
+    const source = new EventSource(`${API_BASE}/human-review/stream${params}`);
+
+    const upsert = (e) => {
+        const item = JSON.parse(e.data);
+        pendingReviews.set(item.checkpoint_id, item);
+        renderQueue([...pendingReviews.values()]);
+    };
+    source.addEventListener('review_added', upsert);
+    source.addEventListener('review_repaused', upsert);
+    source.addEventListener('review_decided', (e) => {
+        pendingReviews.delete(JSON.parse(e.data).checkpoint_id);
+        renderQueue([...pendingReviews.values()]);
+    });
+    source.onerror = (err) => console.error("Review stream error", err);
+}
+
 // Rendering
 function renderQueue(items) {
     const list = $('#review-list');
@@ -136,8 +171,6 @@ window.submitDecision = async function (decision) {
             setGlobalStatus(`Decision sent. Workflow moved to ${data.next_stage}.`, "warning");
         }
 
-        pollPendingReviews();
-
     } catch (err) {
         alert(`Failed to submit decision: ${err.message}`);
     }
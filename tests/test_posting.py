@@ -0,0 +1,40 @@
+import pytest
+
+import posting
+from resilience import TRANSIENT_ERRORS
+
+
+class PartialERP:
+    """ATLAS stand-in whose batch response only covers the first entry."""
+
+    def call_tool(self, tool_name, arguments, timeout=None, track=None):
+        first = arguments["entries"][0]
+        return {"results": [{"idempotency_key": first["idempotency_key"], "posted": True, "erp_txn_id": "TXN-1"}]}
+
+
+@pytest.fixture
+def erp(monkeypatch, tmp_path):
+    monkeypatch.setattr(posting, "get_mcp_client", lambda server: PartialERP())
+    monkeypatch.setattr(posting, "ledger", posting.PostingLedger(str(tmp_path / "ledger.db")))
+
+
+def test_batch_reports_entries_missing_from_the_response(erp):
+    results = posting._post_batch("", [{"idempotency_key": "post-a"}, {"idempotency_key": "post-b"}])
+
+    assert results[0]["posted"] is True
+    assert results[1]["posted"] is False
+    assert posting.ledger.get("post-a") is not None
+    assert posting.ledger.get("post-b") is None
+
+
+def test_unposted_invoice_raises_a_transient_error(erp, monkeypatch):
+    # The other invoice in the batch gets posted; this one is left out of the response
+    def submit(item, group=""):
+        return posting._post_batch(group, [{"idempotency_key": "post-other"}, item])[1]
+
+    monkeypatch.setattr(posting.posting_batcher, "submit", submit)
+
+    with pytest.raises(posting.PostingFailed) as error:
+        posting.post_invoice("thread-1", {"invoice_id": "INV-1", "amount": 10})
+    assert isinstance(error.value, TRANSIENT_ERRORS)
+    assert posting.ledger.get(posting.idempotency_key("thread-1")) is None
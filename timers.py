@@ -0,0 +1,259 @@
+import asyncio
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import settings
+from db import connect_sqlite, local_db_path
+from metrics import registry
+
+logger = logging.getLogger("Timers")
+
+WAKEUPS = registry.counter("workflow_timer_wakeups_total", "Parked threads woken up, by reason.", ("reason",))
+
+
+class TimerStore:
+    """
+    Durable timers for threads parked outside the graph (CLARIFY waiting on the vendor).
+
+    One row per parked thread: the correlation key the reply will carry and the
+    time to wake it (`wake_at`). A reply sets `wake_at` to now. Due timers are
+    claimed in `wake_at` order from an index, under a lease: a waker that dies
+    before the thread is resumed leaves the lease to lapse, and the timer is
+    claimed again. PARKED -> WAKING (leased) -> DONE.
+    """
+
+    def __init__(self, db_path: str, table: str = "workflow_timers"):
+        self.db_path = db_path
+        self.table = table
+        self._local = threading.local()
+        self._listeners: List[Callable[[], None]] = []
+        t = table
+        self._conn().executescript(f"""
+            CREATE TABLE IF NOT EXISTS {t} (
+                thread_id TEXT PRIMARY KEY,
+                correlation_key TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'PARKED',
+                deadline REAL NOT NULL,
+                wake_at REAL NOT NULL,
+                wake_reason TEXT,
+                reply TEXT,
+                lane TEXT,
+                priority REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_expires_at REAL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{t}_correlation ON {t} (correlation_key);
+            CREATE INDEX IF NOT EXISTS idx_{t}_due ON {t} (status, wake_at);
+            CREATE INDEX IF NOT EXISTS idx_{t}_lease ON {t} (status, lease_expires_at);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        timer = dict(row)
+        timer["reply"] = json.loads(timer["reply"]) if timer["reply"] else None
+        return timer
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Register a callback fired (on the writer's thread) when a timer is parked or replied to."""
+        self._listeners.append(callback)
+
+    def _changed(self) -> None:
+        for callback in self._listeners:
+            callback()
+
+    def park(self, thread_id: str, correlation_key: str, stage: str, deadline: float,
+             priority: Optional[Dict[str, Any]] = None) -> None:
+        """Park a thread until a reply with `correlation_key` arrives or the `deadline` (unix time) passes.
+        A thread has one timer; parking it again (a new CLARIFY round) replaces the old one."""
+        now = datetime.datetime.now().isoformat()
+        priority = priority or {}
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO {self.table} (thread_id, correlation_key, stage, status, deadline, wake_at, "
+            f"lane, priority, created_at, updated_at) VALUES (?, ?, ?, 'PARKED', ?, ?, ?, ?, ?, ?)",
+            (thread_id, correlation_key, stage, deadline, deadline,
+             priority.get("lane"), priority.get("score", 0), now, now)
+        )
+        self._changed()
+
+    def reply(self, correlation_key: str, reply: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Record the reply for a parked timer and make it due now. Returns the timer,
+        or None if no PARKED timer has this key (unknown, or already woken)."""
+        cur = self._conn().execute(
+            f"UPDATE {self.table} SET reply = ?, wake_reason = 'reply', wake_at = ?, updated_at = ? "
+            f"WHERE correlation_key = ? AND status = 'PARKED'",
+            (json.dumps(reply, default=str), time.time(), datetime.datetime.now().isoformat(), correlation_key)
+        )
+        if not cur.rowcount:
+            return None
+        self._changed()
+        return self.get_by_key(correlation_key)
+
+    def claim_due(self, limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        """Lease up to `limit` due timers (PARKED past wake_at, or WAKING with a lapsed lease), earliest first."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT thread_id FROM {self.table} WHERE status = 'WAKING' AND lease_expires_at < ? "
+                f"ORDER BY lease_expires_at LIMIT ?", (now, limit)
+            ).fetchall()
+            rows += conn.execute(
+                f"SELECT thread_id FROM {self.table} WHERE status = 'PARKED' AND wake_at <= ? "
+                f"ORDER BY wake_at LIMIT ?", (now, limit - len(rows))
+            ).fetchall()
+            thread_ids = [row["thread_id"] for row in rows]
+            conn.executemany(
+                f"UPDATE {self.table} SET status = 'WAKING', wake_reason = COALESCE(wake_reason, 'timeout'), "
+                f"attempts = attempts + 1, lease_expires_at = ?, updated_at = ? WHERE thread_id = ?",
+                [(now + lease_seconds, datetime.datetime.now().isoformat(), thread_id) for thread_id in thread_ids]
+            )
+            timers = [
+                self._row(conn.execute(f"SELECT * FROM {self.table} WHERE thread_id = ?", (thread_id,)).fetchone())
+                for thread_id in thread_ids
+            ]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return timers
+
+    def claim(self, thread_id: str, lease_seconds: float) -> bool:
+        """Lease one PARKED timer right away, whatever its wake_at (to wake a thread inline)."""
+        cur = self._conn().execute(
+            f"UPDATE {self.table} SET status = 'WAKING', wake_reason = COALESCE(wake_reason, 'timeout'), "
+            f"attempts = attempts + 1, lease_expires_at = ?, updated_at = ? WHERE thread_id = ? AND status = 'PARKED'",
+            (time.time() + lease_seconds, datetime.datetime.now().isoformat(), thread_id)
+        )
+        return cur.rowcount == 1
+
+    def complete(self, thread_id: str) -> bool:
+        """Mark a claimed timer DONE; False if it is not WAKING (another waker got there first)."""
+        cur = self._conn().execute(
+            f"UPDATE {self.table} SET status = 'DONE', lease_expires_at = NULL, updated_at = ? "
+            f"WHERE thread_id = ? AND status = 'WAKING'",
+            (datetime.datetime.now().isoformat(), thread_id)
+        )
+        return cur.rowcount == 1
+
+    def next_wake_at(self) -> Optional[float]:
+        """Earliest time a timer becomes claimable (both lookups are index seeks)."""
+        conn = self._conn()
+        parked = conn.execute(f"SELECT MIN(wake_at) FROM {self.table} WHERE status = 'PARKED'").fetchone()[0]
+        waking = conn.execute(f"SELECT MIN(lease_expires_at) FROM {self.table} WHERE status = 'WAKING'").fetchone()[0]
+        candidates = [at for at in (parked, waking) if at is not None]
+        return min(candidates) if candidates else None
+
+    def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        return self._row(self._conn().execute(f"SELECT * FROM {self.table} WHERE thread_id = ?", (thread_id,)).fetchone())
+
+    def get_by_key(self, correlation_key: str) -> Optional[Dict[str, Any]]:
+        return self._row(self._conn().execute(
+            f"SELECT * FROM {self.table} WHERE correlation_key = ?", (correlation_key,)
+        ).fetchone())
+
+    def is_parked(self, thread_id: str) -> bool:
+        row = self._conn().execute(
+            f"SELECT 1 FROM {self.table} WHERE thread_id = ? AND status IN ('PARKED', 'WAKING')", (thread_id,)
+        ).fetchone()
+        return row is not None
+
+    def count(self, status: str = "PARKED") -> int:
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table} WHERE status = ?", (status,)).fetchone()[0]
+
+    def prune(self, before: str) -> int:
+        """Delete DONE timers last updated before the ISO timestamp `before`."""
+        cur = self._conn().execute(f"DELETE FROM {self.table} WHERE status = 'DONE' AND updated_at < ?", (before,))
+        return cur.rowcount
+
+
+class TimerScheduler:
+    """
+    Wakes parked threads when their timer is due. A single task sleeps until the
+    earliest `wake_at` (one index lookup, however many threads are parked), then
+    claims due timers in batches and hands each to `wake`. Parks and replies in
+    this process wake it at once; timers written by other processes are picked
+    up within `max_sleep_seconds`.
+    """
+
+    def __init__(self, store: TimerStore, wake: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 batch_size: int = 500, lease_seconds: float = 300.0, max_sleep_seconds: float = 30.0):
+        self.store = store
+        self.wake = wake
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_sleep_seconds = max_sleep_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.woken = 0
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.store.add_listener(self._notify)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _notify(self) -> None:
+        # Called from graph/executor threads
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                due = await asyncio.to_thread(self.store.claim_due, self.batch_size, self.lease_seconds)
+                for timer in due:
+                    try:
+                        await self.wake(timer)
+                        self.woken += 1
+                        WAKEUPS.inc(reason=timer["wake_reason"])
+                    except Exception:
+                        # The lease lapses and the timer is claimed again
+                        logger.exception(f"[Timers] Failed to wake thread {timer['thread_id']}")
+                if len(due) == self.batch_size:
+                    continue
+                next_at = await asyncio.to_thread(self.store.next_wake_at)
+            except Exception:
+                logger.exception("[Timers] Timer sweep failed")
+                next_at = None
+            sleep = self.max_sleep_seconds if next_at is None else min(self.max_sleep_seconds, max(0.0, next_at - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        next_at = self.store.next_wake_at()
+        return {
+            "parked": self.store.count("PARKED"),
+            "waking": self.store.count("WAKING"),
+            "woken": self.woken,
+            "next_wake_in_s": round(max(0.0, next_at - time.time()), 3) if next_at is not None else None
+        }
+
+
+timer_store = TimerStore(local_db_path())
@@ -0,0 +1,152 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import settings
+from db import connect_sqlite
+
+class CachePolicy:
+    """How results of one tool are cached: key arguments, TTL, size and tiering."""
+
+    def __init__(self, key_args, ttl_seconds: float, max_entries: int, persist: bool = False, case_insensitive: bool = False):
+        self.key_args = list(key_args)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.persist = persist
+        self.case_insensitive = case_insensitive
+
+    def key(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        parts = []
+        for arg in self.key_args:
+            value = arguments.get(arg)
+            if value is None:
+                # Without the key argument the call is not cacheable
+                return None
+            if self.case_insensitive and isinstance(value, str):
+                value = " ".join(value.split()).casefold()
+            parts.append(value)
+        return f"{server_name}:{tool_name}:{json.dumps(parts, sort_keys=True, default=str)}"
+
+
+class ToolCache:
+    """
+    Read-through cache in front of MCPClient.call_tool.
+    Memory tier: one LRU (OrderedDict) per tool with TTL. Optional disk tier
+    (SQLite) for tools whose policy sets `persist`, so warm entries survive restarts.
+    """
+
+    def __init__(self, policies: Dict[str, CachePolicy], disk_path: Optional[str] = None):
+        self.policies = policies
+        self.disk_path = disk_path
+        self._entries: Dict[str, "OrderedDict[str, tuple]"] = {tool: OrderedDict() for tool in policies}
+        self._stats: Dict[str, Dict[str, int]] = {
+            tool: {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0} for tool in policies
+        }
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disk_writes = 0
+        if disk_path and any(policy.persist for policy in policies.values()):
+            self._disk().execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ToolCache":
+        policies = {
+            tool: CachePolicy(
+                policy["key_args"], policy.get("ttl_seconds", 3600), policy.get("max_entries", 10000),
+                persist=policy.get("persist", False), case_insensitive=policy.get("case_insensitive", False)
+            )
+            for tool, policy in config.get("policies", {}).items()
+        }
+        return cls(policies, config.get("disk_path"))
+
+    def _disk(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.disk_path, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def key(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Optional[str]:
+        policy = self.policies.get(tool_name)
+        return policy.key(server_name, tool_name, arguments) if policy else None
+
+    def get(self, tool_name: str, key: str) -> Optional[Dict[str, Any]]:
+        policy = self.policies[tool_name]
+        now = time.time()
+        with self._lock:
+            entries, stats = self._entries[tool_name], self._stats[tool_name]
+            entry = entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    entries.move_to_end(key)
+                    stats["hits"] += 1
+                    return copy.deepcopy(value)
+                del entries[key]
+                stats["expired"] += 1
+
+        if policy.persist and self.disk_path:
+            row = self._disk().execute(
+                "SELECT value, expires_at FROM tool_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row:
+                value = json.loads(row[0])
+                with self._lock:
+                    self._stats[tool_name]["disk_hits"] += 1
+                    self._store(tool_name, key, value, row[1])
+                return copy.deepcopy(value)
+
+        with self._lock:
+            self._stats[tool_name]["misses"] += 1
+        return None
+
+    def _store(self, tool_name: str, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        # Caller holds self._lock
+        entries = self._entries[tool_name]
+        entries[key] = (expires_at, value)
+        entries.move_to_end(key)
+        while len(entries) > self.policies[tool_name].max_entries:
+            entries.popitem(last=False)
+            self._stats[tool_name]["evictions"] += 1
+
+    def set(self, tool_name: str, key: str, value: Dict[str, Any]) -> None:
+        policy = self.policies[tool_name]
+        expires_at = time.time() + policy.ttl_seconds
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(tool_name, key, value, expires_at)
+        if policy.persist and self.disk_path:
+            self._disk().execute(
+                "INSERT OR REPLACE INTO tool_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            self._disk_writes += 1
+            if self._disk_writes % 1000 == 0:
+                self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """Drop expired rows from the disk tier."""
+        if not self.disk_path:
+            return 0
+        return self._disk().execute("DELETE FROM tool_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            report = {}
+            for tool, stats in self._stats.items():
+                lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+                report[tool] = {
+                    **stats,
+                    "entries": len(self._entries[tool]),
+                    "hit_ratio": round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+                }
+            return report
+
+
+# Global cache instance (used by MCPClient)
+tool_cache = ToolCache.from_config(settings.tool_cache)
@@ -0,0 +1,147 @@
+import functools
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from blob_store import BLOB_REF
+from config import settings
+from metrics import registry
+
+logger = logging.getLogger("Validation")
+
+VALIDATION_FAILURES = registry.counter(
+    "invoice_validation_failures_total", "Payloads and stage outputs that failed schema validation.", ("schema",)
+)
+
+# A check appends "<path>: <problem>" messages to the list it is given
+Check = Callable[[Any, str, List[str]], None]
+
+_TYPES = {
+    # bool is an int subclass; it is not a number here
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "string": lambda v: isinstance(v, str),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, (list, tuple)),
+    "object": lambda v: isinstance(v, dict),
+}
+
+
+class SchemaError(ValueError):
+    """A stage returned output that does not match its output_schema in workflow.json."""
+
+    def __init__(self, schema: str, errors: List[str]):
+        super().__init__(f"{schema} output does not match its schema: {'; '.join(errors)}")
+        self.schema = schema
+        self.errors = errors
+
+
+def compile_schema(schema: Any, required: Optional[List[str]] = None) -> Check:
+    """
+    Turn a workflow.json schema into a check function, once. The schema language:
+    a type name ("string", "number", "boolean", "array", "object"), a dict of field
+    schemas, or a one-element list (an array whose items all match that element).
+    Fields are optional (absent or null is fine) unless listed in `required`; extra
+    fields are allowed. Compacted values (blob references) pass any schema.
+    """
+    if isinstance(schema, str):
+        if schema not in _TYPES:
+            raise ValueError(f"Unknown schema type: {schema}")
+        is_type = _TYPES[schema]
+
+        def _check_type(value, path, errors):
+            if not is_type(value) and not (isinstance(value, dict) and BLOB_REF in value):
+                errors.append(f"{path}: expected {schema}, got {type(value).__name__}")
+        return _check_type
+
+    if isinstance(schema, list):
+        check_item = compile_schema(schema[0]) if schema else None
+
+        def _check_array(value, path, errors):
+            if isinstance(value, dict) and BLOB_REF in value:
+                return
+            if not isinstance(value, (list, tuple)):
+                errors.append(f"{path}: expected array, got {type(value).__name__}")
+                return
+            if check_item is not None:
+                for i, item in enumerate(value):
+                    if item is None:
+                        errors.append(f"{path}[{i}]: expected a value, got null")
+                    else:
+                        check_item(item, f"{path}[{i}]", errors)
+        return _check_array
+
+    if isinstance(schema, dict):
+        fields = [(name, compile_schema(field)) for name, field in schema.items()]
+        required = list(required or [])
+
+        def _check_object(value, path, errors):
+            if isinstance(value, dict) and BLOB_REF in value and len(value) == 1:
+                return
+            if not isinstance(value, dict):
+                errors.append(f"{path}: expected object, got {type(value).__name__}")
+                return
+            for name in required:
+                if value.get(name) is None:
+                    errors.append(f"{path}.{name}: required")
+            for name, check in fields:
+                field_value = value.get(name)
+                if field_value is not None:
+                    check(field_value, f"{path}.{name}", errors)
+        return _check_object
+
+    raise ValueError(f"Unsupported schema: {schema!r}")
+
+
+class Validators:
+    """Checks compiled at startup from workflow.json: `inputs.invoice_payload` and every stage's `output_schema`."""
+
+    def __init__(self, options: Dict[str, Any]):
+        self.enforce_outputs = options.get("stage_outputs", "enforce")
+        self.invoice = compile_schema(
+            settings.inputs.get("invoice_payload", {}), required=options.get("required_inputs", [])
+        )
+        self.outputs: Dict[str, Check] = {}
+        for stage in settings.stages:
+            if stage.get("output_schema"):
+                self.outputs[stage["id"]] = compile_schema(stage["output_schema"])
+
+    def invoice_errors(self, payload: Any) -> List[str]:
+        """Schema problems with an invoice payload ([] when it is valid)."""
+        errors: List[str] = []
+        self.invoice(payload, "invoice", errors)
+        if errors:
+            VALIDATION_FAILURES.inc(schema="invoice_payload")
+        return errors
+
+    def output_errors(self, stage: str, output: Any) -> List[str]:
+        check = self.outputs.get(stage)
+        if check is None or self.enforce_outputs == "off":
+            return []
+        errors: List[str] = []
+        check(output, stage, errors)
+        if errors:
+            VALIDATION_FAILURES.inc(schema=stage)
+        return errors
+
+
+validators = Validators(settings.validation)
+
+
+def validate_output(stage: str, fn: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Wrap a graph node so its stage output is checked against the stage's output_schema.
+
+    A mismatch raises SchemaError (not retried: the same input gives the same output),
+    so bad data stops at the stage that produced it. With `stage_outputs: "warn"` it
+    is only logged.
+    """
+    @functools.wraps(fn)
+    def _node(state):
+        update = fn(state)
+        if update and stage in update:
+            errors = validators.output_errors(stage, update[stage])
+            if errors and validators.enforce_outputs == "enforce":
+                raise SchemaError(stage, errors)
+            if errors:
+                logger.warning(f"[{stage}] Output does not match its schema: {errors}")
+        return update
+
+    return _node
@@ -0,0 +1,126 @@
+"""
+Workflow worker: claims start/resume/retry/wake jobs from the durable job queue and runs them
+against the shared checkpointer. Run one or more processes next to the API (with
+`execution.mode = "queue"` in workflow.json):
+
+    python worker.py --processes 4 --concurrency 8
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from config import settings
+
+logger = logging.getLogger("Worker")
+
+
+class Worker:
+    """
+    One worker process: up to `concurrency` jobs run at once on a thread pool.
+    A heartbeat thread renews the leases of running jobs; if this process dies,
+    the leases lapse and another worker picks the jobs up again.
+    """
+
+    def __init__(self, queue, worker_id: str, concurrency: int = 8, lease_seconds: float = 60, poll_interval: float = 0.2):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._running: Dict[int, Dict[str, Any]] = {}
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _process(self, job: Dict[str, Any]) -> None:
+        # Imported here so the parent supervisor process never builds the graph
+        from runner import execute_job
+
+        try:
+            # A job on its second attempt was interrupted mid-run: continue from the checkpoint
+            result = execute_job(job["kind"], job["payload"], recover=job["attempts"] > 1)
+            self.queue.complete(job["job_id"], self.worker_id, result)
+        except Exception as e:
+            logger.exception(f"[{self.worker_id}] Job {job['job_id']} ({job['kind']}) failed")
+            # A failed resume already handed its review back; the reviewer resubmits instead
+            self.queue.fail(job["job_id"], self.worker_id, str(e), retry=job["kind"] == "start")
+        finally:
+            with self._lock:
+                self._running.pop(job["job_id"], None)
+            self._slots.release()
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                job_ids = list(self._running)
+            for job_id in job_ids:
+                if not self.queue.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                    logger.warning(f"[{self.worker_id}] Lost the lease on job {job_id}")
+
+    def run(self) -> None:
+        logger.info(f"[{self.worker_id}] Started with concurrency {self.concurrency}")
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job") as pool:
+            while not self._stop.is_set():
+                if not self._slots.acquire(timeout=self.poll_interval):
+                    continue
+                job = self.queue.claim(self.worker_id, self.lease_seconds)
+                if job is None:
+                    self._slots.release()
+                    self._stop.wait(self.poll_interval)
+                    continue
+                with self._lock:
+                    self._running[job["job_id"]] = job
+                pool.submit(self._process, job)
+        logger.info(f"[{self.worker_id}] Stopped")
+
+
+def run_worker(concurrency: int) -> None:
+    logging.basicConfig(level=logging.INFO)
+    from job_queue import job_queue
+
+    options = settings.execution
+    worker = Worker(
+        job_queue,
+        worker_id=f"{socket.gethostname()}-{os.getpid()}",
+        concurrency=concurrency,
+        lease_seconds=options.get("lease_seconds", 60),
+        poll_interval=options.get("poll_interval_ms", 50) / 1000
+    )
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Invoice workflow worker")
+    parser.add_argument("--processes", type=int, default=settings.execution.get("worker_processes", 1))
+    parser.add_argument("--concurrency", type=int, default=settings.execution.get("worker_concurrency", 8))
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker(args.concurrency)
+    else:
+        # Spawned (not forked) so every process opens its own SQLite connections
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=run_worker, args=(args.concurrency,)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+
+        def _shutdown(*_):
+            for process in processes:
+                process.terminate()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # children get the Ctrl-C themselves
+        for process in processes:
+            process.join()